@@ -0,0 +1,221 @@
+"""run benchmarks of birdsongrec functions on synthetic data,
+and save time and peak memory of each to a .json file
+
+Examples
+--------
+run benchmarks at small and medium scales, and save results::
+
+    $ python benchmarks/run_benchmarks.py --scales small medium --output results.json
+
+compare with results from an earlier run::
+
+    $ python benchmarks/run_benchmarks.py --output new.json --compare results.json
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import birdsongrec
+from birdsongrec.birdsongrec import determine_unique_labels
+
+from synthetic import make_annotation_xml, make_labels, make_observation_probs
+
+
+SCALES = {
+    'small': dict(num_songs=20, syls_per_song=60, num_labels=8, num_seqs=10, num_frames=200),
+    'medium': dict(num_songs=200, syls_per_song=150, num_labels=12, num_seqs=50, num_frames=500),
+    'large': dict(num_songs=2000, syls_per_song=300, num_labels=20, num_seqs=200,
+                  num_frames=1000),
+}
+
+# these are too slow to run at larger scales
+SLOW = {'Resequencer.resequence[reference]': 'small'}
+
+
+def measure(func, repeat):
+    """time func repeat times, then measure its peak memory with tracemalloc,
+    in a separate call so tracing does not slow down timing"""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return times, peak
+
+
+def make_benchmarks(data_dir, scale):
+    """make synthetic data for one scale, and return dict that maps
+    benchmark names to functions that take no arguments"""
+    params = SCALES[scale]
+    xml_file = os.path.join(data_dir, scale, 'Annotation.xml')
+    make_annotation_xml(xml_file, params['num_songs'], params['syls_per_song'],
+                        params['num_labels'])
+    seq_list = birdsongrec.parse_xml(xml_file)
+    annot = birdsongrec.AnnotationTable.from_xml(xml_file)
+    songs = birdsongrec.parse_xml(xml_file, concat_seqs_into_songs=True)
+    wav_files = annot.wav_files.tolist()
+    labels = make_labels(params['num_labels'])
+    trans_mat = birdsongrec.get_trans_mat(seq_list)
+    resequencer = birdsongrec.Resequencer(trans_mat, labels)
+    sparse_resequencer = birdsongrec.Resequencer(
+        birdsongrec.get_trans_mat(seq_list, sparse=True), labels
+    )
+    observation_probs = make_observation_probs(params['num_seqs'], params['num_frames'],
+                                               params['num_labels'])
+    rng = np.random.default_rng(0)
+    # frame labels, and the same labels with 10% of frames changed
+    ref_frames = [np.argmax(obs, axis=1) for obs in observation_probs]
+    hyp_frames = [np.where(rng.random(frames.shape[0]) < 0.1,
+                           rng.integers(params['num_labels'], size=frames.shape[0]), frames)
+                  for frames in ref_frames]
+    audio_list = [rng.standard_normal(params['num_frames'] * 256).astype(np.float32)
+                  for _ in range(params['num_seqs'])]
+
+    return {
+        'parse_xml': lambda: birdsongrec.parse_xml(xml_file),
+        'parse_xml[concat_seqs_into_songs]':
+            lambda: birdsongrec.parse_xml(xml_file, concat_seqs_into_songs=True),
+        'iter_xml': lambda: sum(1 for _ in birdsongrec.iter_xml(xml_file)),
+        'AnnotationTable.from_xml': lambda: birdsongrec.AnnotationTable.from_xml(xml_file),
+        'AnnotationTable.to_seqs': lambda: annot.to_seqs(),
+        'determine_unique_labels': lambda: determine_unique_labels(xml_file),
+        'load_song_annot': lambda: [birdsongrec.load_song_annot(wav_file, xml_file)
+                                    for wav_file in wav_files[:10]],
+        'get_trans_mat': lambda: birdsongrec.get_trans_mat(seq_list),
+        'get_trans_mat[AnnotationTable]': lambda: birdsongrec.get_trans_mat(annot),
+        'get_trans_mat[sparse]': lambda: birdsongrec.get_trans_mat(seq_list, sparse=True),
+        'TransitionCounts.from_seqs': lambda: birdsongrec.TransitionCounts.from_seqs(seq_list),
+        'frame_labels': lambda: birdsongrec.frame_labels(songs),
+        'spectrograms': lambda: birdsongrec.spectrograms(audio_list),
+        'Resequencer': lambda: birdsongrec.Resequencer(trans_mat, labels),
+        'Resequencer.resequence': lambda: [resequencer.resequence(obs)
+                                           for obs in observation_probs],
+        'Resequencer.resequence[reference]':
+            lambda: [resequencer.resequence(obs, engine='reference')
+                     for obs in observation_probs],
+        'Resequencer.resequence_batch': lambda: resequencer.resequence_batch(observation_probs),
+        'evaluate_songs': lambda: birdsongrec.evaluate_songs(hyp_frames, ref_frames,
+                                                             background=0),
+        'Resequencer.resequence_batch[sparse]':
+            lambda: sparse_resequencer.resequence_batch(observation_probs),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales, repeat, select=None, backend=None):
+    backend = birdsongrec.set_backend(backend)
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        for scale in scales:
+            benchmarks = make_benchmarks(data_dir, scale)
+            for name, func in benchmarks.items():
+                if select and not any(pattern in name for pattern in select):
+                    continue
+                if name in SLOW and list(SCALES).index(scale) > list(SCALES).index(SLOW[name]):
+                    continue
+                # clear caches, so every benchmark runs from a cold start
+                birdsongrec.birdsongrec._cached_annotation_index.cache_clear()
+                times, peak = measure(func, repeat)
+                result = {
+                    'benchmark': name,
+                    'scale': scale,
+                    'params': SCALES[scale],
+                    'times_s': times,
+                    'min_s': min(times),
+                    'median_s': float(np.median(times)),
+                    'peak_memory_bytes': peak,
+                }
+                print(f'{scale:>8} {name:<40} median {result["median_s"]:10.4f} s   '
+                      f'peak {peak / 2 ** 20:10.2f} MiB', flush=True)
+                results.append(result)
+    return {
+        'metadata': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'git_commit': git_commit(),
+            'birdsongrec_version': birdsongrec.__version__,
+            'python_version': platform.python_version(),
+            'numpy_version': np.__version__,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'backend': backend.name,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """print ratio of median times to a baseline, and return
+    number of benchmarks that are slower by more than threshold"""
+    baseline = {(result['benchmark'], result['scale']): result
+                for result in baseline['results']}
+    num_slower = 0
+    for result in results['results']:
+        key = (result['benchmark'], result['scale'])
+        if key not in baseline:
+            continue
+        time_ratio = result['median_s'] / baseline[key]['median_s']
+        memory_ratio = (result['peak_memory_bytes'] / baseline[key]['peak_memory_bytes']
+                        if baseline[key]['peak_memory_bytes'] else float('nan'))
+        slower = time_ratio > 1 + threshold
+        num_slower += slower
+        print(f'{result["scale"]:>8} {result["benchmark"]:<40} time x{time_ratio:6.2f}   '
+              f'memory x{memory_ratio:6.2f}{"   SLOWER" if slower else ""}')
+    return num_slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small', 'medium'],
+                        help='scales of synthetic data to run benchmarks on')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times to run each benchmark')
+    parser.add_argument('--select', nargs='+',
+                        help='only run benchmarks whose names contain one of these strings')
+    parser.add_argument('--backend',
+                        help="backend to use, e.g. 'numpy' or 'numba'. "
+                             "Default is to use 'numba' if it is installed")
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='path to .json file to save results in')
+    parser.add_argument('--compare',
+                        help='path to .json file with results from an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fraction slower than the earlier run that counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.scales, args.repeat, args.select, args.backend)
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=2)
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        num_slower = compare(results, baseline, args.threshold)
+        return 1 if num_slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""generate synthetic data for benchmarks:
+Annotation.xml files that follow doc/xsd/AnnotationSchema.xsd,
+and observation probabilities for Resequencer"""
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+
+def make_labels(num_labels):
+    """make a set of num_labels labels, as strings.
+    Labels are digits as in the dataset, e.g. '0', '1', ..."""
+    return [str(label) for label in range(num_labels)]
+
+
+def make_label_seqs(num_seqs, syls_per_seq, num_labels, seed=0):
+    """make sequences of label codes from a random second-order Markov chain,
+    so that transition matrices are not uniform, as for real song
+
+    Parameters
+    ----------
+    num_seqs : int
+        number of sequences
+    syls_per_seq : int
+        mean number of syllables per sequence. The number of syllables in
+        each sequence is drawn from a Poisson distribution, with a minimum of 1.
+    num_labels : int
+        size of label inventory
+    seed : int
+        for random number generator. Default is 0.
+
+    Returns
+    -------
+    label_seqs : list
+        of 1-d arrays of ints, label codes of syllables in each sequence
+    """
+    rng = np.random.default_rng(seed)
+    # sparse transitions: each pair of labels is followed by a few likely labels
+    trans_probs = rng.dirichlet(np.full((num_labels,), 0.2), size=(num_labels, num_labels))
+    trans_cdf = np.cumsum(trans_probs, axis=2)
+    seq_lengths = np.maximum(rng.poisson(syls_per_seq, size=num_seqs), 1)
+    label_seqs = []
+    for seq_length in seq_lengths.tolist():
+        codes = np.empty((seq_length,), dtype=np.int64)
+        codes[:2] = rng.integers(num_labels, size=min(seq_length, 2))
+        draws = rng.random(seq_length)
+        for ind in range(2, seq_length):
+            codes[ind] = min(np.searchsorted(trans_cdf[codes[ind - 2], codes[ind - 1]],
+                                             draws[ind]), num_labels - 1)
+        label_seqs.append(codes)
+    return label_seqs
+
+
+def make_annotation_xml(xml_file, num_songs, syls_per_song, num_labels, seqs_per_song=3,
+                        samplerate=32000, seed=0):
+    """write a synthetic Annotation.xml file that follows doc/xsd/AnnotationSchema.xsd
+
+    Parameters
+    ----------
+    xml_file : str
+        path to write file to
+    num_songs : int
+        number of songs, i.e. .wav files
+    syls_per_song : int
+        mean number of syllables per song
+    num_labels : int
+        size of label inventory
+    seqs_per_song : int
+        number of sequences each song is split into. Default is 3.
+    samplerate : int
+        used to make positions and lengths realistic. Default is 32000.
+    seed : int
+        for random number generator. Default is 0.
+
+    Returns
+    -------
+    num_seqs : int
+        number of Sequence elements written
+    num_syls : int
+        number of Note elements written
+    """
+    rng = np.random.default_rng(seed)
+    syls_per_seq = max(syls_per_song // seqs_per_song, 1)
+    label_seqs = make_label_seqs(num_songs * seqs_per_song, syls_per_seq, num_labels, seed=seed)
+    labels = make_labels(num_labels)
+
+    root = ET.Element('Sequences')
+    ET.SubElement(root, 'NumSequence').text = str(len(label_seqs))
+    num_syls = 0
+    for song_ind in range(num_songs):
+        seq_position = samplerate  # one second of silence at start of song
+        for label_codes in label_seqs[song_ind * seqs_per_song:(song_ind + 1) * seqs_per_song]:
+            # syllables of ~50-100 ms with gaps of ~20-60 ms, as in Bengalese finch song
+            syl_lengths = rng.integers(samplerate // 20, samplerate // 10, size=label_codes.shape[0])
+            gaps = rng.integers(samplerate // 50, samplerate * 3 // 50, size=label_codes.shape[0])
+            syl_positions = np.cumsum(gaps) + np.concatenate(([0], np.cumsum(syl_lengths)[:-1]))
+            seq_length = int(syl_positions[-1] + syl_lengths[-1] + gaps[0])
+
+            seq = ET.SubElement(root, 'Sequence')
+            ET.SubElement(seq, 'WaveFileName').text = f'{song_ind}.wav'
+            ET.SubElement(seq, 'Position').text = str(seq_position)
+            ET.SubElement(seq, 'Length').text = str(seq_length)
+            ET.SubElement(seq, 'NumNote').text = str(label_codes.shape[0])
+            for position, length, code in zip(syl_positions.tolist(), syl_lengths.tolist(),
+                                               label_codes.tolist()):
+                note = ET.SubElement(seq, 'Note')
+                ET.SubElement(note, 'Position').text = str(position)
+                ET.SubElement(note, 'Length').text = str(length)
+                ET.SubElement(note, 'Label').text = labels[code]
+            num_syls += label_codes.shape[0]
+            # gap of 0.5-2 seconds between sequences
+            seq_position += seq_length + int(rng.integers(samplerate // 2, samplerate * 2))
+
+    os.makedirs(os.path.dirname(os.path.abspath(xml_file)), exist_ok=True)
+    ET.ElementTree(root).write(xml_file, encoding='UTF-8', xml_declaration=True)
+    return len(label_seqs), num_syls
+
+
+def make_observation_probs(num_seqs, num_frames, num_labels, accuracy=0.8, seed=0):
+    """make synthetic observation probabilities, like the softmax outputs
+    of a network that labels each time step
+
+    Parameters
+    ----------
+    num_seqs : int
+        number of sequences
+    num_frames : int
+        mean number of time steps per sequence. The number in each sequence
+        is drawn uniformly from num_frames // 2 to num_frames * 3 // 2.
+    num_labels : int
+        size of label inventory
+    accuracy : float
+        probability that the label with the highest probability at each time step
+        is the true label. Default is 0.8.
+    seed : int
+        for random number generator. Default is 0.
+
+    Returns
+    -------
+    observation_probs : list
+        of 2-d arrays, each num_frames_i x num_labels, whose rows sum to 1
+    """
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(max(num_frames // 2, 1), num_frames * 3 // 2 + 1, size=num_seqs)
+    label_seqs = make_label_seqs(num_seqs, max(num_frames // 10, 1), num_labels, seed=seed)
+    observation_probs = []
+    for length, label_codes in zip(lengths.tolist(), label_seqs):
+        # each syllable lasts several time steps
+        true_codes = np.repeat(label_codes, -(-length // label_codes.shape[0]))[:length]
+        wrong = rng.random(length) > accuracy
+        true_codes[wrong] = rng.integers(num_labels, size=int(wrong.sum()))
+        logits = rng.standard_normal((length, num_labels))
+        logits[np.arange(length), true_codes] += 4.
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+        observation_probs.append(probs / probs.sum(axis=1, keepdims=True))
+    return observation_probs
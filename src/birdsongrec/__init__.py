@@ -10,7 +10,18 @@ from .__about__ import (
     __version__,
 )
 
-from .birdsongrec import parse_xml, load_song_annot, get_trans_mat
-from .birdsongrec import Syllable, Sequence
-from .birdsongrec import Resequencer
+from .birdsongrec import parse_xml, iter_xml, load_song_annot, get_trans_mat, TransitionCounts
+from .birdsongrec import SparseTransitionMatrix
+from .birdsongrec import Syllable, Sequence, AnnotationTable, AnnotationCache
+from .birdsongrec import Song, SongIndex
+from .birdsongrec import AnnotationIndex, get_annotation_index
+from .birdsongrec import DatasetCatalog, load_dataset
+from .birdsongrec import WavFile, open_wav, AudioReader
+from .birdsongrec import spectrogram, spectrograms, SpectrogramCache
+from .birdsongrec import num_frames, frame_labels, iter_frame_labels
+from .birdsongrec import Resequencer, StreamingResequencer, resequence_parallel
+from .birdsongrec import NumpyBackend, NumbaBackend, register_backend, set_backend, get_backend
+from .birdsongrec import segment_observations
+from .birdsongrec import edit_distance, evaluate_songs
+from .birdsongrec import Stats, enable_stats, disable_stats, get_stats, collect_stats
 
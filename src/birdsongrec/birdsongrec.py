@@ -21,11 +21,215 @@ doi:10.1371/journal.pone.0159188
 """
 import os
 import glob
+import hashlib
+import json
+import operator
+import shutil
+import struct
+import tempfile
+import time
 import xml.etree.ElementTree as ET
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 
 import numpy as np
 
 
+class Stats:
+    """Timers, counters, and peak array sizes, collected by functions in this module
+    while stats are enabled with enable_stats or collect_stats.
+
+    Stages are named after the function that runs them, e.g. 'parse_xml',
+    and parts of a stage have names that start with the name of the stage,
+    e.g. 'parse_xml.read_xml'.
+
+    Attributes
+    ----------
+    seconds : dict
+        total time spent in each stage, including time in stages nested in it
+    self_seconds : dict
+        time spent in each stage, excluding time in stages nested in it
+    calls : dict
+        number of times each stage was run
+    counters : dict
+        counts of items processed, e.g. 'sequences_parsed', 'syllables_parsed',
+        'frames_decoded', 'states_expanded'
+    peak_bytes : dict
+        size in bytes of the largest array of each kind made so far, e.g. 'Resequencer.backpointers'
+    callbacks : list
+        functions called with the name of a stage and the seconds it took,
+        each time a stage ends. Use to export times to a metrics system.
+
+    Examples
+    --------
+    >>> with collect_stats() as stats:
+    ...     seq_list = parse_xml('./Bird0/Annotation.xml', concat_seqs_into_songs=True)
+    >>> stats.counters['sequences_parsed']
+    571
+    >>> stats.self_seconds['parse_xml.concat_seqs_into_songs']  # doctest: +SKIP
+    0.0062
+    """
+    def __init__(self):
+        self.seconds = {}
+        self.self_seconds = {}
+        self.calls = {}
+        self.counters = {}
+        self.peak_bytes = {}
+        self.callbacks = []
+        # [name, start time, seconds in nested stages] of stages being run
+        self._stack = []
+
+    def __repr__(self):
+        return "Stats with {} stages and {} counters".format(len(self.seconds),
+                                                             len(self.counters))
+
+    def add_callback(self, callback):
+        """add a function that is called as callback(stage, seconds) each time a stage ends"""
+        self.callbacks.append(callback)
+
+    def stage(self, name):
+        """context manager that times a stage"""
+        return _StageTimer(self, name)
+
+    def iter_stage(self, name, iterable):
+        """iterate over iterable, timing each step as a stage,
+        e.g. to time the part of a pipeline of generators that iterable runs"""
+        iterator = iter(iterable)
+        while True:
+            with _StageTimer(self, name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, num=1):
+        """add num to a counter"""
+        self.counters[name] = self.counters.get(name, 0) + int(num)
+
+    def peak(self, name, nbytes):
+        """record size of an array, or a number of bytes,
+        if it is larger than the largest recorded so far"""
+        nbytes = getattr(nbytes, 'nbytes', nbytes)
+        if nbytes > self.peak_bytes.get(name, 0):
+            self.peak_bytes[name] = int(nbytes)
+
+    def reset(self):
+        """remove all timers, counters, and peak sizes. Callbacks are kept."""
+        self.seconds.clear()
+        self.self_seconds.clear()
+        self.calls.clear()
+        self.counters.clear()
+        self.peak_bytes.clear()
+
+    def to_dict(self):
+        """get timers, counters, and peak sizes as a dict,
+        e.g. to save as .json or export to a metrics system"""
+        return {
+            'seconds': dict(self.seconds),
+            'self_seconds': dict(self.self_seconds),
+            'calls': dict(self.calls),
+            'counters': dict(self.counters),
+            'peak_bytes': dict(self.peak_bytes),
+        }
+
+
+class _StageTimer:
+    __slots__ = ('stats', 'name')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.stats._stack.append([self.name, time.perf_counter(), 0.])
+
+    def __exit__(self, *exc_info):
+        stats = self.stats
+        name, start, nested = stats._stack.pop()
+        elapsed = time.perf_counter() - start
+        if stats._stack:
+            stats._stack[-1][2] += elapsed
+        stats.seconds[name] = stats.seconds.get(name, 0.) + elapsed
+        stats.self_seconds[name] = stats.self_seconds.get(name, 0.) + elapsed - nested
+        stats.calls[name] = stats.calls.get(name, 0) + 1
+        for callback in stats.callbacks:
+            callback(name, elapsed)
+
+
+class _NoStage:
+    """stage used while stats are disabled, that does nothing"""
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_STAGE = _NoStage()
+# Stats being collected, or None if disabled
+_stats = None
+
+
+def _stage(name):
+    """time a stage if stats are enabled"""
+    if _stats is None:
+        return _NO_STAGE
+    return _stats.stage(name)
+
+
+def enable_stats(stats=None):
+    """start collecting Stats from functions in this module
+
+    Parameters
+    ----------
+    stats : Stats
+        to add to. Default is None, in which case a new Stats is made.
+
+    Returns
+    -------
+    stats : Stats
+    """
+    global _stats
+    _stats = Stats() if stats is None else stats
+    return _stats
+
+
+def disable_stats():
+    """stop collecting Stats, and return the Stats that were being collected, if any"""
+    global _stats
+    stats, _stats = _stats, None
+    return stats
+
+
+def get_stats():
+    """get the Stats being collected, or None if stats are disabled"""
+    return _stats
+
+
+@contextmanager
+def collect_stats(stats=None):
+    """context manager that collects Stats within a block,
+    then restores whatever Stats were being collected before the block
+
+    Parameters
+    ----------
+    stats : Stats
+        to add to. Default is None, in which case a new Stats is made.
+    """
+    global _stats
+    previous = _stats
+    stats = enable_stats(stats)
+    try:
+        yield stats
+    finally:
+        _stats = previous
+
+
 class Syllable:
     """Object that represents a syllable.
 
@@ -40,6 +244,9 @@ class Syllable:
         text representation of syllable as classified by a human
         or a machine learning algorithm
     """
+    # no __dict__, to use less memory when a whole dataset is parsed
+    __slots__ = ('position', 'length', 'label')
+
     def __init__(self, position, length, label):
         if type(position) != int:
             raise TypeError(f'position must be an int, not type {type(position)}')
@@ -56,6 +263,16 @@ class Syllable:
                    self.label,self.position,self.length) 
         return rep_str
 
+    @classmethod
+    def _trusted(cls, position, length, label):
+        """make a Syllable without type checks, from values that are
+        already known to be valid, e.g. because the parser converted them"""
+        syl = object.__new__(cls)
+        syl.position = position
+        syl.length = length
+        syl.label = label
+        return syl
+
 
 class Sequence:
     """Object that represents a sequence of syllables.
@@ -70,8 +287,11 @@ class Sequence:
         duration given as number of samples
     syls : list
         list of syllable objects that make up sequence
-    seq_spect : spectrogram object
+
+    Spectrograms of sequences can be computed and cached with SpectrogramCache.
     """
+    __slots__ = ('wav_file', 'position', 'length', 'num_syls', 'syls')
+
     def __init__(self, wav_file, position, length, syl_list):
         if type(wav_file) != str:
             raise TypeError(f'wav_file must be a string, not type {type(wav_file)}')
@@ -81,7 +301,7 @@ class Sequence:
             raise TypeError(f'length must be an int, not type {type(length)}')
         if type(syl_list) != list:
             raise TypeError(f'syl_list must be a list, not type {type(syl_list)}')
-        if not all([type(syl) == Syllable for syl in syl_list]):
+        if not all(type(syl) == Syllable for syl in syl_list):
             raise TypeError('not all elements in syl list are of type Syllable: '
                             f'{syl_list}')
         self.wav_file = wav_file
@@ -95,9 +315,26 @@ class Sequence:
                   self.wav_file, self.position, self.length)
         return rep_str
 
+    @classmethod
+    def _from_columns(cls, wav_file, position, length, syl_positions, syl_lengths, syl_labels):
+        """make a Sequence and its Syllables without type checks, from columns
+        of syllable values that are already known to be valid: ints for positions
+        and lengths, and strings for labels. Used by the parser, that converts
+        every value itself, and by AnnotationTable.to_seqs"""
+        seq = object.__new__(cls)
+        seq.wav_file = wav_file
+        seq.position = position
+        seq.length = length
+        new_syllable = Syllable._trusted
+        seq.syls = [new_syllable(syl_position, syl_length, label)
+                    for syl_position, syl_length, label
+                    in zip(syl_positions, syl_lengths, syl_labels)]
+        seq.num_syls = len(seq.syls)
+        return seq
+
 
 def parse_xml(xml_file, concat_seqs_into_songs=False, return_wav_abspath=False,
-              wav_abspath=None):
+              wav_abspath=None, cache=None):
     """parses Annotation.xml files from the BirdsongRecognition dataset:
     Koumura, T. (2016). BirdsongRecognition (Version 1). figshare.
     https://doi.org/10.6084/m9.figshare.3470165.v1
@@ -121,12 +358,17 @@ def parse_xml(xml_file, concat_seqs_into_songs=False, return_wav_abspath=False,
         the structure of the repository so that the .wav files are no longer in a 
         directory named Wave that's in the same parent directory as the Annotation.xml
         file. Default is None, in which case the structure just described is assumed.
+    cache : AnnotationCache
+        if specified, load parsed annotation from this cache when possible,
+        and add it to the cache after parsing otherwise. Default is None.
 
     Returns
     -------
     seq_list : list of Sequence objects
         if concat_seqs_into_songs is True, then each sequence will correspond to one song,
         i.e., the annotation for one .wav file
+        To use both sequences and songs without parsing twice, parse with
+        concat_seqs_into_songs set to False and group sequences with SongIndex.
 
     Examples
     --------
@@ -139,76 +381,1616 @@ def parse_xml(xml_file, concat_seqs_into_songs=False, return_wav_abspath=False,
     Parses files that adhere to this XML Schema document:
     https://github.com/NickleDave/birdsong-recognition-dataset/blob/main/doc/xsd/AnnotationSchema.xsd
     """
+    with _stage('parse_xml'):
+        if cache is not None:
+            return cache.parse_xml(xml_file, concat_seqs_into_songs, return_wav_abspath,
+                                   wav_abspath)
+        return list(iter_xml(xml_file, concat_seqs_into_songs, return_wav_abspath, wav_abspath))
+
+
+def iter_xml(xml_file, concat_seqs_into_songs=False, return_wav_abspath=False,
+             wav_abspath=None):
+    """iterate over sequences in Annotation.xml files from the BirdsongRecognition
+    dataset, parsing the file incrementally.
+
+    Like parse_xml, but yields one Sequence at a time instead of returning a list,
+    and frees the XML for each sequence once it has been parsed.
+    Memory used is bounded by the size of one song, not the whole file.
+
+    Parameters
+    ----------
+    xml_file : str
+        filename of .xml file, e.g. 'Annotation.xml'
+    concat_seqs_into_songs : bool
+        if True, concatenate sequences into songs, where each .wav file is a
+        song. Sequences from the same .wav file must be next to each other
+        in the file, as they are in the dataset. Default is False.
+    return_wav_abspath : bool
+        if True, change value for the wav_file field of sequences to absolute path,
+        instead of just the .wav file name (without a path). Default is False.
+    wav_abspath : str
+        Path to directory in which .wav files are found. See parse_xml.
+        Default is None.
+
+    Returns
+    -------
+    seqs : generator
+        that yields Sequence objects. If concat_seqs_into_songs is True,
+        each sequence will correspond to one song.
+
+    Examples
+    --------
+    >>> for song in iter_xml(xml_file='./Bird0/Annotation.xml', concat_seqs_into_songs=True):
+    ...     print(song)
+    Sequence from 0.wav with position 32000 and length 138624
+    """
     if return_wav_abspath:
         if wav_abspath:
             if not os.path.isdir(wav_abspath):
                 raise NotADirectoryError(f'return_wav_abspath is True but {wav_abspath} '
                                          'is not a valid directory.')
-    tree = ET.ElementTree(file=xml_file)
-    seq_list = []
-    for seq in tree.iter(tag='Sequence'):
-        wav_file = seq.find('WaveFileName').text
+    stats = _stats
+    elements = _iter_seq_elements(xml_file)
+    if stats is not None:
+        elements = stats.iter_stage('parse_xml.read_xml', elements)
+    seqs = (_seq_from_element(seq, xml_file, return_wav_abspath, wav_abspath)
+            for seq in elements)
+    if stats is not None:
+        seqs = stats.iter_stage('parse_xml.make_objects', _count_seqs(stats, seqs))
+    if concat_seqs_into_songs:
+        seqs = _concat_seqs_into_songs(seqs)
+        if stats is not None:
+            seqs = stats.iter_stage('parse_xml.concat_seqs_into_songs', seqs)
+    return seqs
+
+
+def _count_seqs(stats, seqs):
+    """count sequences and syllables as they are parsed, when stats are enabled"""
+    for seq in seqs:
+        stats.count('sequences_parsed')
+        stats.count('syllables_parsed', seq.num_syls)
+        yield seq
+
+
+def _iter_seq_elements(xml_file):
+    """yield each Sequence element from an Annotation.xml file, parsed incrementally.
+    Elements are cleared and removed from the root after they are consumed,
+    so memory used is bounded by one sequence."""
+    # 'start' events are only needed to get the root element, but the parser
+    # can't stop reporting them, so skip them with one comparison each
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    root = None
+    with open(xml_file, 'rb') as fp:
+        # small chunks, so few events are queued at once; many queued events
+        # make the garbage collector run more often
+        for chunk in iter(lambda: fp.read(2 ** 14), b''):
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    if root is None:
+                        root = elem
+                elif elem.tag == 'Sequence':
+                    yield elem
+                    # free the parsed sequence
+                    elem.clear()
+                    root.remove(elem)
+    parser.close()
+
+
+def _wav_file_from_element(seq, xml_file, return_wav_abspath=False, wav_abspath=None):
+    """get name of .wav file from a Sequence element from an Annotation.xml file,
+    optionally converted to an absolute path"""
+    return _resolve_wav_file(seq.find('WaveFileName').text, xml_file,
+                             return_wav_abspath, wav_abspath)
+
+
+def _resolve_wav_file(wav_file, xml_file, return_wav_abspath=False, wav_abspath=None):
+    """optionally convert name of .wav file from an Annotation.xml file to a path"""
+    if return_wav_abspath:
+        if wav_abspath:
+            wav_file = os.path.join(wav_abspath, wav_file)
+        else:
+            # assume .wav file is in Wave directory that's a child to wherever
+            # Annotation.xml file is kept (since this is how the repository is
+            # structured)
+            xml_dirname = os.path.dirname(xml_file)
+            wav_file = os.path.join(xml_dirname, 'Wave', wav_file)
+        if not os.path.isfile(wav_file):
+            raise FileNotFoundError(f'File {wav_file} is not found')
+    return wav_file
+
+
+def _seq_from_element(seq, xml_file, return_wav_abspath=False, wav_abspath=None):
+    """convert a Sequence element from an Annotation.xml file into a Sequence object"""
+    wav_file = _wav_file_from_element(seq, xml_file, return_wav_abspath, wav_abspath)
+    if type(wav_file) != str:
+        raise TypeError(f'wav_file must be a string, not type {type(wav_file)}')
+    position = int(seq.find('Position').text)
+    length = int(seq.find('Length').text)
+    syl_positions, syl_lengths, syl_labels = [], [], []
+    for syl in seq.iterfind('Note'):
+        syl_positions.append(int(syl.findtext('Position')))
+        syl_lengths.append(int(syl.findtext('Length')))
+        label = syl.findtext('Label')
+        # missing <Label> is None, that Syllable does not accept
+        if type(label) != str:
+            raise TypeError(f'label must be a string, not type {type(label)}')
+        syl_labels.append(label)
+    return Sequence._from_columns(wav_file, position, length,
+                                  syl_positions, syl_lengths, syl_labels)
+
+
+def _concat_seqs_into_songs(seqs):
+    """concatenate sequences from the same .wav file into songs, yielding each song
+    once all of its sequences have been consumed.
+
+    Sequences from the same .wav file must be next to each other.
+    Each song is a new Sequence, with new Syllables whose positions are relative
+    to the start of the .wav file; the sequences and syllables are not changed."""
+    song_seqs = []
+    for seq in seqs:
+        if song_seqs and seq.wav_file != song_seqs[0].wav_file:
+            yield _song_from_seqs(song_seqs)
+            song_seqs = []
+        song_seqs.append(seq)
+    if song_seqs:
+        yield _song_from_seqs(song_seqs)  # last song
+
+
+def _song_from_seqs(seqs):
+    """make one new Sequence from sequences from the same .wav file"""
+    syl_positions, syl_lengths, syl_labels = [], [], []
+    for seq in seqs:
+        syl_positions.extend([seq.position + syl.position for syl in seq.syls])
+        syl_lengths.extend([syl.length for syl in seq.syls])
+        syl_labels.extend([syl.label for syl in seq.syls])
+    return Sequence._from_columns(seqs[0].wav_file, seqs[0].position,
+                                  sum([seq.length for seq in seqs]),
+                                  syl_positions, syl_lengths, syl_labels)
+
+
+class Song:
+    """View of all the sequences from one .wav file as one song,
+    made by SongIndex, that does not copy or change the sequences or syllables.
+
+    Unlike the songs returned by parse_xml when concat_seqs_into_songs is True,
+    positions of syllables in syls are still relative to the start of their sequence;
+    positions relative to the start of the .wav file are in syl_positions,
+    computed the first time they are accessed.
+
+    Attributes
+    ----------
+    wav_file : str
+        .wav file that song is from
+    seqs : list
+        of Sequence objects from the .wav file, in the order they were parsed
+    position : int
+        starting sample number of first sequence
+    length : int
+        sum of the lengths of the sequences, as for parse_xml
+    num_syls : int
+    syls : list
+        of Syllable objects from all sequences. Not copied.
+        The list is made the first time it is accessed.
+    syl_positions : list
+        of ints, starting sample number of each syllable,
+        relative to start of .wav file
+    """
+    __slots__ = ('wav_file', 'seqs', '_length', '_num_syls', '_syls', '_syl_positions')
+
+    def __init__(self, wav_file, seqs):
+        self.wav_file = wav_file
+        self.seqs = seqs
+        # computed once, since a Song does not change
+        self._length = sum([seq.length for seq in seqs])
+        self._num_syls = sum([seq.num_syls for seq in seqs])
+        self._syls = None
+        self._syl_positions = None
+
+    def __repr__(self):
+        return "Song from {} with position {} and length {}".format(
+            self.wav_file, self.position, self.length)
+
+    @property
+    def position(self):
+        return self.seqs[0].position
+
+    @property
+    def length(self):
+        return self._length
+
+    @property
+    def num_syls(self):
+        return self._num_syls
+
+    @property
+    def syls(self):
+        if self._syls is None:
+            self._syls = [syl for seq in self.seqs for syl in seq.syls]
+        return self._syls
+
+    @property
+    def syl_positions(self):
+        if self._syl_positions is None:
+            self._syl_positions = [seq.position + syl.position
+                                   for seq in self.seqs for syl in seq.syls]
+        return self._syl_positions
+
+    def to_sequence(self):
+        """make a new Sequence for the song, with new Syllables whose positions
+        are relative to the start of the .wav file, like the songs returned by
+        parse_xml when concat_seqs_into_songs is True"""
+        syls = self.syls
+        return Sequence._from_columns(self.wav_file, self.position, self.length,
+                                      self.syl_positions, [syl.length for syl in syls],
+                                      [syl.label for syl in syls])
+
+
+class SongIndex:
+    """Groups a list of Sequences into songs, one for each .wav file,
+    so that both sequences and songs can be used from a single call to parse_xml.
+
+    Sequences are grouped once, when the index is made; songs are Song views
+    that are made the first time they are accessed, and do not copy or change
+    sequences or syllables. Sequences from the same .wav file do not have to be
+    next to each other in the list.
+
+    Parameters
+    ----------
+    seqs : list
+        of Sequence objects, as returned by parse_xml
+        with concat_seqs_into_songs set to False
+
+    Attributes
+    ----------
+    seqs : list
+        of Sequence objects
+    wav_files : list
+        of .wav files, in the order they first occur in seqs
+    seq_song_ids : list
+        of ints, index into wav_files of the song that each sequence is from
+
+    Examples
+    --------
+    >>> seq_list = parse_xml('./Bird0/Annotation.xml')
+    >>> songs = SongIndex(seq_list)
+    >>> songs['0.wav']
+    Song from 0.wav with position 32000 and length 138624
+    >>> songs[0].syl_positions[:3]
+    [34240, 40256, 46944]
+    >>> seq_list[0].syls[0].position  # unchanged
+    2240
+    """
+    def __init__(self, seqs):
+        self.seqs = seqs
+        song_ids = {}
+        self.seq_song_ids = [song_ids.setdefault(seq.wav_file, len(song_ids)) for seq in seqs]
+        self.wav_files = list(song_ids)
+        self._song_ids = song_ids
+        self._song_seq_ids = [[] for _ in self.wav_files]
+        for seq_id, song_id in enumerate(self.seq_song_ids):
+            self._song_seq_ids[song_id].append(seq_id)
+        self._songs = [None] * len(self.wav_files)
+
+    def __repr__(self):
+        return "SongIndex with {} songs and {} sequences".format(len(self), len(self.seqs))
+
+    def __len__(self):
+        return len(self.wav_files)
+
+    def __contains__(self, wav_file):
+        return wav_file in self._song_ids
+
+    def __iter__(self):
+        return (self[song_id] for song_id in range(len(self)))
+
+    def __getitem__(self, key):
+        """get Song by index, or by .wav file"""
+        song_id = self._song_ids[key] if isinstance(key, str) else key
+        song = self._songs[song_id]
+        if song is None:
+            song = Song(self.wav_files[song_id],
+                        [self.seqs[seq_id] for seq_id in self._song_seq_ids[song_id]])
+            self._songs[song_id] = song
+        return song
+
+    def song_seq_ids(self, key):
+        """get indices into seqs of the sequences in a song,
+        given index of song or .wav file"""
+        song_id = self._song_ids[key] if isinstance(key, str) else key
+        return self._song_seq_ids[song_id]
+
+    def song_of(self, seq_id):
+        """get Song that the sequence at index seq_id is from"""
+        return self[self.seq_song_ids[seq_id]]
+
+    def to_seqs(self):
+        """make a new list of Sequences, one for each song, like the list returned
+        by parse_xml when concat_seqs_into_songs is True. seqs are not changed"""
+        return [song.to_sequence() for song in self]
+
+
+SequenceView = namedtuple('SequenceView', ['wav_file', 'position', 'length',
+                                           'syl_positions', 'syl_lengths', 'syl_label_codes'])
+SequenceView.__doc__ = """View of one sequence or song in an AnnotationTable.
+syl_positions, syl_lengths and syl_label_codes are arrays,
+that are views into the arrays of the table when possible."""
+
+
+class AnnotationTable:
+    """Annotation from an Annotation.xml file, stored as columns in NumPy arrays,
+    instead of as Sequence and Syllable objects.
+
+    Attributes
+    ----------
+    labels : 1-d array
+        set of unique labels applied to syllables, sorted, as returned by numpy.unique.
+        Label codes are indices into this array.
+    wav_files : 1-d array
+        unique .wav file names, in the order they first occur.
+        .wav file codes are indices into this array.
+    seq_wav_codes : 1-d array
+        of ints, .wav file of each sequence, as an index into wav_files
+    seq_positions : 1-d array
+        of ints, starting sample number of each sequence within .wav file
+    seq_lengths : 1-d array
+        of ints, duration of each sequence given as number of samples
+    seq_offsets : 1-d array
+        of ints, with length number of sequences + 1. Syllables from sequence i
+        are at indices seq_offsets[i]:seq_offsets[i + 1] of the syllable arrays
+    syl_seq_ids : 1-d array
+        of ints, index of sequence that each syllable belongs to
+    syl_positions : 1-d array
+        of ints, starting sample number of each syllable,
+        relative to start of its sequence, as in Syllable.position
+    syl_lengths : 1-d array
+        of ints, duration of each syllable given as number of samples
+    syl_label_codes : 1-d array
+        of ints, label of each syllable, as an index into labels
+    songs : bool
+        if True, sequences from each .wav file have been concatenated into songs,
+        and syl_positions are relative to the start of the .wav file,
+        as for parse_xml when concat_seqs_into_songs is True. Default is False.
+
+    Examples
+    --------
+    >>> annot = AnnotationTable.from_xml('./Bird0/Annotation.xml')
+    >>> annot
+    AnnotationTable with 571 sequences, 7652 syllables, and 9 labels
+    >>> annot.sequence(0).syl_label_codes
+    array([0, 0, 0, 1, 0, 0, 1, 0], dtype=int32)
+    >>> trans_mat = get_trans_mat(annot)
+    """
+    def __init__(self, labels, wav_files, seq_wav_codes, seq_positions, seq_lengths,
+                 seq_offsets, syl_positions, syl_lengths, syl_label_codes, songs=False):
+        self.songs = songs
+        self.labels = np.asanyarray(labels)
+        self.wav_files = np.asanyarray(wav_files)
+        self.seq_wav_codes = np.asanyarray(seq_wav_codes, dtype=np.int32)
+        self.seq_positions = np.asanyarray(seq_positions, dtype=np.int64)
+        self.seq_lengths = np.asanyarray(seq_lengths, dtype=np.int64)
+        self.seq_offsets = np.asanyarray(seq_offsets, dtype=np.int64)
+        self.syl_positions = np.asanyarray(syl_positions, dtype=np.int64)
+        self.syl_lengths = np.asanyarray(syl_lengths, dtype=np.int64)
+        self.syl_label_codes = np.asanyarray(syl_label_codes, dtype=np.int32)
+        if self.seq_offsets.shape != (self.num_seqs + 1,):
+            raise ValueError('seq_offsets must have length equal to number of sequences + 1')
+        self.syl_seq_ids = np.repeat(np.arange(self.num_seqs, dtype=np.int32),
+                                     np.diff(self.seq_offsets))
+        self._wav_codes = {wav_file: wav_code
+                           for wav_code, wav_file in enumerate(self.wav_files.tolist())}
+        # indices of sequences from each .wav file, grouped by .wav file
+        self._song_order = np.argsort(self.seq_wav_codes, kind='stable')
+        self._song_offsets = np.searchsorted(self.seq_wav_codes[self._song_order],
+                                             np.arange(self.wav_files.shape[0] + 1))
+
+    @property
+    def num_seqs(self):
+        return self.seq_wav_codes.shape[0]
+
+    @property
+    def num_syls(self):
+        return self.syl_label_codes.shape[0]
+
+    def __len__(self):
+        return self.num_seqs
+
+    def __repr__(self):
+        return "AnnotationTable with {} sequences, {} syllables, and {} labels".format(
+            self.num_seqs, self.num_syls, self.labels.shape[0])
+
+    @property
+    def syl_labels(self):
+        """label of each syllable"""
+        return self.labels[self.syl_label_codes]
+
+    @property
+    def syl_onsets(self):
+        """starting sample number of each syllable, relative to start of .wav file"""
+        if self.songs:
+            return self.syl_positions
+        return self.syl_positions + self.seq_positions[self.syl_seq_ids]
+
+    @classmethod
+    def from_xml(cls, xml_file, concat_seqs_into_songs=False, return_wav_abspath=False,
+                 wav_abspath=None):
+        """parse Annotation.xml file into an AnnotationTable,
+        without making a Sequence or Syllable object for each element.
+
+        Parameters are the same as for parse_xml.
+        If concat_seqs_into_songs is True, each row corresponds to one song,
+        and positions of syllables are relative to the start of the .wav file,
+        as they are for the Sequence objects returned by parse_xml.
+        """
         if return_wav_abspath:
             if wav_abspath:
-                wav_file = os.path.join(wav_abspath, wav_file)
-            else:
-                # assume .wav file is in Wave directory that's a child to wherever
-                # Annotation.xml file is kept (since this is how the repository is
-                # structured)
-                xml_dirname = os.path.dirname(xml_file)
-                wav_file = os.path.join(xml_dirname, 'Wave', wav_file)
-            if not os.path.isfile(wav_file):
-                raise FileNotFoundError('File {wav_file} is not found')
-
-        position = int(seq.find('Position').text)
-        length = int(seq.find('Length').text)
-        syl_list = []
-        for syl in seq.iter(tag='Note'):
-            syl_position = int(syl.find('Position').text)
-            syl_length = int(syl.find('Length').text)
-            label = syl.find('Label').text
-
-            syl_obj = Syllable(position=syl_position,
-                               length=syl_length,
-                               label=label)
-            syl_list.append(syl_obj)
-        seq_obj = Sequence(wav_file=wav_file,
-                           position=position,
-                           length=length,
-                           syl_list=syl_list)
-        seq_list.append(seq_obj)
+                if not os.path.isdir(wav_abspath):
+                    raise NotADirectoryError(f'return_wav_abspath is True but {wav_abspath} '
+                                             'is not a valid directory.')
+        with _stage('AnnotationTable.from_xml'):
+            annot = cls._from_xml(xml_file, return_wav_abspath, wav_abspath)
+        if _stats is not None:
+            _stats.count('sequences_parsed', annot.num_seqs)
+            _stats.count('syllables_parsed', annot.num_syls)
+        if concat_seqs_into_songs:
+            with _stage('AnnotationTable.concat_seqs_into_songs'):
+                annot = annot.concat_seqs_into_songs()
+        return annot
 
-    if concat_seqs_into_songs:
-        song_list = []
-        curr_wav_file = seq_list[0].wav_file
-        new_seq_obj = seq_list[0]
-        for syl in new_seq_obj.syls:
-            syl.position += new_seq_obj.position
-
-        for seq in seq_list[1:]:
-            if seq.wav_file == curr_wav_file:
-                new_seq_obj.length += seq.length
-                new_seq_obj.num_syls += seq.num_syls
-                for syl in seq.syls:
-                    syl.position += seq.position
-                new_seq_obj.syls += seq.syls
+    @classmethod
+    def _from_xml(cls, xml_file, return_wav_abspath=False, wav_abspath=None):
+        wav_codes = {}
+        seq_wav_codes, seq_positions, seq_lengths, seq_num_syls = [], [], [], []
+        syl_positions, syl_lengths, syl_labels = [], [], []
+        for seq in _iter_seq_elements(xml_file):
+            wav_file = _wav_file_from_element(seq, xml_file, return_wav_abspath, wav_abspath)
+            seq_wav_codes.append(wav_codes.setdefault(wav_file, len(wav_codes)))
+            seq_positions.append(int(seq.find('Position').text))
+            seq_lengths.append(int(seq.find('Length').text))
+            num_syls = 0
+            for syl in seq.iterfind('Note'):
+                syl_positions.append(int(syl.findtext('Position')))
+                syl_lengths.append(int(syl.findtext('Length')))
+                label = syl.findtext('Label')
+                # like parse_xml, missing <Label> is an error, not the label 'None'
+                if type(label) != str:
+                    raise TypeError(f'label must be a string, not type {type(label)}')
+                syl_labels.append(label)
+                num_syls += 1
+            seq_num_syls.append(num_syls)
 
-            else:
-                song_list.append(new_seq_obj)
-                curr_wav_file = seq.wav_file
-                new_seq_obj = seq
-                for syl in new_seq_obj.syls:
-                    syl.position += new_seq_obj.position
+        labels, syl_label_codes = np.unique(np.array(syl_labels, dtype=str), return_inverse=True)
+        return cls(labels=labels,
+                   wav_files=np.array(list(wav_codes), dtype=str),
+                   seq_wav_codes=seq_wav_codes,
+                   seq_positions=seq_positions,
+                   seq_lengths=seq_lengths,
+                   seq_offsets=np.concatenate(([0], np.cumsum(seq_num_syls, dtype=np.int64))),
+                   syl_positions=syl_positions,
+                   syl_lengths=syl_lengths,
+                   syl_label_codes=syl_label_codes)
 
-        song_list.append(new_seq_obj)  # to append last song
+    @classmethod
+    def from_seqs(cls, seqs, songs=False):
+        """make an AnnotationTable from a list of Sequence objects.
+        Set songs to True if seqs are songs, i.e. they were returned
+        by parse_xml with concat_seqs_into_songs set to True."""
+        wav_codes = {}
+        seq_wav_codes = [wav_codes.setdefault(seq.wav_file, len(wav_codes)) for seq in seqs]
+        labels, syl_label_codes = np.unique(
+            np.array([syl.label for seq in seqs for syl in seq.syls], dtype=str),
+            return_inverse=True
+        )
+        return cls(labels=labels,
+                   wav_files=np.array(list(wav_codes), dtype=str),
+                   seq_wav_codes=seq_wav_codes,
+                   seq_positions=[seq.position for seq in seqs],
+                   seq_lengths=[seq.length for seq in seqs],
+                   seq_offsets=np.concatenate(
+                       ([0], np.cumsum([len(seq.syls) for seq in seqs], dtype=np.int64))
+                   ),
+                   syl_positions=[syl.position for seq in seqs for syl in seq.syls],
+                   syl_lengths=[syl.length for seq in seqs for syl in seq.syls],
+                   syl_label_codes=syl_label_codes,
+                   songs=songs)
 
-        return song_list
+    def with_wav_files(self, wav_files):
+        """return a new AnnotationTable with the same arrays,
+        but with wav_files replaced, e.g. by paths to the files"""
+        if len(wav_files) != self.wav_files.shape[0]:
+            raise ValueError(f'must specify {self.wav_files.shape[0]} .wav files, '
+                             f'but got {len(wav_files)}')
+        return AnnotationTable(labels=self.labels,
+                               wav_files=np.array(wav_files, dtype=str),
+                               seq_wav_codes=self.seq_wav_codes,
+                               seq_positions=self.seq_positions,
+                               seq_lengths=self.seq_lengths,
+                               seq_offsets=self.seq_offsets,
+                               syl_positions=self.syl_positions,
+                               syl_lengths=self.syl_lengths,
+                               syl_label_codes=self.syl_label_codes,
+                               songs=self.songs)
 
-    else:
+    @classmethod
+    def concatenate(cls, tables):
+        """concatenate AnnotationTables into one table,
+        merging the sets of labels and .wav files of each table"""
+        if len(set([table.songs for table in tables])) > 1:
+            raise ValueError('can not concatenate tables of songs with tables of sequences')
+        labels = np.unique(np.concatenate([np.array([], dtype=str)]
+                                          + [table.labels for table in tables]))
+        wav_files = np.array(list(dict.fromkeys(
+            [wav_file for table in tables for wav_file in table.wav_files.tolist()]
+        )), dtype=str)
+        wav_codes = {wav_file: wav_code for wav_code, wav_file in enumerate(wav_files.tolist())}
+        seq_wav_codes, seq_offsets, syl_label_codes = [], [np.zeros((1,), dtype=np.int64)], []
+        num_syls = 0
+        for table in tables:
+            table_wav_codes = np.array([wav_codes[wav_file]
+                                        for wav_file in table.wav_files.tolist()], dtype=np.int32)
+            seq_wav_codes.append(table_wav_codes[table.seq_wav_codes])
+            seq_offsets.append(table.seq_offsets[1:] + num_syls)
+            num_syls += table.num_syls
+            syl_label_codes.append(
+                np.searchsorted(labels, table.labels).astype(np.int32)[table.syl_label_codes]
+            )
+        return cls(labels=labels,
+                   wav_files=wav_files,
+                   seq_wav_codes=np.concatenate([np.zeros((0,), dtype=np.int32)] + seq_wav_codes),
+                   seq_positions=np.concatenate([np.zeros((0,), dtype=np.int64)]
+                                                + [table.seq_positions for table in tables]),
+                   seq_lengths=np.concatenate([np.zeros((0,), dtype=np.int64)]
+                                              + [table.seq_lengths for table in tables]),
+                   seq_offsets=np.concatenate(seq_offsets),
+                   syl_positions=np.concatenate([np.zeros((0,), dtype=np.int64)]
+                                                + [table.syl_positions for table in tables]),
+                   syl_lengths=np.concatenate([np.zeros((0,), dtype=np.int64)]
+                                              + [table.syl_lengths for table in tables]),
+                   syl_label_codes=np.concatenate([np.zeros((0,), dtype=np.int32)]
+                                                  + syl_label_codes),
+                   songs=bool(tables) and tables[0].songs)
+
+    def concat_seqs_into_songs(self):
+        """return a new AnnotationTable where consecutive sequences from the same
+        .wav file are concatenated into one song, as parse_xml does when
+        concat_seqs_into_songs is True"""
+        if self.songs or self.num_seqs == 0:
+            return self
+        # first sequence of each run of sequences from the same .wav file
+        song_starts = np.flatnonzero(np.r_[True, self.seq_wav_codes[1:] != self.seq_wav_codes[:-1]])
+        return AnnotationTable(
+            labels=self.labels,
+            wav_files=self.wav_files,
+            seq_wav_codes=self.seq_wav_codes[song_starts],
+            seq_positions=self.seq_positions[song_starts],
+            seq_lengths=np.add.reduceat(self.seq_lengths, song_starts),
+            seq_offsets=np.r_[self.seq_offsets[song_starts], self.num_syls],
+            # relative to start of .wav file
+            syl_positions=self.syl_onsets,
+            syl_lengths=self.syl_lengths,
+            syl_label_codes=self.syl_label_codes,
+            songs=True,
+        )
+
+    def sequence(self, seq_id):
+        """get a SequenceView of the sequence at index seq_id,
+        where arrays of syllables are views into this table"""
+        start, stop = self.seq_offsets[seq_id], self.seq_offsets[seq_id + 1]
+        return SequenceView(wav_file=str(self.wav_files[self.seq_wav_codes[seq_id]]),
+                            position=int(self.seq_positions[seq_id]),
+                            length=int(self.seq_lengths[seq_id]),
+                            syl_positions=self.syl_positions[start:stop],
+                            syl_lengths=self.syl_lengths[start:stop],
+                            syl_label_codes=self.syl_label_codes[start:stop])
+
+    def song_seq_ids(self, wav_file):
+        """get indices of sequences from a .wav file"""
+        if wav_file not in self._wav_codes:
+            raise ValueError(f'no sequences from {wav_file} in AnnotationTable')
+        wav_code = self._wav_codes[wav_file]
+        return self._song_order[self._song_offsets[wav_code]:self._song_offsets[wav_code + 1]]
+
+    def song(self, wav_file):
+        """get a SequenceView of all syllables from a .wav file.
+
+        Positions of syllables are relative to the start of the .wav file,
+        length is the sum of lengths of sequences, and position is the position
+        of the first sequence, as for songs returned by parse_xml when
+        concat_seqs_into_songs is True."""
+        seq_ids = self.song_seq_ids(wav_file)
+        if np.all(np.diff(seq_ids) == 1):
+            syl_inds = slice(self.seq_offsets[seq_ids[0]], self.seq_offsets[seq_ids[-1] + 1])
+        else:
+            syl_inds = np.concatenate([np.arange(self.seq_offsets[seq_id],
+                                                 self.seq_offsets[seq_id + 1])
+                                       for seq_id in seq_ids])
+        syl_positions = self.syl_positions[syl_inds]
+        if not self.songs:
+            syl_positions = syl_positions + self.seq_positions[self.syl_seq_ids[syl_inds]]
+        return SequenceView(
+            wav_file=str(wav_file),
+            position=int(self.seq_positions[seq_ids[0]]),
+            length=int(self.seq_lengths[seq_ids].sum()),
+            syl_positions=syl_positions,
+            syl_lengths=self.syl_lengths[syl_inds],
+            syl_label_codes=self.syl_label_codes[syl_inds],
+        )
+
+    def to_seqs(self, seq_ids=None):
+        """convert to a list of Sequence objects
+
+        Parameters
+        ----------
+        seq_ids : list
+            of ints, indices of sequences to convert.
+            Default is None, in which case all sequences are converted.
+        """
+        if seq_ids is None:
+            seq_ids = range(self.num_seqs)
+        seq_list = []
+        for seq_id in seq_ids:
+            seq_view = self.sequence(seq_id)
+            # tolist gives Python ints and strs, so type checks can be skipped
+            seq_list.append(Sequence._from_columns(
+                seq_view.wav_file, seq_view.position, seq_view.length,
+                seq_view.syl_positions.tolist(), seq_view.syl_lengths.tolist(),
+                self.labels[seq_view.syl_label_codes].tolist()
+            ))
         return seq_list
 
 
-def load_song_annot(wav_file, xml_file=None, concat_seqs=True):
+class AnnotationIndex:
+    """Index from .wav file names to the annotation for the song in each file,
+    from one Annotation.xml file.
+
+    The file is parsed once, when the index is made. After that,
+    looking up the annotation for a song does not depend on the size of the file.
+    Each lookup returns new Sequence and Syllable objects,
+    so callers can change them without affecting later lookups.
+    Use get_annotation_index to get an index that is shared between callers.
+
+    Parameters
+    ----------
+    annot : AnnotationTable
+        with one row per sequence
+
+    Examples
+    --------
+    >>> index = AnnotationIndex.from_xml('./Bird0/Annotation.xml')
+    >>> index.load('1.wav')
+    Sequence from 1.wav with position 32000 and length 214176
+    """
+    def __init__(self, annot):
+        self.annot = annot
+
+    @classmethod
+    def from_xml(cls, xml_file, cache=None):
+        """make an AnnotationIndex from an Annotation.xml file,
+        using an AnnotationCache if specified"""
+        if cache is not None:
+            return cls(cache.load_table(xml_file))
+        return cls(AnnotationTable.from_xml(xml_file))
+
+    @property
+    def wav_files(self):
+        return self.annot.wav_files
+
+    def __len__(self):
+        return self.annot.wav_files.shape[0]
+
+    def __contains__(self, wav_file):
+        return wav_file in self.annot._wav_codes
+
+    def __repr__(self):
+        return "AnnotationIndex of {} songs".format(len(self))
+
+    def load(self, wav_file, concat_seqs=True):
+        """load annotation for the song in a .wav file
+
+        Parameters
+        ----------
+        wav_file : str
+            name of .wav file, as written in Annotation.xml
+        concat_seqs : bool
+            if True, concatenate sequences from the .wav file into one single Sequence.
+            Default is True.
+
+        Returns
+        -------
+        seq_list : list
+            of Sequence objects, as returned by load_song_annot.
+            If there is only one Sequence, it is returned instead of a list.
+        """
+        if wav_file not in self:
+            return []
+        seq_ids = self.annot.song_seq_ids(wav_file).tolist()
+        seq_list = self.annot.to_seqs(seq_ids)
+        if concat_seqs:
+            # like parse_xml, only concatenate sequences that are next to each other in file
+            run_starts = [0] + [ind for ind in range(1, len(seq_ids))
+                                if seq_ids[ind] != seq_ids[ind - 1] + 1] + [len(seq_ids)]
+            seq_list = [next(_concat_seqs_into_songs(seq_list[start:stop]))
+                        for start, stop in zip(run_starts[:-1], run_starts[1:])]
+        if len(seq_list) == 1:
+            seq_list = seq_list[0]
+        return seq_list
+
+
+@lru_cache(maxsize=32)
+def _cached_annotation_index(xml_file, size, mtime_ns, cache):
+    return AnnotationIndex.from_xml(xml_file, cache=cache)
+
+
+def get_annotation_index(xml_file, cache=None):
+    """get AnnotationIndex for an Annotation.xml file.
+
+    Indices are kept in a least-recently-used cache of the 32 most recently used
+    files, shared by all callers, including load_song_annot.
+    An index is made again if the file changes.
+
+    Parameters
+    ----------
+    xml_file : str
+        path to Annotation.xml file
+    cache : AnnotationCache
+        used to make index if specified. Default is None.
+
+    Returns
+    -------
+    index : AnnotationIndex
+    """
+    xml_file = os.path.abspath(xml_file)
+    stat = os.stat(xml_file)
+    return _cached_annotation_index(xml_file, stat.st_size, stat.st_mtime_ns, cache)
+
+
+def _is_cache_key(name, suffix=''):
+    """True if name is a sha1 hex digest, used as a key for an entry in a cache,
+    followed by suffix. Caches only ever remove files and directories named like this,
+    so they never remove anything else in their directory"""
+    if not name.endswith(suffix):
+        return False
+    key = name[:len(name) - len(suffix)]
+    return len(key) == 40 and all(char in '0123456789abcdef' for char in key)
+
+
+class AnnotationCache:
+    """Cache of parsed Annotation.xml files, stored on disk.
+
+    Each file is stored as the arrays of an AnnotationTable, in .npy files
+    that are memory-mapped when loaded, so loading from the cache is much faster
+    than parsing the .xml file again.
+
+    Entries are keyed by the absolute path to the .xml file, and are
+    invalidated automatically when the file changes. Changes are detected
+    by size and modification time of the file; if those differ from when
+    the entry was made, a hash of the file's contents is compared as well.
+    When the total size of entries exceeds max_bytes, least recently
+    used entries are removed.
+
+    Parameters
+    ----------
+    cache_dir : str
+        directory in which to store cache. Default is None, in which case
+        entries are stored in a directory named .birdsongrec-cache in the same
+        directory as each Annotation.xml file.
+    max_bytes : int
+        maximum total size of entries in each cache directory, in bytes.
+        Default is 2 ** 30 (1 GiB).
+
+    Examples
+    --------
+    >>> cache = AnnotationCache('~/.cache/birdsongrec')
+    >>> seq_list = parse_xml('./Bird0/Annotation.xml', cache=cache)  # parses, adds to cache
+    >>> seq_list = parse_xml('./Bird0/Annotation.xml', cache=cache)  # loads from cache
+    """
+    FORMAT_VERSION = 1
+    DEFAULT_DIRNAME = '.birdsongrec-cache'
+    ARRAYS = ('labels', 'wav_files', 'seq_wav_codes', 'seq_positions', 'seq_lengths',
+              'seq_offsets', 'syl_positions', 'syl_lengths', 'syl_label_codes')
+
+    def __init__(self, cache_dir=None, max_bytes=2 ** 30):
+        if cache_dir is not None:
+            cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def __repr__(self):
+        return "AnnotationCache in {} with max_bytes {}".format(
+            self.cache_dir if self.cache_dir else self.DEFAULT_DIRNAME, self.max_bytes)
+
+    def _dir_for(self, xml_file):
+        if self.cache_dir is not None:
+            return self.cache_dir
+        return os.path.join(os.path.dirname(xml_file), self.DEFAULT_DIRNAME)
+
+    def _entry_dir(self, xml_file):
+        key = hashlib.sha1(xml_file.encode()).hexdigest()
+        return os.path.join(self._dir_for(xml_file), key)
+
+    @staticmethod
+    def _content_hash(xml_file):
+        sha = hashlib.sha256()
+        with open(xml_file, 'rb') as fp:
+            for block in iter(lambda: fp.read(2 ** 20), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def _load_entry(self, xml_file, stat):
+        """return AnnotationTable from entry for xml_file if it is valid, else None"""
+        entry_dir = self._entry_dir(xml_file)
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        try:
+            with open(meta_path) as fp:
+                meta = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if meta.get('format_version') != self.FORMAT_VERSION or meta.get('xml_file') != xml_file:
+            return None
+        if meta['size'] != stat.st_size or meta['mtime_ns'] != stat.st_mtime_ns:
+            if meta['size'] != stat.st_size or meta['sha256'] != self._content_hash(xml_file):
+                return None
+            # contents unchanged, e.g. file was touched or copied
+            meta['mtime_ns'] = stat.st_mtime_ns
+            with open(meta_path, 'w') as fp:
+                json.dump(meta, fp)
+        try:
+            arrays = {name: np.load(os.path.join(entry_dir, f'{name}.npy'), mmap_mode='r')
+                      for name in self.ARRAYS}
+        except (OSError, ValueError):
+            return None
+        # mark as recently used, for eviction
+        os.utime(meta_path)
+        return AnnotationTable(**arrays)
+
+    def _store_entry(self, xml_file, stat, annot):
+        cache_dir = self._dir_for(xml_file)
+        os.makedirs(cache_dir, exist_ok=True)
+        entry_dir = self._entry_dir(xml_file)
+        tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp-')
+        for name in self.ARRAYS:
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), getattr(annot, name))
+        meta = {
+            'format_version': self.FORMAT_VERSION,
+            'xml_file': xml_file,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': self._content_hash(xml_file),
+        }
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as fp:
+            json.dump(meta, fp)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self._evict(cache_dir, keep=entry_dir)
+
+    def _entries(self, cache_dir):
+        """paths to entries in cache_dir. Only directories named with a key
+        that contain a meta.json file are entries; nothing else in cache_dir
+        is ever removed"""
+        try:
+            dir_entries = list(os.scandir(cache_dir))
+        except OSError:
+            return []
+        return [entry.path for entry in dir_entries
+                if entry.is_dir(follow_symlinks=False) and _is_cache_key(entry.name)
+                and os.path.isfile(os.path.join(entry.path, 'meta.json'))]
+
+    def _evict(self, cache_dir, keep=None):
+        """remove least recently used entries until total size is at most max_bytes,
+        never removing the entry keep, e.g. the one just stored"""
+        if self.max_bytes is None:
+            return
+        entries = []
+        for entry_path in self._entries(cache_dir):
+            try:
+                last_used = os.stat(os.path.join(entry_path, 'meta.json')).st_mtime
+                size = sum([file.stat().st_size for file in os.scandir(entry_path)])
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((last_used, size, entry_path))
+        total = sum([size for _, size, _ in entries])
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry_path == keep:
+                continue
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total -= size
+
+    def load_table(self, xml_file):
+        """load AnnotationTable for an Annotation.xml file from the cache,
+        parsing the file and adding it to the cache if needed
+
+        Parameters
+        ----------
+        xml_file : str
+            path to Annotation.xml file
+
+        Returns
+        -------
+        annot : AnnotationTable
+            with one row per sequence. Arrays are memory-mapped
+            when loaded from cache.
+        """
+        with _stage('AnnotationCache.load_table'):
+            xml_file = os.path.abspath(xml_file)
+            stat = os.stat(xml_file)
+            annot = self._load_entry(xml_file, stat)
+            if _stats is not None:
+                _stats.count('cache_misses' if annot is None else 'cache_hits')
+            if annot is None:
+                annot = AnnotationTable.from_xml(xml_file)
+                self._store_entry(xml_file, stat, annot)
+            return annot
+
+    def parse_xml(self, xml_file, concat_seqs_into_songs=False, return_wav_abspath=False,
+                  wav_abspath=None):
+        """same as parse_xml, but loads from the cache when possible.
+        See parse_xml for parameters."""
+        if return_wav_abspath:
+            if wav_abspath:
+                if not os.path.isdir(wav_abspath):
+                    raise NotADirectoryError(f'return_wav_abspath is True but {wav_abspath} '
+                                             'is not a valid directory.')
+        annot = self.load_table(xml_file)
+        if return_wav_abspath:
+            annot = annot.with_wav_files(
+                [_resolve_wav_file(wav_file, xml_file, return_wav_abspath, wav_abspath)
+                 for wav_file in annot.wav_files.tolist()]
+            )
+        if concat_seqs_into_songs:
+            annot = annot.concat_seqs_into_songs()
+        return annot.to_seqs()
+
+    def clear(self, xml_file=None):
+        """remove all entries from the cache. If cache_dir is None,
+        xml_file must be specified, to find the cache next to it.
+
+        Only entries, and temporary directories left by entries that were
+        being stored, are removed. The cache directory is removed only
+        if it is then empty."""
+        if self.cache_dir is None and xml_file is None:
+            raise ValueError('must specify xml_file when cache_dir is None')
+        cache_dir = self._dir_for(os.path.abspath(xml_file)) if xml_file else self.cache_dir
+        for entry_path in self._entries(cache_dir):
+            shutil.rmtree(entry_path, ignore_errors=True)
+        if os.path.isdir(cache_dir):
+            for entry in os.scandir(cache_dir):
+                if entry.is_dir(follow_symlinks=False) and entry.name.startswith('.tmp-'):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+        try:
+            os.rmdir(cache_dir)
+        except OSError:
+            # not empty, or already removed
+            pass
+
+
+class DatasetCatalog:
+    """Annotation for every bird in the BirdsongRecognition dataset,
+    returned by load_dataset.
+
+    Attributes
+    ----------
+    root : str
+        path to root of dataset, that contains a directory for each bird
+    bird_ids : 1-d array
+        names of bird directories, e.g. 'Bird0'
+    table : AnnotationTable
+        annotation for all sequences from all birds, where wav_files are
+        paths to .wav files. Labels from different birds are in one set of
+        labels; use bird to get the labels for one bird.
+    seq_bird_codes : 1-d array
+        of ints, bird that each sequence in table is from, as an index into bird_ids
+
+    Examples
+    --------
+    >>> catalog = load_dataset('./BirdsongRecognition', max_workers=10)
+    >>> bird0_annot = catalog.bird('Bird0')
+    >>> bird0_seq_ids = np.flatnonzero(catalog.seq_bird_ids == 'Bird0')
+    """
+    def __init__(self, root, bird_ids, bird_tables):
+        self.root = root
+        self.bird_ids = np.array(bird_ids, dtype=str)
+        self._bird_tables = dict(zip(bird_ids, bird_tables))
+        self.table = AnnotationTable.concatenate(bird_tables)
+        self.seq_bird_codes = np.repeat(np.arange(len(bird_ids), dtype=np.int32),
+                                        [table.num_seqs for table in bird_tables])
+
+    def __repr__(self):
+        return "DatasetCatalog with {} birds, {} songs, and {} sequences".format(
+            self.bird_ids.shape[0], self.wav_paths.shape[0], self.table.num_seqs)
+
+    @property
+    def wav_paths(self):
+        return self.table.wav_files
+
+    @property
+    def seq_bird_ids(self):
+        """bird that each sequence in table is from"""
+        return self.bird_ids[self.seq_bird_codes]
+
+    def bird(self, bird_id):
+        """get AnnotationTable for one bird, with its own set of labels"""
+        return self._bird_tables[bird_id]
+
+
+def _load_bird_table(xml_file, validate_wav_files=False, cache=None):
+    """load AnnotationTable for one bird, with wav_files converted to paths"""
+    if cache is not None:
+        annot = cache.load_table(xml_file)
+    else:
+        annot = AnnotationTable.from_xml(xml_file)
+    wave_dir = os.path.join(os.path.dirname(os.path.abspath(xml_file)), 'Wave')
+    wav_files = annot.wav_files.tolist()
+    if validate_wav_files:
+        # list directory once, instead of checking each file exists
+        found = set(os.listdir(wave_dir)) if os.path.isdir(wave_dir) else set()
+        missing = [wav_file for wav_file in wav_files if wav_file not in found]
+        if missing:
+            raise FileNotFoundError(f'.wav files in {xml_file} not found in {wave_dir}: {missing}')
+    return annot.with_wav_files([os.path.join(wave_dir, wav_file) for wav_file in wav_files])
+
+
+def load_dataset(root, max_workers=None, validate_wav_files=False, cache=None):
+    """load annotation for every bird in the BirdsongRecognition dataset,
+    parsing the Annotation.xml file for each bird in parallel
+
+    Parameters
+    ----------
+    root : str
+        path to root of dataset. Every directory in root that contains an
+        Annotation.xml file, e.g. Bird0, Bird1, ..., is treated as a bird.
+    max_workers : int
+        number of worker processes. Default is None, in which case the number
+        of processors on the machine is used. If 1, files are parsed in this process.
+    validate_wav_files : bool
+        if True, check that the .wav file for every song is in the Wave directory
+        of each bird, and raise a FileNotFoundError if not. Default is False.
+    cache : AnnotationCache
+        used to load annotation if specified. Default is None.
+
+    Returns
+    -------
+    catalog : DatasetCatalog
+    """
+    root = os.path.abspath(os.path.expanduser(root))
+    xml_files = sorted(glob.glob(os.path.join(root, '*', 'Annotation.xml')))
+    if len(xml_files) < 1:
+        raise ValueError(f'no directories with an Annotation.xml file found in {root}')
+    bird_ids = [os.path.basename(os.path.dirname(xml_file)) for xml_file in xml_files]
+    load_args = ([validate_wav_files] * len(xml_files), [cache] * len(xml_files))
+    if max_workers == 1:
+        bird_tables = list(map(_load_bird_table, xml_files, *load_args))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            bird_tables = list(executor.map(_load_bird_table, xml_files, *load_args))
+    return DatasetCatalog(root, bird_ids, bird_tables)
+
+
+class WavFile:
+    """A .wav file whose audio data is memory-mapped, so that reading part of the file
+    only reads those bytes from disk.
+
+    The RIFF header is parsed once, when the WavFile is made.
+    Supports uncompressed PCM (8, 16, or 32 bit) and IEEE float (32 or 64 bit) data.
+
+    Parameters
+    ----------
+    path : str
+        path to .wav file
+
+    Attributes
+    ----------
+    samplerate : int
+        sampling rate, in Hz
+    num_channels : int
+    num_samples : int
+        number of samples (frames) per channel
+    data : numpy.memmap
+        audio data, read-only. 1-d array with shape (num_samples,) if there is
+        one channel, otherwise 2-d with shape (num_samples, num_channels)
+    """
+    # (format tag, bits per sample) -> dtype
+    DTYPES = {
+        (1, 8): np.dtype('u1'),
+        (1, 16): np.dtype('<i2'),
+        (1, 32): np.dtype('<i4'),
+        (3, 32): np.dtype('<f4'),
+        (3, 64): np.dtype('<f8'),
+    }
+    WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+    def __init__(self, path):
+        self.path = path
+        file_size = os.path.getsize(path)
+        fmt, data_offset, data_size = None, None, None
+        with open(path, 'rb') as fp:
+            riff, _, wave = struct.unpack('<4sI4s', fp.read(12))
+            if riff != b'RIFF' or wave != b'WAVE':
+                raise ValueError(f'not a RIFF WAVE file: {path}')
+            while data_offset is None:
+                chunk_header = fp.read(8)
+                if len(chunk_header) < 8:
+                    break
+                chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+                if chunk_id == b'fmt ':
+                    fmt = fp.read(chunk_size)
+                    fp.seek(chunk_size % 2, 1)
+                elif chunk_id == b'data':
+                    data_offset, data_size = fp.tell(), chunk_size
+                else:
+                    # chunks are padded to an even number of bytes
+                    fp.seek(chunk_size + chunk_size % 2, 1)
+        if fmt is None or data_offset is None:
+            raise ValueError(f'did not find fmt and data chunks in .wav file: {path}')
+
+        format_tag, num_channels, samplerate, _, block_align, bits_per_sample = \
+            struct.unpack('<HHIIHH', fmt[:16])
+        if format_tag == self.WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            # actual format is first two bytes of sub-format GUID
+            format_tag = struct.unpack('<H', fmt[24:26])[0]
+        if (format_tag, bits_per_sample) not in self.DTYPES:
+            raise ValueError(f'can not memory-map .wav file with format {format_tag} and '
+                             f'{bits_per_sample} bits per sample: {path}')
+        self.samplerate = samplerate
+        self.num_channels = num_channels
+        self.dtype = self.DTYPES[(format_tag, bits_per_sample)]
+        # size in header can be wrong, e.g. for files that were not closed properly
+        data_size = min(data_size, file_size - data_offset)
+        self.num_samples = data_size // block_align
+        shape = (self.num_samples,) if num_channels == 1 else (self.num_samples, num_channels)
+        if self.num_samples > 0:
+            self.data = np.memmap(path, dtype=self.dtype, mode='r', offset=data_offset,
+                                  shape=shape)
+        else:
+            self.data = np.zeros(shape, dtype=self.dtype)
+
+    def __repr__(self):
+        return "WavFile {} with {} samples at {} Hz".format(
+            self.path, self.num_samples, self.samplerate)
+
+    def __len__(self):
+        return self.num_samples
+
+    def read(self, start, length):
+        """get a view of length samples starting at sample number start,
+        without copying"""
+        if start < 0 or start + length > self.num_samples:
+            raise ValueError(f'samples {start}:{start + length} are out of range for '
+                             f'{self.path} with {self.num_samples} samples')
+        return self.data[start:start + length]
+
+
+@lru_cache(maxsize=128)
+def _open_wav(path, size, mtime_ns):
+    return WavFile(path)
+
+
+def open_wav(path):
+    """get a WavFile for a .wav file. WavFiles are kept in a least-recently-used
+    cache of the 128 most recently used files, so the header is only parsed once."""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return _open_wav(path, stat.st_size, stat.st_mtime_ns)
+
+
+class AudioReader:
+    """Reads audio for annotated sequences, songs, and syllables from memory-mapped
+    .wav files, returning NumPy views instead of reading whole files.
+
+    Parameters
+    ----------
+    wav_dir : str
+        directory that contains .wav files, e.g. the Wave directory for one bird.
+        Used when the wav_file of a sequence is a file name instead of a path.
+        Default is None, in which case wav_file must be a path.
+
+    Examples
+    --------
+    >>> reader = AudioReader('./Bird0/Wave')
+    >>> seq_list = parse_xml('./Bird0/Annotation.xml')
+    >>> seq_audio = reader.sequence(seq_list[0])
+    >>> syl_audio = reader.syllable(seq_list[0], seq_list[0].syls[0])
+    >>> annot = AnnotationTable.from_xml('./Bird0/Annotation.xml')
+    >>> windows, lengths = reader.gather_syllables(annot)
+    """
+    def __init__(self, wav_dir=None):
+        self.wav_dir = wav_dir
+
+    def __repr__(self):
+        return "AudioReader for {}".format(self.wav_dir)
+
+    def wav(self, wav_file):
+        """get WavFile for a .wav file name or path"""
+        if self.wav_dir is not None and not os.path.isabs(wav_file):
+            wav_file = os.path.join(self.wav_dir, wav_file)
+        return open_wav(wav_file)
+
+    def song(self, wav_file):
+        """get a view of all audio in a .wav file"""
+        return self.wav(wav_file).data
+
+    def sequence(self, seq):
+        """get a view of the audio for a Sequence (or SequenceView)"""
+        return self.wav(seq.wav_file).read(seq.position, seq.length)
+
+    def syllable(self, seq, syl, relative=True):
+        """get a view of the audio for a Syllable from a Sequence
+
+        Parameters
+        ----------
+        seq : Sequence
+        syl : Syllable
+            from seq
+        relative : bool
+            if True, position of syllable is relative to the start of sequence,
+            as for sequences returned by parse_xml. Set to False for songs, i.e.
+            when concat_seqs_into_songs is True. Default is True.
+        """
+        start = seq.position + syl.position if relative else syl.position
+        return self.wav(seq.wav_file).read(start, syl.length)
+
+    def gather(self, wav_files, onsets, lengths, out=None):
+        """copy many windows of audio into one array
+
+        Parameters
+        ----------
+        wav_files : list
+            of .wav file names or paths, one for each window
+        onsets : 1-d array
+            of ints, starting sample number of each window
+        lengths : 1-d array
+            of ints, number of samples in each window
+        out : ndarray
+            preallocated array to copy windows into, with shape
+            (number of windows, at least max(lengths)). Windows shorter than
+            out.shape[1] are padded with zeros. Default is None,
+            in which case an array is allocated, with the dtype of the first file.
+
+        Returns
+        -------
+        out : ndarray
+            with windows of audio
+        """
+        onsets = np.asarray(onsets, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if not (len(wav_files) == onsets.shape[0] == lengths.shape[0]):
+            raise ValueError('wav_files, onsets, and lengths must have the same length')
+        if out is None:
+            dtype = self.wav(wav_files[0]).dtype if len(wav_files) > 0 else np.int16
+            out = np.zeros((len(wav_files), lengths.max(initial=0)), dtype=dtype)
+        else:
+            if out.shape[0] != len(wav_files) or out.shape[1] < lengths.max(initial=0):
+                raise ValueError(f'out must have shape at least ({len(wav_files)}, '
+                                 f'{lengths.max(initial=0)}), but shape was {out.shape}')
+            out[...] = 0
+        # group windows by file, so each file is looked up once
+        wav_files = np.asarray(wav_files)
+        for wav_file in np.unique(wav_files).tolist():
+            wav = self.wav(wav_file)
+            for ind in np.flatnonzero(wav_files == wav_file).tolist():
+                out[ind, :lengths[ind]] = wav.read(onsets[ind], lengths[ind])
+        return out
+
+    def gather_syllables(self, annot, syl_ids=None, out=None):
+        """copy audio for syllables in an AnnotationTable into one array
+
+        Parameters
+        ----------
+        annot : AnnotationTable
+        syl_ids : 1-d array
+            of ints, indices of syllables in annot. Default is None,
+            in which case all syllables are gathered.
+        out : ndarray
+            preallocated array, see AudioReader.gather
+
+        Returns
+        -------
+        out : ndarray
+            with one row of audio for each syllable, padded with zeros
+        lengths : 1-d array
+            number of samples in each row that are from the syllable
+        """
+        if syl_ids is None:
+            syl_ids = np.arange(annot.num_syls)
+        syl_ids = np.asarray(syl_ids)
+        wav_files = annot.wav_files[annot.seq_wav_codes[annot.syl_seq_ids[syl_ids]]]
+        onsets = annot.syl_onsets[syl_ids]
+        lengths = annot.syl_lengths[syl_ids]
+        return self.gather(wav_files.tolist(), onsets, lengths, out=out), lengths
+
+
+def spectrogram(audio, nperseg=512, noverlap=256, window=None, log_transform=True):
+    """compute spectrogram of audio with a short-time Fourier transform
+
+    Parameters
+    ----------
+    audio : 1-d array
+        audio samples
+    nperseg : int
+        number of samples in each segment (frame). Default is 512.
+    noverlap : int
+        number of samples that consecutive frames overlap. Default is 256.
+    window : 1-d array
+        window applied to each frame, with length nperseg. Default is None,
+        in which case a periodic Hann window is used.
+    log_transform : bool
+        if True, return the natural log of the magnitude. Default is True.
+
+    Returns
+    -------
+    spect : 2-d array
+        of float32, with shape (number of frames, nperseg // 2 + 1).
+        Frame i starts at sample i * (nperseg - noverlap). Only frames that
+        fit entirely in audio are computed.
+    """
+    return spectrograms([audio], nperseg, noverlap, window, log_transform)[0]
+
+
+def spectrograms(audio_list, nperseg=512, noverlap=256, window=None, log_transform=True):
+    """compute spectrograms of many arrays of audio at once,
+    with one batched FFT over the frames of all arrays.
+    See spectrogram for parameters.
+
+    Returns
+    -------
+    spects : list
+        of 2-d arrays, one spectrogram for each array in audio_list
+    """
+    if not 0 <= noverlap < nperseg:
+        raise ValueError(f'noverlap must be at least 0 and less than nperseg, '
+                         f'but was {noverlap} with nperseg {nperseg}')
+    if window is None:
+        window = np.hanning(nperseg + 1)[:-1]
+    window = np.asarray(window, dtype=np.float32)
+    if window.shape != (nperseg,):
+        raise ValueError(f'window must have shape ({nperseg},), but shape was {window.shape}')
+    hop = nperseg - noverlap
+    if len(audio_list) == 0:
+        return []
+
+    frames = []
+    for audio in audio_list:
+        audio = np.asarray(audio)
+        if audio.ndim != 1:
+            raise ValueError(f'audio must be 1-d, but had shape {audio.shape}')
+        if audio.shape[0] < nperseg:
+            frames.append(np.zeros((0, nperseg), dtype=np.float32))
+            continue
+        # view of frames, without copying
+        frames.append(np.lib.stride_tricks.as_strided(
+            audio, shape=((audio.shape[0] - nperseg) // hop + 1, nperseg),
+            strides=(audio.strides[0] * hop, audio.strides[0]), writeable=False
+        ))
+    num_frames = [frame.shape[0] for frame in frames]
+    # copy frames into one float32 array, instead of concatenating
+    # and then casting, which would make two copies of every frame
+    offsets = np.concatenate(([0], np.cumsum(num_frames)))
+    batch = np.empty((offsets[-1], nperseg), dtype=np.float32)
+    for frame, start, stop in zip(frames, offsets[:-1], offsets[1:]):
+        batch[start:stop] = frame
+    batch *= window
+    # FFT over blocks of frames, so the complex128 output of np.fft.rfft
+    # is never made for the whole batch at once
+    spects = np.empty((batch.shape[0], nperseg // 2 + 1), dtype=np.float32)
+    block = max(1, 2 ** 22 // nperseg)
+    for start in range(0, batch.shape[0], block):
+        spects[start:start + block] = np.abs(np.fft.rfft(batch[start:start + block], axis=1))
+    if log_transform:
+        np.log(np.maximum(spects, 1e-10, out=spects), out=spects)
+    return np.split(spects, offsets[1:-1])
+
+
+def _compute_spectrograms(cache, wav_files):
+    """compute spectrograms for a batch of .wav files and store them in cache.
+    Runs in worker processes, for SpectrogramCache.compute."""
+    wavs = [open_wav(wav_file) for wav_file in wav_files]
+    for wav in wavs:
+        if wav.num_channels != 1:
+            raise ValueError(f'can only compute spectrograms for one channel, but {wav.path} '
+                             f'has {wav.num_channels}')
+    spects = spectrograms([wav.data for wav in wavs], cache.nperseg, cache.noverlap,
+                          cache.window, cache.log_transform)
+    for wav_file, spect in zip(wav_files, spects):
+        cache._store(wav_file, spect)
+    return len(wav_files)
+
+
+class SpectrogramCache:
+    """Spectrograms of .wav files, computed once and stored on disk.
+
+    Entries are addressed by a hash of the absolute path, size, and modification time
+    of each .wav file, and of the parameters used to compute the spectrogram,
+    so a changed file or new parameters give a new entry. Spectrograms are stored
+    as .npy files that are memory-mapped when loaded. When the total size of entries
+    exceeds max_bytes, least recently used entries are removed.
+
+    Parameters
+    ----------
+    cache_dir : str
+        directory in which to store spectrograms
+    nperseg, noverlap, window, log_transform
+        parameters for computing spectrograms, see spectrogram
+    wav_dir : str
+        directory that contains .wav files, used when wav_file is a file name
+        instead of a path. Default is None.
+    max_bytes : int
+        maximum total size of entries, in bytes. Default is None, in which case
+        entries are never removed.
+
+    Examples
+    --------
+    >>> spect_cache = SpectrogramCache('~/.cache/birdsongrec-spect', wav_dir='./Bird0/Wave')
+    >>> seq_list = parse_xml('./Bird0/Annotation.xml')
+    >>> spect_cache.compute([seq.wav_file for seq in seq_list], max_workers=8)
+    >>> seq_spect = spect_cache.sequence(seq_list[0])  # memory-mapped
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, cache_dir, nperseg=512, noverlap=256, window=None, log_transform=True,
+                 wav_dir=None, max_bytes=None):
+        if not 0 <= noverlap < nperseg:
+            raise ValueError(f'noverlap must be at least 0 and less than nperseg, '
+                             f'but was {noverlap} with nperseg {nperseg}')
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.nperseg = nperseg
+        self.noverlap = noverlap
+        self.window = None if window is None else np.asarray(window, dtype=np.float32)
+        self.log_transform = log_transform
+        self.wav_dir = wav_dir
+        self.max_bytes = max_bytes
+        window_hash = None if self.window is None else hashlib.sha1(self.window.tobytes()).hexdigest()
+        self._params_key = json.dumps([self.FORMAT_VERSION, nperseg, noverlap, window_hash,
+                                       log_transform])
+
+    def __repr__(self):
+        return "SpectrogramCache in {} with nperseg {} and noverlap {}".format(
+            self.cache_dir, self.nperseg, self.noverlap)
+
+    @property
+    def hop(self):
+        """number of samples between the starts of consecutive frames"""
+        return self.nperseg - self.noverlap
+
+    def _wav_path(self, wav_file):
+        if self.wav_dir is not None and not os.path.isabs(wav_file):
+            wav_file = os.path.join(self.wav_dir, wav_file)
+        return os.path.abspath(wav_file)
+
+    def _entry_path(self, wav_file):
+        wav_path = self._wav_path(wav_file)
+        stat = os.stat(wav_path)
+        key = json.dumps([wav_path, stat.st_size, stat.st_mtime_ns, self._params_key])
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+    def _store(self, wav_file, spect):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-', suffix='.npy')
+        with os.fdopen(fd, 'wb') as fp:
+            np.save(fp, spect)
+        os.replace(tmp_path, self._entry_path(wav_file))
+
+    def _entries(self):
+        """os.DirEntry for each entry in cache_dir. Only files named with a key
+        and the suffix .npy are entries; nothing else in cache_dir is ever removed"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return [entry for entry in os.scandir(self.cache_dir)
+                if entry.is_file(follow_symlinks=False) and _is_cache_key(entry.name, '.npy')]
+
+    def _evict(self, keep=None):
+        """remove least recently used entries until total size is at most max_bytes,
+        never removing the entry at path keep, e.g. one about to be loaded"""
+        if self.max_bytes is None:
+            return
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum([size for _, size, _ in entries])
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry_path == keep:
+                continue
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            total -= size
+
+    def __contains__(self, wav_file):
+        return os.path.isfile(self._entry_path(wav_file))
+
+    def compute(self, wav_files, max_workers=None, batch_size=16):
+        """compute spectrograms for .wav files that are not already in the cache
+
+        Parameters
+        ----------
+        wav_files : list
+            of .wav file names or paths. Duplicates are computed once.
+        max_workers : int
+            number of worker processes. Default is None, in which case the number
+            of processors on the machine is used. If 1, spectrograms are computed
+            in this process.
+        batch_size : int
+            number of .wav files whose frames are transformed with one FFT.
+            Default is 16.
+
+        Returns
+        -------
+        num_computed : int
+            number of spectrograms that were computed
+        """
+        wav_paths = sorted(set([self._wav_path(wav_file) for wav_file in wav_files]))
+        missing = [wav_path for wav_path in wav_paths if wav_path not in self]
+        batches = [missing[start:start + batch_size]
+                   for start in range(0, len(missing), batch_size)]
+        if max_workers == 1 or len(batches) < 2:
+            num_computed = sum(map(_compute_spectrograms, [self] * len(batches), batches))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                num_computed = sum(executor.map(_compute_spectrograms,
+                                                [self] * len(batches), batches))
+        self._evict()
+        return num_computed
+
+    def load(self, wav_file):
+        """get memory-mapped spectrogram for a .wav file,
+        computing it and adding it to the cache if needed"""
+        entry_path = self._entry_path(wav_file)
+        try:
+            spect = np.load(entry_path, mmap_mode='r')
+        except (OSError, ValueError):
+            _compute_spectrograms(self, [self._wav_path(wav_file)])
+            self._evict(keep=entry_path)
+            return np.load(entry_path, mmap_mode='r')
+        # mark as recently used, for eviction
+        os.utime(entry_path)
+        return spect
+
+    def frame_range(self, position, length):
+        """get the start and stop of the frames that start within
+        the samples from position to position + length"""
+        start = -(-position // self.hop)
+        stop = -(-(position + length) // self.hop)
+        return start, stop
+
+    def song(self, wav_file):
+        """get spectrogram for a whole .wav file"""
+        return self.load(wav_file)
+
+    def sequence(self, seq):
+        """get frames of spectrogram for a Sequence (or SequenceView) that start within it"""
+        start, stop = self.frame_range(seq.position, seq.length)
+        return self.load(seq.wav_file)[start:stop]
+
+    def clear(self):
+        """remove all entries from the cache, and temporary files left by entries
+        that were being stored. cache_dir is removed only if it is then empty"""
+        for entry in self._entries():
+            os.remove(entry.path)
+        if os.path.isdir(self.cache_dir):
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file(follow_symlinks=False) and entry.name.startswith('.tmp-'):
+                    os.remove(entry.path)
+        try:
+            os.rmdir(self.cache_dir)
+        except OSError:
+            # not empty, or already removed
+            pass
+
+
+def load_song_annot(wav_file, xml_file=None, concat_seqs=True, cache=None):
     """load annotation for specific song from BirdsongRecognition dataset:
     Koumura, T. (2016). BirdsongRecognition (Version 1). figshare.
     https://doi.org/10.6084/m9.figshare.3470165.v1
@@ -228,56 +2010,467 @@ def load_song_annot(wav_file, xml_file=None, concat_seqs=True):
     concat_seqs : bool
         if True, concatenate sequences from the .wav file into one single Sequence.
         Default is True.
+    cache : AnnotationCache
+        used to load annotation if specified. Default is None.
+
+    Returns
+    -------
+    seq_list : list
+        of Sequence objects. If concat_seqs is True, a single Sequence object will be
+        returned.
+
+    Examples
+    --------
+    >>> from birdsongrec import load_song_annot
+    >>> wav1 = load_song_annot(wav_file='1.wav')
+    >>> print(wav1)
+    Sequence from 1.wav with position 32000 and length 214176
+    """
+    dirname, wav_file = os.path.split(wav_file)
+    if xml_file is None:
+        if dirname == '':
+            xml_file = glob.glob('../Annotation.xml')
+        else:
+            xml_file = glob.glob(os.path.join(dirname, '../Annotation.xml'))
+
+        if len(xml_file) < 1:
+            raise ValueError(f'Can\'t open {wav_file}, Annotation.xml file not found in '
+                             f'parent directory {dirname}')
+        elif len(xml_file) > 1:
+            raise ValueError('Can\'t open {}, found more than one Annotation.xml file '
+                             'in parent of current directory'.
+                             format(wav_file))
+        else:
+            xml_file = xml_file[0]
+
+    with _stage('load_song_annot'):
+        with _stage('load_song_annot.get_annotation_index'):
+            index = get_annotation_index(xml_file, cache=cache)
+        if _stats is not None:
+            _stats.count('songs_loaded')
+        return index.load(wav_file, concat_seqs=concat_seqs)
+
+
+def determine_unique_labels(annotation_file, cache=None):
+    """given an annotation.xml file
+    from a bird in BirdsongRecognition dataset,
+    determine unique set of labels applied to syllables from that bird.
+    annotation_file can also be an AnnotationTable.
+    If an AnnotationCache is specified, labels are loaded from the cache when possible."""
+    if isinstance(annotation_file, AnnotationTable):
+        return ''.join(annotation_file.labels.tolist())
+    if cache is not None:
+        return determine_unique_labels(cache.load_table(annotation_file))
+    annotation = parse_xml(annotation_file,
+                           concat_seqs_into_songs=True)
+    lbls = [syl.label
+            for seq in annotation
+            for syl in seq.syls]
+    unique_lbls = np.unique(lbls).tolist()
+    unique_lbls = ''.join(unique_lbls)  # convert from list to string
+    return unique_lbls
+
+
+def num_frames(num_samples, frame_size=512, hop=256):
+    """number of frames of frame_size samples, hop samples apart, that fit entirely
+    in num_samples samples, as for spectrogram with nperseg=frame_size"""
+    return np.maximum(0, (np.asarray(num_samples) - frame_size) // hop + 1)
+
+
+def _label_code_map(annot_labels, labels):
+    """map from label codes of an AnnotationTable to indices into labels"""
+    label_codes = {label: code for code, label in enumerate(list(labels))}
+    missing = [label for label in annot_labels if label not in label_codes]
+    if missing:
+        raise ValueError(f'labels {missing} in annotation are not in labels: {labels}')
+    return np.array([label_codes[label] for label in annot_labels], dtype=np.int32)
+
+
+def _frame_label_codes(syl_onsets, syl_lengths, syl_codes, syl_song_ids, song_num_frames,
+                       frame_size, hop, background):
+    """map syllables from many songs to frames in one pass, without looping over syllables.
+    Returns list with one array of label codes per song."""
+    song_num_frames = np.asarray(song_num_frames, dtype=np.int64)
+    frame_offsets = np.concatenate(([0], np.cumsum(song_num_frames)))
+    out = np.full((frame_offsets[-1],), background, dtype=np.int32)
+    # frame i is labeled with the syllable that contains its center sample,
+    # i * hop + frame_size // 2, so frames first:stop belong to each syllable
+    center = frame_size // 2
+    first = np.maximum(-(-(syl_onsets - center) // hop), 0)
+    stop = np.minimum(-(-(syl_onsets + syl_lengths - center) // hop),
+                      song_num_frames[syl_song_ids])
+    counts = np.maximum(stop - first, 0)
+    # indices of frames for all syllables, one run per syllable
+    run_starts = np.cumsum(counts) - counts
+    frame_inds = (np.arange(counts.sum())
+                  + np.repeat(frame_offsets[syl_song_ids] + first - run_starts, counts))
+    out[frame_inds] = np.repeat(syl_codes, counts)
+    return np.split(out, frame_offsets[1:-1])
+
+
+def frame_labels(annot, frame_size=512, hop=256, num_samples=None, labels=None,
+                 background=None):
+    """make a vector of labels for every frame of every song
+
+    Parameters
+    ----------
+    annot : AnnotationTable, or list of Sequence objects
+        annotation for songs. A list of Sequences should be
+        returned by parse_xml with concat_seqs_into_songs set to True.
+    frame_size : int
+        number of samples in each frame. Default is 512.
+    hop : int
+        number of samples between the starts of consecutive frames. Default is 256.
+        With the defaults, frames are the same as those of spectrogram.
+    num_samples : dict
+        that maps .wav files to their number of samples, used to find the number
+        of frames in each song. Default is None, in which case songs end
+        at the end of their last syllable.
+    labels : str, list, or 1-d array
+        set of labels that codes are indices into. Default is None, in which case
+        the labels of annot are used, that are the same as the labels
+        returned by get_trans_mat.
+    background : int
+        code for frames that are not in any syllable, i.e., silence.
+        Default is None, in which case the code is the number of labels.
+
+    Returns
+    -------
+    wav_files : list
+        of .wav files, one for each song
+    label_vecs : list
+        of 1-d arrays of ints, one for each song, with the label code of each frame.
+        Frame i is labeled with the syllable that contains sample
+        i * hop + frame_size // 2.
+
+    Examples
+    --------
+    >>> annot = AnnotationTable.from_xml('./Bird0/Annotation.xml')
+    >>> trans_mat = get_trans_mat(annot)  # labels are annot.labels
+    >>> wav_files, label_vecs = frame_labels(annot)
+    """
+    if not isinstance(annot, AnnotationTable):
+        annot = AnnotationTable.from_seqs(annot, songs=True)
+    if labels is None:
+        labels = annot.labels
+    if background is None:
+        background = len(labels)
+    syl_codes = _label_code_map(annot.labels.tolist(), labels)[annot.syl_label_codes]
+    syl_onsets = annot.syl_onsets
+    syl_song_ids = annot.seq_wav_codes[annot.syl_seq_ids]
+    wav_files = annot.wav_files.tolist()
+    if num_samples is None:
+        song_ends = np.zeros((len(wav_files),), dtype=np.int64)
+        np.maximum.at(song_ends, syl_song_ids, syl_onsets + annot.syl_lengths)
+    else:
+        song_ends = np.array([num_samples[wav_file] for wav_file in wav_files], dtype=np.int64)
+    label_vecs = _frame_label_codes(syl_onsets, annot.syl_lengths, syl_codes, syl_song_ids,
+                                    num_frames(song_ends, frame_size, hop),
+                                    frame_size, hop, background)
+    return wav_files, label_vecs
+
+
+def iter_frame_labels(songs, labels, frame_size=512, hop=256, num_samples=None,
+                      background=None):
+    """make vectors of labels for frames one song at a time,
+    e.g. for a corpus that is too large to make all at once.
+    See frame_labels for parameters.
+
+    Parameters
+    ----------
+    songs : iterable
+        of Sequence objects, e.g. returned by iter_xml
+        with concat_seqs_into_songs set to True, or an AnnotationTable
+    labels : str, list, or 1-d array
+        set of labels that codes are indices into. Required,
+        because labels of all songs are not known ahead of time.
+
+    Yields
+    ------
+    wav_file : str
+        .wav file of song
+    label_vec : 1-d array
+        label code of each frame in song
+
+    Examples
+    --------
+    >>> labels = determine_unique_labels('./Bird0/Annotation.xml')
+    >>> songs = iter_xml('./Bird0/Annotation.xml', concat_seqs_into_songs=True)
+    >>> for wav_file, label_vec in iter_frame_labels(songs, labels):
+    ...     pass
+    """
+    if background is None:
+        background = len(labels)
+    if isinstance(songs, AnnotationTable):
+        annot = songs
+        code_map = _label_code_map(annot.labels.tolist(), labels)
+        songs = (annot.song(wav_file) for wav_file in annot.wav_files.tolist())
+    else:
+        code_map = None
+    label_codes = {label: code for code, label in enumerate(list(labels))}
+    for song in songs:
+        if code_map is not None:
+            syl_onsets, syl_lengths = song.syl_positions, song.syl_lengths
+            syl_codes = code_map[song.syl_label_codes]
+        else:
+            syl_onsets = np.array([syl.position for syl in song.syls], dtype=np.int64)
+            syl_lengths = np.array([syl.length for syl in song.syls], dtype=np.int64)
+            syl_labels = [syl.label for syl in song.syls]
+            missing = [label for label in syl_labels if label not in label_codes]
+            if missing:
+                raise ValueError(f'labels {missing} in annotation are not in labels: {labels}')
+            syl_codes = np.array([label_codes[label] for label in syl_labels], dtype=np.int32)
+        if num_samples is None:
+            song_end = (syl_onsets + syl_lengths).max(initial=0)
+        else:
+            song_end = num_samples[song.wav_file]
+        label_vec, = _frame_label_codes(syl_onsets, syl_lengths, syl_codes,
+                                        np.zeros(syl_onsets.shape, dtype=np.intp),
+                                        [num_frames(song_end, frame_size, hop)],
+                                        frame_size, hop, background)
+        yield song.wav_file, label_vec
+
+
+def segment_observations(observation_probs, method='argmax', threshold=0.1):
+    """merge consecutive frames of observation probabilities into segments,
+    for Resequencer.resequence_segments
+
+    Parameters
+    ----------
+    observation_probs : ndarray
+        m x p matrix, m estimated probabilities for p classes
+    method : str
+        one of {'argmax', 'threshold'}. If 'argmax', a segment is a run of
+        frames where the class with the highest probability is the same.
+        If 'threshold', a new segment starts at a frame when the probability of
+        any class differs from the previous frame by more than threshold.
+        Default is 'argmax'.
+    threshold : float
+        used when method is 'threshold'. Default is 0.1.
+
+    Returns
+    -------
+    onsets : 1-d array
+        of ints, first frame of each segment
+    lengths : 1-d array
+        of ints, number of frames in each segment
+    """
+    observation_probs = np.asarray(observation_probs)
+    if observation_probs.ndim != 2 or observation_probs.shape[0] < 1:
+        raise ValueError('observation_probs must be a 2-d array with at least one row, '
+                         f'but shape was {observation_probs.shape}')
+    if method == 'argmax':
+        argmax = np.argmax(observation_probs, axis=1)
+        changes = argmax[1:] != argmax[:-1]
+    elif method == 'threshold':
+        changes = np.abs(np.diff(observation_probs, axis=0)).max(axis=1) > threshold
+    else:
+        raise ValueError(f"method must be one of {{'argmax', 'threshold'}}, not {method}")
+    onsets = np.flatnonzero(np.r_[True, changes])
+    lengths = np.diff(np.r_[onsets, observation_probs.shape[0]])
+    return onsets, lengths
+
+
+class NumpyBackend:
+    """Kernels for the hot paths of this module, implemented with NumPy.
+
+    This is the default backend, and the interface for other backends:
+    a backend subclasses NumpyBackend, overrides the kernels it can compute
+    faster, and is added with register_backend. Kernels that are not
+    overridden, and cases an overriding kernel does not handle,
+    fall back to NumPy. Select a backend with set_backend.
+
+    Attributes
+    ----------
+    name : str
+        name used to select backend with set_backend
+    """
+    name = 'numpy'
+
+    def count_trigrams(self, label_codes, seq_lengths, num_labels):
+        """count occurrences of every trigram of labels, used by get_trans_mat
+        and TransitionCounts. Parameters and return value are the same as
+        _count_trigrams."""
+        return _count_trigrams(label_codes, seq_lengths, num_labels)
+
+    def viterbi(self, resequencer, log_obs, lengths, source_states, beam=True):
+        """forward pass of Viterbi over a batch of sequences, used by
+        Resequencer.resequence and Resequencer.resequence_batch
+
+        Parameters
+        ----------
+        resequencer : Resequencer
+        log_obs : ndarray
+            n x m x num_labels, log observation probabilities,
+            sorted by decreasing length
+        lengths : 1-d array
+            of ints, number of time steps in each sequence, in decreasing order
+        source_states : ndarray
+            (m - 1) x n x num_states array of backpointers, filled in place
+        beam : bool
+            if True, prune with beam_width and beam_threshold of resequencer,
+            if specified.
+
+        Returns
+        -------
+        current_score : ndarray
+            n x num_states, score of each state at last time step of each sequence
+        """
+        current_score = resequencer._viterbi_init(log_obs[:, 0])
+        for time_step in range(source_states.shape[0]):
+            # only sequences with more time steps are still being decoded
+            num_active = np.count_nonzero(lengths > time_step + 1)
+            resequencer._viterbi_step(current_score[:num_active],
+                                      log_obs[:num_active, time_step + 1],
+                                      source_states[time_step, :num_active],
+                                      beam=beam)
+        return current_score
+
+
+class NumbaBackend(NumpyBackend):
+    """Kernels compiled with Numba, selected automatically when Numba can be imported.
+
+    Compiled kernels are cached on disk by Numba, next to this module or in
+    the directory set by the NUMBA_CACHE_DIR environment variable, so that
+    they are only compiled once, instead of by every process that uses them,
+    e.g. the workers of resequence_parallel. Results are identical to those
+    of NumpyBackend. Decoding with a SparseTransitionMatrix or with beam pruning
+    uses NumPy.
+    """
+    name = 'numba'
+
+    def __init__(self):
+        # raises ImportError if Numba is not installed
+        self._kernels = _numba_kernels()
+
+    def count_trigrams(self, label_codes, seq_lengths, num_labels):
+        return self._kernels['count_trigrams'](
+            np.ascontiguousarray(label_codes, dtype=np.intp).ravel(),
+            np.ascontiguousarray(seq_lengths, dtype=np.intp), num_labels
+        )
+
+    def viterbi(self, resequencer, log_obs, lengths, source_states, beam=True):
+        if resequencer.sparse or (beam and (resequencer.beam_width is not None
+                                            or resequencer.beam_threshold is not None)):
+            return super().viterbi(resequencer, log_obs, lengths, source_states, beam)
+        if _stats is not None:
+            _stats.count('states_expanded',
+                          (lengths - 1).sum() * (resequencer.num_states - 1))
+        current_score = resequencer._viterbi_init(log_obs[:, 0])
+        self._kernels['viterbi'](current_score, np.ascontiguousarray(log_obs, dtype=float),
+                                 np.asarray(lengths, dtype=np.intp),
+                                 resequencer.log_transition_probs, source_states)
+        return current_score
+
+
+@lru_cache(maxsize=None)
+def _numba_kernels():
+    """compile kernels used by NumbaBackend, or load them from Numba's cache"""
+    import numba
+
+    @numba.njit(cache=True)
+    def count_trigrams(label_codes, seq_lengths, num_labels):
+        counts = np.zeros((num_labels, num_labels, num_labels), dtype=np.int64)
+        seq_start = 0
+        for seq_length in seq_lengths:
+            for syl_ind in range(seq_start + 2, seq_start + seq_length):
+                counts[label_codes[syl_ind - 2], label_codes[syl_ind - 1],
+                       label_codes[syl_ind]] += 1
+            seq_start += seq_length
+        return counts
+
+    @numba.njit(cache=True)
+    def viterbi(current_score, log_obs, lengths, log_trans, source_states):
+        # same states, arithmetic and tie-breaking as Resequencer._viterbi_step,
+        # advancing current_score in place from the first time step to the last
+        num_seqs, _, num_labels = log_obs.shape
+        num_pair_states = (num_labels + 1) * num_labels
+        head_state = num_pair_states
+        next_score = np.empty((num_labels * num_labels,))
+        best_score = np.empty((num_labels,))
+        best_label_one = np.empty((num_labels,), dtype=np.intp)
+        for seq_ind in range(num_seqs):
+            score = current_score[seq_ind]
+            for time_step in range(lengths[seq_ind] - 1):
+                obs = log_obs[seq_ind, time_step + 1]
+                states = source_states[time_step, seq_ind]
+                for label_two in range(num_labels):
+                    best_score[:] = -np.inf
+                    best_label_one[:] = 0
+                    for label_one in range(num_labels + 1):
+                        source_score = score[label_one * num_labels + label_two]
+                        for dest_label in range(num_labels):
+                            candidate = (source_score + log_trans[label_one, label_two,
+                                                                  dest_label]
+                                         + obs[dest_label])
+                            # keep the *last* source state with the max score
+                            if candidate >= best_score[dest_label]:
+                                best_score[dest_label] = candidate
+                                best_label_one[dest_label] = label_one
+                    for dest_label in range(num_labels):
+                        dest_state = label_two * num_labels + dest_label
+                        next_score[dest_state] = best_score[dest_label]
+                        states[dest_state] = best_label_one[dest_label] * num_labels + label_two
+                score[:num_labels * num_labels] = next_score
+                score[num_labels * num_labels:] = -np.inf
+                states[num_labels * num_labels:num_pair_states] = head_state
+
+    return {'count_trigrams': count_trigrams, 'viterbi': viterbi}
+
+
+_BACKENDS = {'numpy': NumpyBackend, 'numba': NumbaBackend}
+# backend in use, or None to select one automatically the first time one is needed
+_backend = None
+
+
+def register_backend(backend_class):
+    """add a backend that can be selected with set_backend
+
+    Parameters
+    ----------
+    backend_class : type
+        subclass of NumpyBackend, with a unique name attribute
+    """
+    if not (isinstance(backend_class, type) and issubclass(backend_class, NumpyBackend)):
+        raise TypeError(f'backend must be a subclass of NumpyBackend, not {backend_class}')
+    _BACKENDS[backend_class.name] = backend_class
+
+
+def set_backend(name=None):
+    """select backend used for counting trigrams and for Viterbi decoding
+
+    Parameters
+    ----------
+    name : str
+        name of a registered backend, e.g. 'numpy' or 'numba'.
+        Default is None, in which case 'numba' is used if Numba can be
+        imported, and 'numpy' otherwise.
 
     Returns
     -------
-    seq_list : list
-        of Sequence objects. If concat_seqs is True, a single Sequence object will be
-        returned.
-
-    Examples
-    --------
-    >>> from birdsongrec import load_song_annot
-    >>> wav1 = load_song_annot(wav_file='1.wav')
-    >>> print(wav1)
-    Sequence from 1.wav with position 32000 and length 214176
+    backend : NumpyBackend
+        instance of backend that was selected
     """
-    dirname, wav_file = os.path.split(wav_file)
-    if xml_file is None:
-        if dirname == '':
-            xml_file = glob.glob('../Annotation.xml')
-        else:
-            xml_file = glob.glob(os.path.join(dirname, '../Annotation.xml'))
-
-        if len(xml_file) < 1:
-            raise ValueError(f'Can\'t open {wav_file}, Annotation.xml file not found in '
-                             f'parent directory {dirname}')
-        elif len(xml_file) > 1:
-            raise ValueError('Can\'t open {}, found more than one Annotation.xml file '
-                             'in parent of current directory'.
-                             format(wav_file))
-        else:
-            xml_file = xml_file[0]
-
-    seq_list = parse_xml(xml_file, concat_seqs_into_songs=concat_seqs)
-    seq_list = [seq for seq in seq_list if seq.wav_file == wav_file]
-    if len(seq_list) == 1:
-        seq_list = seq_list[0]
-    return seq_list
+    global _backend
+    if name is None:
+        try:
+            _backend = NumbaBackend()
+        except ImportError:
+            _backend = NumpyBackend()
+    elif name in _BACKENDS:
+        # raises ImportError if a backend's dependencies are not installed
+        _backend = _BACKENDS[name]()
+    else:
+        raise ValueError(f'backend must be one of {list(_BACKENDS)}, not {name}')
+    return _backend
 
 
-def determine_unique_labels(annotation_file):
-    """given an annotation.xml file
-    from a bird in BirdsongRecognition dataset,
-    determine unique set of labels applied to syllables from that bird"""
-    annotation = parse_xml(annotation_file,
-                           concat_seqs_into_songs=True)
-    lbls = [syl.label
-            for seq in annotation
-            for syl in seq.syls]
-    unique_lbls = np.unique(lbls).tolist()
-    unique_lbls = ''.join(unique_lbls)  # convert from list to string
-    return unique_lbls
+def get_backend():
+    """get backend used for counting trigrams and for Viterbi decoding,
+    selecting one with set_backend if none has been selected yet"""
+    if _backend is None:
+        return set_backend()
+    return _backend
 
 
 class Resequencer:
@@ -302,13 +2495,30 @@ class Resequencer:
         Each string represents a sequence of syllables
     observation_prob : ndarray
         n x m x p matrix, n sequences of m estimated probabilities for p classes
-    transition_prob : ndarray
+    transition_prob : ndarray, or SparseTransitionMatrix
         second-order transition matrix, n x m x p matrix where the value at
         [n,m,p] is the probability of transitioning to labels[p] at time step
         t given that labels[m] was observed at t-1 and labels[n] was observed
-        at t-2
+        at t-2. If a SparseTransitionMatrix, each time step of the vectorized
+        engine only scores transitions that occurred, plus the backoff
+        probability of each pair of labels, so time and memory scale with
+        the number of trigrams that occurred. The result is the same as with
+        the dense matrix, except that when paths have scores that differ only by
+        rounding error, a different one of them can be chosen.
+        Beam pruning and Resequencer.resequence_nbest use a dense table
+        of log probabilities, made the first time it is needed.
     labels : list of chars
         Contains all unique labels used to label songs being resequenced
+    beam_width : int
+        if specified, only this many of the highest-scoring states are expanded
+        at each time step of the vectorized engine. Default is None.
+    beam_threshold : float
+        if specified, only states whose log score is within beam_threshold of
+        the highest log score are expanded at each time step of the
+        vectorized engine. Default is None.
+        Pruning with beam_width or beam_threshold is faster, but the result
+        can differ from the exact result; use Resequencer.evaluate_beam
+        to measure how much.
 
     Returns
     -------
@@ -317,7 +2527,17 @@ class Resequencer:
         e.g. resequenced[0] is sequences[0] after running through the algorithm.
     """
 
-    def __init__(self,transition_probs,labels):
+    def __init__(self,transition_probs,labels,beam_width=None,beam_threshold=None):
+        if beam_width is not None:
+            if type(beam_width) != int:
+                raise TypeError(f'beam_width must be an int, not type {type(beam_width)}')
+            if beam_width < 1:
+                raise ValueError(f'beam_width must be a positive integer, not {beam_width}')
+        if beam_threshold is not None:
+            if beam_threshold < 0:
+                raise ValueError(f'beam_threshold must be non-negative, not {beam_threshold}')
+        self.beam_width = beam_width
+        self.beam_threshold = beam_threshold
         self.transition_probs = transition_probs
         self.labels = labels
         self.num_labels = len(labels)
@@ -326,30 +2546,29 @@ class Resequencer:
         #num_states calculation: +1 for 'e' state at beginning of initial states
         #number of labels (now without 'e') and + 1 for the final 'tail' state
         self.num_states = (self.num_labels + 1) * self.num_labels + 1
-        # create dict of lists used to determine 'destination' state
-        # given source state (key) and emitted label (index into each list)
-        # i..e if source state is 5, destination_state{5} will return a list as
-        # long as the number of labels, indexing into that list w/ e.g. index 4
-        # will return some state number that then becomes the destination state
-        # so len(destination_states.keys()) == num_states
-        self.destination_states = {}
-        dst_state_ctr = 0
-        for label_one in range(0,self.num_labels+1):  # +1 for 'e' state
-            for label_two in range(0,self.num_labels):  # now without e
-                dest_label_one = label_two
-                dest_state_list = []
-                for dest_label_two in range(0,self.num_labels):
-                    dest_state_list.append(
-                        dest_label_one * self.num_labels + dest_label_two)
-                self.destination_states[dst_state_ctr] = dest_state_list
-                dst_state_ctr += 1
-        # + 1 for the final tail states
-        dest_label_one = self.num_labels
-        dest_state_list = []
-        for dest_label_two in range(0,self.num_labels):
-            dest_state_list.append(
-                dest_label_one * self.num_labels + dest_label_two)
-        self.destination_states[dst_state_ctr] = dest_state_list
+        # number of states that have a label_one and label_two, i.e. all but head
+        num_pair_states = (self.num_labels + 1) * self.num_labels
+        # labels of each state, state_labels[state] = [label_one, label_two],
+        # where num_labels stands for 'e'. State number is
+        # label_one * num_labels + label_two, and last state is head state, 'e' 'e'
+        self.state_labels = np.empty((self.num_states, 2), dtype=np.int32)
+        self.state_labels[:num_pair_states, 0] = np.repeat(np.arange(self.num_labels + 1),
+                                                           self.num_labels)
+        self.state_labels[:num_pair_states, 1] = np.tile(np.arange(self.num_labels),
+                                                         self.num_labels + 1)
+        self.state_labels[self.num_states - 1] = self.num_labels
+        # table used to determine 'destination' state given source state (row)
+        # and emitted label (column), i.e. if source state is [label_one, label_two]
+        # and emitted label is dest_label, destination state is [label_two, dest_label]
+        # so destination_table.shape == (num_states, num_labels)
+        self.destination_table = (
+            self.state_labels[:, 1:] * self.num_labels + np.arange(self.num_labels)
+        ).astype(np.int32)
+        # dict of lists with the same destination states, used by reference engine
+        self.destination_states = {
+            state: dest_state_list
+            for state, dest_state_list in enumerate(self.destination_table.tolist())
+        }
         # number of tail states = num_states because any state can transition to
         # a tail state and the tail state is non-emitting
         self.tail_states = list(range(0,self.num_states))
@@ -360,7 +2579,702 @@ class Resequencer:
         #initial states.
         self.initial_transition_prob = 1.0 / self.num_labels
 
-    def resequence(self,observation_probs):
+        self.sparse = isinstance(transition_probs, SparseTransitionMatrix)
+        if self.sparse:
+            self._init_sparse(transition_probs)
+            self._log_transition_probs = None
+        else:
+            self._log_transition_probs = self._make_log_transition_probs(transition_probs)
+        # smallest dtype that can hold any state number, used for backpointers
+        self.backpointer_dtype = np.min_scalar_type(self.num_states - 1)
+
+    def _make_log_transition_probs(self, transition_probs):
+        # log of transition probabilities, indexed by [label_one, label_two, dest_label]
+        # where label_one == num_labels is the 'e' state, for which the transition
+        # probability is always the initial transition probability.
+        # Used by the vectorized engine so that each time step is one max / argmax
+        # over a (num_labels + 1) x num_labels x num_labels array of scores.
+        # Reshaped to (num_pair_states, num_labels), it is indexed by
+        # [source state, dest_label]
+        log_trans = np.empty((self.num_labels + 1, self.num_labels, self.num_labels))
+        with np.errstate(divide='ignore'):
+            log_trans[:self.num_labels] = np.log(
+                np.asarray(transition_probs, dtype=float)[:self.num_labels,
+                                                          :self.num_labels,
+                                                          :self.num_labels]
+            )
+        log_trans[self.num_labels] = np.log(self.initial_transition_prob)
+        return log_trans
+
+    def _init_sparse(self, transition_probs):
+        """precompute tables used by _viterbi_step_sparse"""
+        num_labels = self.num_labels
+        if transition_probs.num_labels < num_labels:
+            raise ValueError(f'transition_probs has {transition_probs.num_labels} labels, '
+                             f'but there are {num_labels} labels')
+        trigrams = transition_probs.trigrams
+        keep = np.all(trigrams < num_labels, axis=1)
+        label_one, label_two, dest_label = trigrams[keep].T
+        log_probs = transition_probs.probs[keep]
+        # log of backoff probabilities, indexed by [label_one, label_two],
+        # with initial transition probability for 'e' state, as in log_transition_probs
+        log_backoff = np.empty((num_labels + 1, num_labels))
+        with np.errstate(divide='ignore'):
+            log_backoff[:num_labels] = np.log(
+                transition_probs.backoff[:num_labels, :num_labels]
+            )
+            log_probs = np.log(log_probs)
+        log_backoff[num_labels] = np.log(self.initial_transition_prob)
+        self._log_backoff = log_backoff.ravel()
+
+        # trigrams that occurred, grouped by destination state [label_two, dest_label],
+        # in ascending order of label_one within each group
+        order = np.lexsort((label_one, dest_label, label_two))
+        label_one, label_two, dest_label = label_one[order], label_two[order], dest_label[order]
+        dest_states = label_two * num_labels + dest_label
+        self._sparse_label_one = label_one
+        self._sparse_source_states = label_one * num_labels + label_two
+        self._sparse_dest_labels = dest_label
+        self._sparse_log_probs = log_probs[order]
+        self._sparse_group_starts = np.flatnonzero(
+            np.r_[True, dest_states[1:] != dest_states[:-1]]
+        ) if dest_states.size else np.zeros((0,), dtype=np.intp)
+        self._sparse_group_sizes = np.diff(np.r_[self._sparse_group_starts, dest_states.size])
+        self._sparse_group_dest_states = dest_states[self._sparse_group_starts]
+
+    @property
+    def log_transition_probs(self):
+        if self._log_transition_probs is None:
+            self._log_transition_probs = self._make_log_transition_probs(
+                self.transition_probs.to_dense()
+            )
+        return self._log_transition_probs
+
+    def _stay_log_transition_probs(self):
+        """log_transition_probs[:, label, label] for every label,
+        without making the dense table if transition_probs is sparse"""
+        label_range = np.arange(self.num_labels)
+        if not self.sparse:
+            return self.log_transition_probs[:, label_range, label_range]
+        stay_trans = self._log_backoff.reshape(self.num_labels + 1, self.num_labels).copy()
+        stay = self._sparse_source_states % self.num_labels == self._sparse_dest_labels
+        stay_trans[self._sparse_label_one[stay], self._sparse_dest_labels[stay]] = \
+            self._sparse_log_probs[stay]
+        return stay_trans
+
+    ENGINES = ('vectorized', 'reference')
+
+    def resequence(self, observation_probs, engine='vectorized'):
+        """find most likely sequence of labels given observation probabilities
+
+        Parameters
+        ----------
+        observation_probs : ndarray
+            m x p matrix, m estimated probabilities for p classes, i.e.
+            observation_probs[t, p] is the probability of labels[p] at time step t
+        engine : str
+            one of {'vectorized', 'reference'}. The 'vectorized' engine computes
+            each time step as a single max / argmax over an array of scores with
+            NumPy. The 'reference' engine is the original pure-Python loop,
+            kept to test that the engines give the same result.
+            Default is 'vectorized'.
+
+        Returns
+        -------
+        resequenced : list
+            of labels, the most likely label at each time step
+        """
+        if engine not in self.ENGINES:
+            raise ValueError(f'engine must be one of {self.ENGINES}, not {engine}')
+        with _stage('Resequencer.resequence'):
+            if engine == 'vectorized':
+                return self._resequence_vectorized(observation_probs)
+            else:
+                if _stats is not None:
+                    _stats.count('frames_decoded', len(observation_probs))
+                return self._resequence_reference(observation_probs)
+
+    def resequence_batch(self, observation_probs, lengths=None, batch_size=None):
+        """find most likely sequence of labels for many sequences at once
+
+        All sequences in a batch are decoded together, so that each vectorized
+        time step advances every sequence that has not yet ended.
+
+        Parameters
+        ----------
+        observation_probs : ndarray, or list of ndarray
+            either an n x m x p array, n sequences of m estimated probabilities
+            for p classes, padded along the second axis to the length of the
+            longest sequence, or a list of n arrays, each m_i x p
+        lengths : array-like
+            of ints, number of time steps in each sequence. Required to ignore
+            padding in a 3-d array; default is None, in which case
+            every sequence in a 3-d array is assumed to have m time steps,
+            and the length of each array in a list is used.
+        batch_size : int
+            number of sequences to decode together. Memory used scales with
+            batch_size x (num_labels + 1) x num_labels x num_labels.
+            Default is None, in which case all sequences are decoded together.
+
+        Returns
+        -------
+        resequenced : list
+            of lists of labels, one for each sequence in observation_probs,
+            in the same order
+        """
+        if isinstance(observation_probs, np.ndarray):
+            if observation_probs.ndim != 3:
+                raise ValueError('observation_probs must be a 3-d array or a list of 2-d arrays, '
+                                 f'but array had {observation_probs.ndim} dimensions')
+            num_seqs, max_len = observation_probs.shape[:2]
+            if lengths is None:
+                lengths = np.full((num_seqs,), max_len)
+        else:
+            observation_probs = [np.asarray(obs) for obs in observation_probs]
+            num_seqs = len(observation_probs)
+            if lengths is None:
+                lengths = [obs.shape[0] for obs in observation_probs]
+            max_len = max([obs.shape[0] for obs in observation_probs], default=0)
+        lengths = np.asarray(lengths, dtype=int)
+        if lengths.shape != (num_seqs,):
+            raise ValueError(f'lengths must have one element for each of the {num_seqs} '
+                             f'sequences, but shape was {lengths.shape}')
+        if np.any(lengths < 1) or np.any(lengths > max_len):
+            raise ValueError(f'lengths must be between 1 and {max_len}')
+        if batch_size is None:
+            batch_size = max(num_seqs, 1)
+
+        resequenced = []
+        with _stage('Resequencer.resequence_batch'):
+            for batch_start in range(0, num_seqs, batch_size):
+                batch_inds = range(batch_start, min(batch_start + batch_size, num_seqs))
+                batch_lengths = lengths[batch_inds.start:batch_inds.stop]
+                batch_max_len = batch_lengths.max()
+                if isinstance(observation_probs, np.ndarray):
+                    batch_obs = observation_probs[batch_inds.start:batch_inds.stop,
+                                                  :batch_max_len, :self.num_labels]
+                else:
+                    # pad with ones, so log of padding is zero instead of -inf
+                    batch_obs = np.ones((len(batch_inds), batch_max_len, self.num_labels))
+                    for batch_ind, seq_ind in enumerate(batch_inds):
+                        seq_len = batch_lengths[batch_ind]
+                        batch_obs[batch_ind, :seq_len] = \
+                            observation_probs[seq_ind][:seq_len, :self.num_labels]
+                if _stats is not None:
+                    _stats.peak('Resequencer.batch_observation_probs', batch_obs)
+                resequenced.extend(self._viterbi_batch(batch_obs, batch_lengths)[0])
+        return resequenced
+
+    def stream(self, lag=None):
+        """get a StreamingResequencer, to decode observation probabilities
+        in chunks as they arrive. See StreamingResequencer for details."""
+        return StreamingResequencer(self, lag=lag)
+
+    def resequence_nbest(self, observation_probs, k=5):
+        """find the k most likely sequences of labels, and their log scores,
+        in one forward pass
+
+        Uses a list Viterbi algorithm: instead of only the best path into each
+        state, the k best paths into each state are kept, each with a backpointer
+        to a state and to which of its k paths it extends. Memory used grows
+        linearly with k. Beam pruning is not used.
+
+        Parameters
+        ----------
+        observation_probs : ndarray
+            m x p matrix, m estimated probabilities for p classes
+        k : int
+            number of sequences to find. Default is 5.
+
+        Returns
+        -------
+        resequenced : list
+            of up to k lists of labels, distinct sequences of labels in order
+            of decreasing log score. resequenced[0] is the same as the result of
+            resequence. Fewer than k are returned if fewer than k sequences
+            have a probability greater than zero.
+        log_scores : 1-d array
+            log score of each sequence in resequenced
+        """
+        if type(k) != int:
+            raise TypeError(f'k must be an int, not type {type(k)}')
+        if k < 1:
+            raise ValueError(f'k must be a positive integer, not {k}')
+        with _stage('Resequencer.resequence_nbest'):
+            observation_probs = np.asarray(observation_probs)[:, :self.num_labels]
+            num_labels = self.num_labels
+            length = observation_probs.shape[0]
+            with np.errstate(divide='ignore'):
+                log_obs = np.log(observation_probs)
+            if _stats is not None:
+                _stats.count('frames_decoded', length)
+
+            # scores[label_one, label_two, rank] is the log score of the rank-th best
+            # path into state [label_one, label_two]; label_one == num_labels is 'e'
+            scores = np.full((num_labels + 1, num_labels, k), -np.inf)
+            scores[num_labels, :, 0] = np.log(self.initial_transition_prob) + log_obs[0]
+            # backpointers[t, label_two, dest_label, rank] is the candidate that the
+            # rank-th best path into state [label_two, dest_label] at time step t + 1
+            # extends, as an index into candidates ordered by
+            # (label_one, from num_labels down to 0) then rank, see below
+            backpointers = np.zeros((max(length - 1, 0), num_labels, num_labels, k),
+                                    dtype=np.min_scalar_type((num_labels + 1) * k - 1))
+            if _stats is not None:
+                _stats.peak('Resequencer.nbest_backpointers', backpointers)
+            for time_step in range(length - 1):
+                # (label_one, label_two, rank, dest_label), summed in same order as resequence
+                candidates = scores[:, :, :, np.newaxis] + \
+                    self.log_transition_probs[:, :, np.newaxis, :]
+                candidates += log_obs[time_step + 1]
+                # -> (label_two, dest_label, label_one reversed, rank), so that
+                # a stable sort breaks ties by keeping the *last* label_one first,
+                # as resequence does
+                candidates = candidates[::-1].transpose(1, 3, 0, 2).reshape(
+                    num_labels, num_labels, (num_labels + 1) * k
+                )
+                if k < candidates.shape[2]:
+                    # only sort the best k, after partitioning, keeping ties in order
+                    kth_best = -np.partition(-candidates, k - 1, axis=2)[:, :, k - 1:k]
+                    candidates = np.where(candidates >= kth_best, candidates, -np.inf)
+                best = np.argsort(-candidates, axis=2, kind='stable')[:, :, :k]
+                backpointers[time_step] = best
+                scores = np.full((num_labels + 1, num_labels, k), -np.inf)
+                scores[:num_labels] = np.take_along_axis(candidates, best, axis=2)
+                if _stats is not None:
+                    _stats.count('states_expanded', (num_labels + 1) * num_labels * k)
+
+            # best k of all (state, rank), ties broken by first state then rank
+            final_scores = scores.reshape(-1)
+            final = np.argsort(-final_scores, kind='stable')[:k]
+            final = final[final_scores[final] > -np.inf]
+            resequenced = []
+            for state_rank in final.tolist():
+                state, rank = divmod(state_rank, k)
+                state_path = np.empty((length,), dtype=np.intp)
+                state_path[-1] = state
+                for time_step in range(length - 2, -1, -1):
+                    label_one, label_two = divmod(state, num_labels)
+                    candidate = int(backpointers[time_step, label_one, label_two, rank])
+                    source_label_one, rank = divmod(candidate, k)
+                    state = (num_labels - source_label_one) * num_labels + label_one
+                    state_path[time_step] = state
+                resequenced.append(self._state_path_labels(state_path))
+            return resequenced, final_scores[final]
+
+    def resequence_segments(self, observation_probs, method='argmax', threshold=0.1,
+                            return_segments=False):
+        """find most likely sequence of labels, decoding over segments of consecutive
+        frames instead of over every frame, which is much faster when frames
+        within syllables and silent periods have similar probabilities
+
+        Frames are merged into segments with segment_observations. Every frame in
+        a segment gets the same label, and paths are scored exactly as resequence
+        scores them, so the only difference from resequence is that the label
+        can not change within a segment; use evaluate_segments to measure
+        how much results differ.
+
+        Parameters
+        ----------
+        observation_probs : ndarray
+            m x p matrix, m estimated probabilities for p classes
+        method : str
+            one of {'argmax', 'threshold'}, see segment_observations. Default is 'argmax'.
+        threshold : float
+            used when method is 'threshold', see segment_observations. Default is 0.1.
+        return_segments : bool
+            if True, return labels of segments instead of frames.
+            Default is False.
+
+        Returns
+        -------
+        resequenced : list
+            of labels, the most likely label at each time step.
+            Returned if return_segments is False.
+        segment_labels, onsets, lengths : list, 1-d array, 1-d array
+            label, first time step, and number of time steps of each segment.
+            Consecutive segments with the same label are merged.
+            Returned if return_segments is True.
+        """
+        observation_probs = np.asarray(observation_probs)[:, :self.num_labels]
+        with _stage('Resequencer.resequence_segments'):
+            onsets, lengths = segment_observations(observation_probs, method, threshold)
+            resequenced = self._viterbi_segments(observation_probs, onsets, lengths)
+        if not return_segments:
+            return resequenced
+        # merge segments with the same label
+        labels = np.array(resequenced, dtype=object)
+        run_onsets = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+        run_lengths = np.diff(np.r_[run_onsets, labels.shape[0]])
+        return labels[run_onsets].tolist(), run_onsets, run_lengths
+
+    def evaluate_segments(self, observation_probs, method='argmax', threshold=0.1):
+        """measure how much the result of decoding over segments, with
+        resequence_segments, differs from the result of resequence
+
+        Parameters are the same as for resequence_segments.
+
+        Returns
+        -------
+        segments_eval : dict
+            with the following keys:
+                'resequenced' : list, labels found by decoding over segments
+                'exact' : list, labels found by decoding over frames
+                'num_different' : int, number of time steps where labels differ
+                'label_error_rate' : float, num_different divided by number of time steps
+                'num_frames' : int, number of time steps
+                'num_segments' : int, number of segments decoded
+                'compression' : float, num_frames divided by num_segments
+        """
+        observation_probs = np.asarray(observation_probs)[:, :self.num_labels]
+        onsets, _ = segment_observations(observation_probs, method, threshold)
+        resequenced = self.resequence_segments(observation_probs, method, threshold)
+        exact = self.resequence(observation_probs)
+        num_different = sum([label != exact_label
+                             for label, exact_label in zip(resequenced, exact)])
+        return {
+            'resequenced': resequenced,
+            'exact': exact,
+            'num_different': num_different,
+            'label_error_rate': num_different / len(exact),
+            'num_frames': len(exact),
+            'num_segments': onsets.shape[0],
+            'compression': len(exact) / onsets.shape[0],
+        }
+
+    def _viterbi_segments(self, observation_probs, onsets, lengths):
+        """Viterbi over segments of frames that all get the same label.
+
+        Each segment is decoded as one ordinary time step for its first frame,
+        which can change the label, followed by one 'stay' step for the rest of
+        its frames: from state [label_one, label] to state [label, label], with
+        log score log_trans[label_one, label, label]
+        + (num_frames - 2) * log_trans[label, label, label]
+        + the summed log observation probabilities of the frames"""
+        num_labels = self.num_labels
+        num_segments = onsets.shape[0]
+        with np.errstate(divide='ignore'):
+            log_obs = np.log(observation_probs)
+        # log observation probabilities of all frames but the first in each segment,
+        # summed over just those frames, since subtracting the first frame from
+        # the sum of all frames gives nan when the first frame has probability zero
+        is_rest = np.ones((observation_probs.shape[0],), dtype=bool)
+        is_rest[onsets] = False
+        rest_lengths = lengths - 1
+        multi_frame = rest_lengths > 0
+        rest_log_obs = np.zeros((num_segments, num_labels))
+        if np.any(multi_frame):
+            rest_starts = (np.cumsum(rest_lengths) - rest_lengths)[multi_frame]
+            rest_log_obs[multi_frame] = np.add.reduceat(log_obs[is_rest], rest_starts, axis=0)
+        # log_trans[label_one, label, label], and log_trans[label, label, label]
+        label_range = np.arange(num_labels)
+        stay_trans = self._stay_log_transition_probs()
+        self_trans = stay_trans[label_range, label_range]
+        stay_dest_states = label_range * num_labels + label_range
+        if _stats is not None:
+            _stats.count('frames_decoded', observation_probs.shape[0])
+            _stats.count('segments_decoded', num_segments)
+
+        # best source state at first frame of each segment, and of 'stay' step
+        first_source_states = np.zeros((num_segments, 1, self.num_states),
+                                       dtype=self.backpointer_dtype)
+        stay_source_states = np.zeros((num_segments, num_labels), dtype=self.backpointer_dtype)
+        current_score = self._viterbi_init(log_obs[onsets[:1]])
+        for segment in range(num_segments):
+            if segment > 0:
+                self._viterbi_step(current_score, log_obs[onsets[segment]][np.newaxis],
+                                   first_source_states[segment])
+            if lengths[segment] > 1:
+                # (label_one, label), summed in same order as resequence
+                scores = current_score[0, :(num_labels + 1) * num_labels].reshape(
+                    num_labels + 1, num_labels) + stay_trans
+                # reference keeps the *last* source state with the max score
+                best_label_one = num_labels - np.argmax(scores[::-1], axis=0)
+                current_score[:] = -np.inf
+                stay_score = scores.max(axis=0)
+                if lengths[segment] > 2:
+                    # only add self-transitions that happen, since 0 * -inf is nan
+                    stay_score = stay_score + (lengths[segment] - 2) * self_trans
+                current_score[0, stay_dest_states] = stay_score + rest_log_obs[segment]
+                stay_source_states[segment] = best_label_one * num_labels + label_range
+
+        # traceback to state at every frame
+        state_path = np.empty((observation_probs.shape[0],), dtype=np.intp)
+        state = int(np.argmax(current_score[0]))
+        for segment in range(num_segments - 1, -1, -1):
+            onset, length = onsets[segment], lengths[segment]
+            if length > 1:
+                state_path[onset + 1:onset + length] = state
+                state = int(stay_source_states[segment, state // num_labels])
+            state_path[onset] = state
+            if segment > 0:
+                state = int(first_source_states[segment, 0, state])
+        return self._state_path_labels(state_path)
+
+    def evaluate_beam(self, observation_probs):
+        """measure how much the result of decoding with beam pruning
+        differs from the exact result
+
+        Parameters
+        ----------
+        observation_probs : ndarray
+            m x p matrix, m estimated probabilities for p classes
+
+        Returns
+        -------
+        beam_eval : dict
+            with the following keys:
+                'resequenced' : list, labels found with beam pruning
+                'exact' : list, labels found without pruning
+                'num_different' : int, number of time steps where labels differ
+                'label_error_rate' : float, num_different divided by number of time steps
+                'log_score' : float, log score of best path found with pruning
+                'exact_log_score' : float, log score of best path found without pruning
+                'log_score_difference' : float, exact_log_score minus log_score,
+                always greater than or equal to zero
+        """
+        observation_probs = np.asarray(observation_probs)[np.newaxis, :, :self.num_labels]
+        lengths = np.array([observation_probs.shape[1]])
+        resequenced, log_score = self._viterbi_batch(observation_probs, lengths)
+        exact, exact_log_score = self._viterbi_batch(observation_probs, lengths, beam=False)
+        resequenced, log_score = resequenced[0], log_score[0]
+        exact, exact_log_score = exact[0], exact_log_score[0]
+        num_different = sum([label != exact_label
+                             for label, exact_label in zip(resequenced, exact)])
+        return {
+            'resequenced': resequenced,
+            'exact': exact,
+            'num_different': num_different,
+            'label_error_rate': num_different / len(exact),
+            'log_score': log_score,
+            'exact_log_score': exact_log_score,
+            'log_score_difference': exact_log_score - log_score,
+        }
+
+    def _resequence_vectorized(self, observation_probs):
+        observation_probs = np.asarray(observation_probs)
+        return self._viterbi_batch(observation_probs[np.newaxis, :, :self.num_labels],
+                                   np.array([observation_probs.shape[0]]))[0][0]
+
+    def _viterbi_batch(self, observation_probs, lengths, beam=True):
+        """vectorized Viterbi over a batch of sequences.
+
+        observation_probs is n x m x num_labels, lengths is n.
+        Sequences are sorted by length so that the sequences still being
+        decoded at any time step are a prefix of the batch.
+        If beam is True, prune with beam_width and beam_threshold, if specified.
+        Returns list of label lists, and array of log scores of best paths."""
+        num_seqs = observation_probs.shape[0]
+        if lengths.max(initial=0) == 0:
+            # no time steps, so each best path is empty, with log score 0
+            return [[] for _ in range(num_seqs)], np.zeros((num_seqs,))
+        order = np.argsort(-lengths, kind='stable')
+        lengths = lengths[order]
+        with np.errstate(divide='ignore'):
+            log_obs = np.log(observation_probs[order])
+        num_time_steps = lengths[0] - 1
+        # backpointers, source_states[t, seq, state] is the best source state
+        # at time step t for state at time step t + 1
+        source_states = np.zeros((num_time_steps, num_seqs, self.num_states),
+                                 dtype=self.backpointer_dtype)
+        if _stats is not None:
+            _stats.count('sequences_decoded', num_seqs)
+            _stats.count('frames_decoded', lengths.sum())
+            _stats.peak('Resequencer.backpointers', source_states)
+
+        with _stage('Resequencer.viterbi'):
+            current_score = get_backend().viterbi(self, log_obs, lengths, source_states,
+                                                  beam=beam)
+
+        with _stage('Resequencer.traceback'):
+            resequenced = [None] * num_seqs
+            for seq_ind in range(num_seqs):
+                resequenced[order[seq_ind]] = self._traceback(
+                    source_states[:, seq_ind], current_score[seq_ind], lengths[seq_ind]
+                )
+        best_scores = np.empty((num_seqs,))
+        best_scores[order] = current_score.max(axis=1)
+        return resequenced, best_scores
+
+    def _viterbi_init(self, log_obs):
+        """initial inductive step of Viterbi, from head state to the 'e' states.
+
+        log_obs is n x num_labels, log observation probabilities at first time step.
+        Returns n x num_states array of scores."""
+        num_labels = self.num_labels
+        current_score = np.full((log_obs.shape[0], self.num_states), -np.inf)
+        current_score[:, num_labels * num_labels:(num_labels + 1) * num_labels] = \
+            np.log(self.initial_transition_prob) + log_obs
+        return current_score
+
+    def _viterbi_step(self, current_score, log_obs, source_states, beam=True):
+        """advance n x num_states array current_score by one time step, in place,
+        given n x num_labels log observation probabilities at that time step.
+        Best source state of each state is written into n x num_states source_states"""
+        if beam and (self.beam_width is not None or self.beam_threshold is not None):
+            for seq_ind in range(current_score.shape[0]):
+                self._viterbi_step_beam(current_score[seq_ind], log_obs[seq_ind],
+                                        source_states[seq_ind])
+            return
+        if self.sparse:
+            self._viterbi_step_sparse(current_score, log_obs, source_states)
+            return
+
+        num_labels = self.num_labels
+        # number of states that have a label_one and label_two, i.e. all but head
+        num_pair_states = (num_labels + 1) * num_labels
+        num_seqs = current_score.shape[0]
+        scores = current_score[:, :num_pair_states].reshape(
+            num_seqs, num_labels + 1, num_labels
+        )
+        # (seq, label_one, label_two, dest_label), summed in same order as reference
+        scores = scores[:, :, :, np.newaxis] + self.log_transition_probs
+        scores += log_obs[:, np.newaxis, np.newaxis, :]
+        # reference keeps the *last* source state with the max score,
+        # so take argmax along reversed label_one axis
+        best_label_one = num_labels - np.argmax(scores[:, ::-1], axis=1)
+        current_score[:, :num_labels * num_labels] = scores.max(axis=1).reshape(num_seqs, -1)
+        if _stats is not None:
+            _stats.count('states_expanded', num_seqs * num_pair_states)
+            _stats.peak('Resequencer.step_scores', scores)
+        # 'e' states and head state can only be reached from head state,
+        # which always has a score of -inf
+        current_score[:, num_labels * num_labels:] = -np.inf
+        # for destination state [label_two, dest_label], the source states are
+        # [label_one, label_two] for all label_one, so source state number is
+        # label_one * num_labels + label_two
+        source_states[:, :num_labels * num_labels] = (
+            best_label_one * num_labels + np.arange(num_labels)[:, np.newaxis]
+        ).reshape(num_seqs, -1)
+        source_states[:, num_labels * num_labels:num_pair_states] = self.head_state
+
+    def _viterbi_step_sparse(self, current_score, log_obs, source_states):
+        """advance n x num_states array current_score by one time step, in place,
+        like _viterbi_step, scoring only transitions that occurred
+        plus the backoff probability of each source state"""
+        num_labels = self.num_labels
+        num_pair_states = (num_labels + 1) * num_labels
+        num_seqs = current_score.shape[0]
+        scores = current_score[:, :num_pair_states]
+        # every transition from source state [label_one, label_two] that did not
+        # occur has the same backoff probability, so the best source of
+        # destination state [label_two, dest_label] among them is the same
+        # for all dest_label
+        backoff_scores = (scores + self._log_backoff).reshape(num_seqs, num_labels + 1,
+                                                               num_labels)
+        # reference keeps the *last* source state with the max score
+        best_label_one = np.repeat(num_labels - np.argmax(backoff_scores[:, ::-1], axis=1),
+                                   num_labels, axis=1)
+        next_score = (backoff_scores.max(axis=1)[:, :, np.newaxis]
+                      + log_obs[:, np.newaxis, :]).reshape(num_seqs, -1)
+
+        group_starts = self._sparse_group_starts
+        if group_starts.size:
+            # (seq, trigram that occurred), summed in same order as reference
+            candidates = scores[:, self._sparse_source_states] + self._sparse_log_probs
+            candidates += log_obs[:, self._sparse_dest_labels]
+            group_max = np.maximum.reduceat(candidates, group_starts, axis=1)
+            is_max = candidates == np.repeat(group_max, self._sparse_group_sizes, axis=1)
+            group_label_one = np.maximum.reduceat(
+                np.where(is_max, self._sparse_label_one, -1), group_starts, axis=1
+            )
+            if _stats is not None:
+                _stats.peak('Resequencer.step_scores', candidates)
+            # the probability of a transition that occurred is greater than
+            # the backoff probability, so where the same label_one is best
+            # its score from the transition that occurred wins
+            dest_states = self._sparse_group_dest_states
+            backoff_max = next_score[:, dest_states]
+            backoff_label_one = best_label_one[:, dest_states]
+            better = (group_max > backoff_max) | (
+                (group_max == backoff_max) & (group_label_one > backoff_label_one)
+            )
+            next_score[:, dest_states] = np.where(better, group_max, backoff_max)
+            best_label_one[:, dest_states] = np.where(better, group_label_one,
+                                                      backoff_label_one)
+        if _stats is not None:
+            _stats.count('states_expanded', num_seqs * num_pair_states)
+
+        current_score[:, :num_labels * num_labels] = next_score
+        current_score[:, num_labels * num_labels:] = -np.inf
+        source_states[:, :num_labels * num_labels] = (
+            best_label_one * num_labels + np.repeat(np.arange(num_labels), num_labels)
+        )
+        source_states[:, num_labels * num_labels:num_pair_states] = self.head_state
+
+    def _viterbi_step_beam(self, current_score, log_obs, source_states):
+        """advance scores of one sequence by one time step, in place,
+        only expanding states kept after pruning with beam_width and beam_threshold"""
+        num_labels = self.num_labels
+        num_pair_states = (num_labels + 1) * num_labels
+        scores = current_score[:num_pair_states]
+        active = np.flatnonzero(scores > -np.inf)
+        if self.beam_threshold is not None and active.size > 0:
+            active = active[scores[active] >= scores[active].max() - self.beam_threshold]
+        if self.beam_width is not None and active.size > self.beam_width:
+            top = np.argpartition(-scores[active], self.beam_width - 1)[:self.beam_width]
+            active = np.sort(active[top])
+        if _stats is not None:
+            _stats.count('states_expanded', active.size)
+        if active.size == 0:
+            # every score is -inf, e.g. all observation probabilities were zero,
+            # so fill in scores and source states as the exact step does
+            current_score[:] = -np.inf
+            source_states[:num_labels * num_labels] = (
+                num_labels * num_labels + np.repeat(np.arange(num_labels), num_labels)
+            )
+            source_states[num_labels * num_labels:num_pair_states] = self.head_state
+            return
+
+        # destination states of source state [label_one, label_two] are
+        # [label_two, dest_label] for all dest_label, so group active source states
+        # by label_two, in ascending order of source state within each group
+        active = active[np.lexsort((active, active % num_labels))]
+        label_two = active % num_labels
+        group_starts = np.flatnonzero(np.r_[True, label_two[1:] != label_two[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, active.size])
+
+        # (active source state, dest_label), summed in same order as reference
+        candidates = scores[active, np.newaxis] + \
+            self.log_transition_probs.reshape(num_pair_states, num_labels)[active]
+        candidates += log_obs
+        group_max = np.maximum.reduceat(candidates, group_starts, axis=0)
+        # reference keeps the *last* source state with the max score
+        is_max = candidates == np.repeat(group_max, group_sizes, axis=0)
+        best_row = np.maximum.reduceat(
+            np.where(is_max, np.arange(active.size)[:, np.newaxis], -1), group_starts, axis=0
+        )
+        dest_states = self.destination_table[active[group_starts]]
+        current_score[:] = -np.inf
+        current_score[dest_states] = group_max
+        source_states[dest_states] = active[best_row]
+
+    def _traceback(self, source_states, final_score, length):
+        """retrieve best state sequence in reverse, given
+        (time steps x states) array of source states and scores at last time step"""
+        state_path = np.empty((length,), dtype=np.intp)
+        # np.argmax returns first max, as does reference
+        current_state = int(np.argmax(final_score))
+        state_path[-1] = current_state
+        for time_step in range(length - 2, -1, -1):
+            current_state = source_states[time_step, current_state]
+            state_path[time_step] = current_state
+        return self._state_path_labels(state_path)
+
+    def _state_path_labels(self, state_path, from_head=True):
+        """convert a sequence of states into a list of labels.
+        If from_head is True, state_path[0] is the first time step of the sequence."""
+        # label emitted when entering each state is its label_two,
+        # and label_two of head state is num_labels, i.e., no label
+        label_inds = self.state_labels[state_path, 1]
+        # first state must be reachable from head state, otherwise no label
+        if from_head and len(label_inds) > 0:
+            if label_inds[0] == self.num_labels or \
+                    self.destination_table[self.head_state, label_inds[0]] != state_path[0]:
+                label_inds[0] = self.num_labels
+        labels = list(self.labels) + [-1]
+        return [labels[label_ind] for label_ind in label_inds]
+
+    def _resequence_reference(self, observation_probs):
         num_time_steps = observation_probs.shape[0] - 1
         source_states = []
         for time_step in range(num_time_steps):
@@ -444,17 +3358,535 @@ class Resequencer:
         return resequenced
 
 
-def get_trans_mat(seqs,smoothing_constant=1e-4):
+class StreamingResequencer:
+    """Online version of Resequencer.resequence, for long recordings.
+
+    Observation probabilities are pushed in chunks as they arrive,
+    and labels are committed (returned) as soon as they can be determined.
+    Labels for a time step are committed once all surviving paths,
+    i.e. all states with a score greater than -inf, agree on the state at that
+    time step. Since the best path must go through that state, labels
+    committed this way are the same labels returned by Resequencer.resequence
+    for the whole recording, as long as at least one path keeps a score greater
+    than -inf, which is always the case when no probabilities are zero.
+
+    Paths usually agree after a small number of time steps, but this is not
+    guaranteed. To bound memory, specify a lag: if more than lag time steps are
+    still uncommitted after a chunk, labels are committed for the oldest time
+    steps along the path that is currently best, and paths that do not agree
+    with it are dropped. Labels committed this way may differ from
+    labels returned by Resequencer.resequence.
+
+    Parameters
+    ----------
+    resequencer : Resequencer
+        used to decode
+    lag : int
+        maximum number of time steps to keep without committing labels,
+        after each chunk is pushed. Memory used scales with lag plus size of
+        chunks. Default is None, in which case labels are only committed
+        when paths agree, and output is the same as Resequencer.resequence
+        (except when every path ends with a score of -inf).
+
+    Examples
+    --------
+    >>> streamer = resequencer.stream(lag=500)
+    >>> labels = []
+    >>> for chunk in chunks:
+    ...     labels.extend(streamer.push(chunk))
+    >>> labels.extend(streamer.flush())
+    """
+    def __init__(self, resequencer, lag=None):
+        if lag is not None:
+            if type(lag) != int:
+                raise TypeError(f'lag must be an int, not type {type(lag)}')
+            if lag < 0:
+                raise ValueError(f'lag must be a non-negative integer, not {lag}')
+        self.resequencer = resequencer
+        self.lag = lag
+        self.reset()
+
+    def reset(self):
+        """reset to start decoding a new recording"""
+        self.num_time_steps = 0
+        self.num_committed = 0
+        self._current_score = None
+        # backpointers for uncommitted time steps,
+        # _source_states[i] maps states at time step (num_committed + i + 1)
+        # to best source states at time step (num_committed + i)
+        self._source_states = []
+
+    @property
+    def num_pending(self):
+        """number of time steps pushed for which labels are not yet committed"""
+        return self.num_time_steps - self.num_committed
+
+    def push(self, observation_probs):
+        """push a chunk of observation probabilities
+
+        Parameters
+        ----------
+        observation_probs : ndarray
+            m x p matrix, m estimated probabilities for p classes.
+            A 1-d array of p probabilities is treated as one time step.
+
+        Returns
+        -------
+        committed : list
+            of labels committed after pushing this chunk, that follow any labels
+            committed after previous chunks. May be empty.
+        """
+        resequencer = self.resequencer
+        observation_probs = np.asarray(observation_probs)
+        if observation_probs.ndim == 1:
+            observation_probs = observation_probs[np.newaxis, :]
+        with np.errstate(divide='ignore'):
+            log_obs = np.log(observation_probs[:, :resequencer.num_labels])
+        source_states = np.zeros((log_obs.shape[0], resequencer.num_states),
+                                 dtype=resequencer.backpointer_dtype)
+        for time_step in range(log_obs.shape[0]):
+            if self._current_score is None:
+                self._current_score = resequencer._viterbi_init(log_obs[time_step:time_step + 1])
+            else:
+                resequencer._viterbi_step(self._current_score,
+                                          log_obs[time_step:time_step + 1],
+                                          source_states[time_step:time_step + 1])
+                # don't need to keep backpointers into a committed time step
+                if self.num_pending > 0:
+                    self._source_states.append(source_states[time_step])
+            self.num_time_steps += 1
+
+        committed = self._commit_converged()
+        if self.lag is not None and self.num_pending > self.lag:
+            committed += self._commit_best(self.num_pending - self.lag)
+        return committed
+
+    def flush(self):
+        """commit labels for all remaining time steps along the best path,
+        at the end of a recording, then reset.
+
+        Returns
+        -------
+        committed : list
+            of labels for remaining time steps
+        """
+        committed = []
+        if self.num_pending > 0:
+            committed = self._commit(self.num_pending, int(np.argmax(self._current_score[0])))
+        self.reset()
+        return committed
+
+    def _commit_converged(self):
+        """commit labels up to latest time step where all surviving paths agree"""
+        if self.num_pending == 0:
+            return []
+        states = np.flatnonzero(np.isfinite(self._current_score[0]))
+        if states.size == 0:
+            return []
+        pending_ind = self.num_pending - 1
+        while states.size > 1 and pending_ind > 0:
+            pending_ind -= 1
+            states = np.unique(self._source_states[pending_ind][states])
+        if states.size > 1:
+            return []
+        return self._commit(pending_ind + 1, states[0])
+
+    def _commit_best(self, num_steps):
+        """commit labels for oldest num_steps time steps along current best path,
+        and drop paths that do not go through the same state"""
+        # ancestors[state] is the state at the last time step to commit
+        # on the best path to each current state
+        ancestors = np.arange(self.resequencer.num_states)
+        for pending_ind in range(self.num_pending - 2, num_steps - 2, -1):
+            ancestors = self._source_states[pending_ind][ancestors]
+        best_state = ancestors[np.argmax(self._current_score[0])]
+        self._current_score[0, ancestors != best_state] = -np.inf
+        return self._commit(num_steps, best_state)
+
+    def _commit(self, num_steps, last_state):
+        """commit labels for oldest num_steps time steps,
+        given state at the last of those time steps"""
+        state_path = np.empty((num_steps,), dtype=np.intp)
+        state_path[-1] = last_state
+        for pending_ind in range(num_steps - 2, -1, -1):
+            state_path[pending_ind] = self._source_states[pending_ind][state_path[pending_ind + 1]]
+        committed = self.resequencer._state_path_labels(state_path,
+                                                        from_head=self.num_committed == 0)
+        del self._source_states[:num_steps]
+        self.num_committed += num_steps
+        return committed
+
+
+# Resequencers used by worker processes of resequence_parallel,
+# set once per worker by _init_resequence_worker
+_worker_resequencers = None
+
+
+def _init_resequence_worker(resequencers, backend_class):
+    global _worker_resequencers, _backend
+    _worker_resequencers = resequencers
+    _backend = backend_class()
+
+
+def _resequence_worker(task):
+    resequencer_key, observation_probs, engine = task
+    return _worker_resequencers[resequencer_key].resequence(observation_probs, engine=engine)
+
+
+def resequence_parallel(resequencer, observation_probs, max_workers=None, chunksize=1,
+                        engine='vectorized'):
+    """resequence many songs in parallel, using a pool of processes
+
+    Each worker process receives the Resequencer(s) once, when it starts,
+    instead of with every song, and uses the same backend as the calling process.
+
+    Parameters
+    ----------
+    resequencer : Resequencer, or dict
+        used to resequence songs. To resequence songs from multiple birds,
+        pass a dict that maps a key for each bird to the Resequencer for that bird.
+    observation_probs : dict, or list
+        if resequencer is a Resequencer, a dict that maps each song
+        (e.g., the name of its .wav file) to an m x p array of observation
+        probabilities, or a list of such arrays. If resequencer is a dict,
+        a dict with the same keys, that maps each bird to a dict or list of arrays.
+    max_workers : int
+        number of worker processes. Default is None, in which case the number
+        of processors on the machine is used.
+    chunksize : int
+        number of songs sent to a worker process at a time. Larger chunks
+        reduce overhead of communicating with processes when there are
+        many short songs. Default is 1.
+    engine : str
+        passed to Resequencer.resequence. Default is 'vectorized'.
+
+    Returns
+    -------
+    resequenced : dict, or list
+        with the same structure and order as observation_probs, where each
+        array is replaced by the list of labels returned by Resequencer.resequence
+
+    Examples
+    --------
+    >>> resequenced = resequence_parallel({'bird0': resequencer0, 'bird1': resequencer1},
+    ...                                   {'bird0': {'0.wav': probs0, '1.wav': probs1},
+    ...                                    'bird1': {'0.wav': probs2}},
+    ...                                   max_workers=32, chunksize=8)
+    >>> resequenced['bird1']['0.wav']
+    """
+    if isinstance(resequencer, Resequencer):
+        resequencers = {None: resequencer}
+        observation_probs = {None: observation_probs}
+    elif isinstance(resequencer, dict):
+        resequencers = resequencer
+        if set(observation_probs.keys()) != set(resequencers.keys()):
+            raise ValueError('keys of observation_probs must be the same as keys of '
+                             f'resequencer: {list(resequencers.keys())}')
+    else:
+        raise TypeError('resequencer must be a Resequencer or a dict of Resequencers, '
+                        f'not type {type(resequencer)}')
+
+    tasks = []
+    for resequencer_key, probs in observation_probs.items():
+        probs = probs.values() if isinstance(probs, dict) else probs
+        tasks.extend([(resequencer_key, obs, engine) for obs in probs])
+
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_resequence_worker,
+                             initargs=(resequencers, type(get_backend()))) as executor:
+        results = iter(executor.map(_resequence_worker, tasks, chunksize=chunksize))
+
+    resequenced = {}
+    for resequencer_key, probs in observation_probs.items():
+        if isinstance(probs, dict):
+            resequenced[resequencer_key] = {song: next(results) for song in probs}
+        else:
+            resequenced[resequencer_key] = [next(results) for _ in probs]
+    if isinstance(resequencer, Resequencer):
+        return resequenced[None]
+    return resequenced
+
+
+def _encode_label_seqs(*seq_lists):
+    """convert lists of sequences of labels into integer codes, with one set of
+    codes for all lists. Returns array of unique labels, and for each list,
+    the codes of all its sequences concatenated plus the length of each sequence"""
+    # a str is a sequence of single-character labels
+    arrays = [[np.asarray(list(seq) if isinstance(seq, str) else seq).ravel() for seq in seqs]
+              for seqs in seq_lists]
+    all_labels = [array for seqs in arrays for array in seqs if array.size > 0]
+    if all_labels:
+        labels, codes = np.unique(np.concatenate(all_labels), return_inverse=True)
+    else:
+        labels, codes = np.array([]), np.zeros((0,), dtype=np.intp)
+    codes = codes.ravel().astype(np.int32)
+    encoded = []
+    offset = 0
+    for seqs in arrays:
+        lengths = np.array([array.size for array in seqs], dtype=np.intp)
+        encoded.append((codes[offset:offset + lengths.sum()], lengths))
+        offset += lengths.sum()
+    return labels, encoded
+
+
+def _edit_distance_batch(hyps, refs):
+    """Levenshtein distance between each pair of 1-d arrays of int codes
+    in lists hyps and refs, computed for all pairs at once.
+
+    Pairs are padded to the longest hyp and ref. Each row of the dynamic
+    programming table is computed for all pairs with array operations, where
+    insertions are found with a cumulative minimum, since
+    d[i, j] = min over k <= j of (e[i, k] + j - k)."""
+    num_pairs = len(hyps)
+    hyp_lengths = np.array([hyp.shape[0] for hyp in hyps], dtype=np.intp)
+    ref_lengths = np.array([ref.shape[0] for ref in refs], dtype=np.intp)
+    max_hyp, max_ref = hyp_lengths.max(initial=0), ref_lengths.max(initial=0)
+    padded_hyps = np.full((num_pairs, max_hyp), -1, dtype=np.int32)
+    padded_refs = np.full((num_pairs, max_ref), -1, dtype=np.int32)
+    for pair_ind in range(num_pairs):
+        padded_hyps[pair_ind, :hyp_lengths[pair_ind]] = hyps[pair_ind]
+        padded_refs[pair_ind, :ref_lengths[pair_ind]] = refs[pair_ind]
+
+    pair_range = np.arange(num_pairs)
+    hyp_range = np.arange(max_hyp + 1, dtype=np.int32)
+    # row 0 of table: distance from empty ref to each prefix of hyp
+    distances = np.repeat(hyp_range[np.newaxis], num_pairs, axis=0)
+    result = distances[pair_range, hyp_lengths]
+    best = np.empty_like(distances)
+    for ref_ind in range(1, max_ref + 1):
+        best[:, 0] = ref_ind
+        # substitution or match, and deletion
+        np.minimum(distances[:, :-1]
+                   + (padded_hyps != padded_refs[:, ref_ind - 1, np.newaxis]),
+                   distances[:, 1:] + 1, out=best[:, 1:])
+        # insertion
+        distances = np.minimum.accumulate(best - hyp_range, axis=1) + hyp_range
+        done = ref_lengths == ref_ind
+        result[done] = distances[done, hyp_lengths[done]]
+    return result
+
+
+def _edit_distances(hyps, refs, max_workers=1, batch_size=256):
+    """Levenshtein distances between lists of 1-d arrays of int codes,
+    batching pairs with similar lengths together"""
+    # sort by length, so pairs in a batch need little padding
+    order = np.lexsort(([hyp.shape[0] for hyp in hyps], [ref.shape[0] for ref in refs]))
+    batches = [order[start:start + batch_size] for start in range(0, order.shape[0], batch_size)]
+    hyp_batches = [[hyps[ind] for ind in batch] for batch in batches]
+    ref_batches = [[refs[ind] for ind in batch] for batch in batches]
+    if max_workers == 1 or len(batches) < 2:
+        batch_distances = list(map(_edit_distance_batch, hyp_batches, ref_batches))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            batch_distances = list(executor.map(_edit_distance_batch, hyp_batches, ref_batches))
+    distances = np.zeros((len(hyps),), dtype=np.int64)
+    for batch, batch_distance in zip(batches, batch_distances):
+        distances[batch] = batch_distance
+    return distances
+
+
+def edit_distance(hyps, refs, max_workers=1, batch_size=256):
+    """compute Levenshtein (edit) distance between many pairs of sequences of labels
+
+    Labels are converted to integer codes, and the distances for a batch of
+    pairs are computed together, one row of the dynamic programming table at
+    a time, with array operations.
+
+    Parameters
+    ----------
+    hyps : list
+        of sequences of labels, e.g. lists of str returned by Resequencer.resequence.
+        A str is a sequence of labels that are each one character.
+    refs : list
+        of sequences of labels, the same length as hyps
+    max_workers : int
+        number of worker processes that compute batches. Default is 1,
+        in which case distances are computed in this process. If None,
+        the number of processors on the machine is used.
+    batch_size : int
+        number of pairs computed together. Default is 256.
+
+    Returns
+    -------
+    distances : 1-d array
+        of ints, minimum number of insertions, deletions, and substitutions
+        that change hyps[i] into refs[i]
+    """
+    if len(hyps) != len(refs):
+        raise ValueError(f'hyps and refs must have the same length, but lengths were '
+                         f'{len(hyps)} and {len(refs)}')
+    _, ((hyp_codes, hyp_lengths), (ref_codes, ref_lengths)) = _encode_label_seqs(hyps, refs)
+    hyps = np.split(hyp_codes, np.cumsum(hyp_lengths)[:-1]) if len(hyps) else []
+    refs = np.split(ref_codes, np.cumsum(ref_lengths)[:-1]) if len(refs) else []
+    return _edit_distances(hyps, refs, max_workers, batch_size)
+
+
+def _divide(numerator, denominator):
+    """divide, giving nan where denominator is zero"""
+    numerator = np.asarray(numerator, dtype=float)
+    return np.divide(numerator, denominator, out=np.full(numerator.shape, np.nan),
+                     where=np.asarray(denominator) > 0)
+
+
+def evaluate_songs(hyps, refs, background=None, tolerance=1, max_workers=1, batch_size=256):
+    """compute syllable error rate, frame error rate, and precision and recall
+    of segment boundaries, for many songs at once
+
+    Syllables are runs of frames with the same label, other than background.
+    Syllable error rate is the edit distance between the sequences of
+    syllable labels in hyps and refs, divided by the number of syllables in refs.
+    Frame error rate is the fraction of frames whose labels differ.
+    Boundaries are the onsets and offsets of syllables, in frames; a boundary
+    in hyps is correct if there is a boundary in refs within tolerance frames,
+    and a boundary in refs is detected if there is a boundary in hyps within
+    tolerance frames.
+
+    Parameters
+    ----------
+    hyps : list
+        of sequences of labels of frames, one for each song,
+        e.g., returned by Resequencer.resequence_batch
+    refs : list
+        of sequences of labels of frames, one for each song, with the same
+        number of frames as hyps, e.g. from frame_labels
+    background : label
+        label of frames that are not part of a syllable, e.g. silence.
+        Default is None, in which case every frame is part of a syllable.
+    tolerance : int
+        number of frames by which boundaries can differ. Default is 1.
+    max_workers : int
+        number of worker processes that compute edit distances. Default is 1,
+        in which case they are computed in this process. If None,
+        the number of processors on the machine is used.
+    batch_size : int
+        number of songs whose edit distances are computed together. Default is 256.
+
+    Returns
+    -------
+    metrics : dict
+        with totals over all songs, with keys 'syllable_error_rate',
+        'frame_error_rate', 'boundary_precision', 'boundary_recall', and
+        'boundary_f1', and 1-d arrays with one element per song, with keys
+        'edit_distances', 'num_syllables', 'num_hyp_syllables', 'num_frame_errors',
+        'num_frames', 'num_boundaries', 'num_hyp_boundaries',
+        'num_correct_boundaries', 'num_detected_boundaries', and the rates for
+        each song, 'song_syllable_error_rate', 'song_frame_error_rate',
+        'song_boundary_precision', and 'song_boundary_recall'.
+        Rates are nan where there is nothing to divide by.
+
+    Examples
+    --------
+    >>> wav_files, label_vecs = frame_labels(songs, labels=labels)
+    >>> refs = [np.array(labels + ['-'])[label_vec] for label_vec in label_vecs]
+    >>> hyps = resequencer.resequence_batch(observation_probs)  # with a '-' label
+    >>> metrics = evaluate_songs(hyps, refs, background='-', max_workers=8)
+    >>> metrics['syllable_error_rate'], metrics['song_syllable_error_rate']
+    """
+    if len(hyps) != len(refs):
+        raise ValueError(f'hyps and refs must have the same length, but lengths were '
+                         f'{len(hyps)} and {len(refs)}')
+    if tolerance < 0:
+        raise ValueError(f'tolerance must be non-negative, not {tolerance}')
+    num_songs = len(refs)
+    labels, ((hyp_codes, num_frames), (ref_codes, ref_num_frames)) = \
+        _encode_label_seqs(hyps, refs)
+    if np.any(num_frames != ref_num_frames):
+        mismatched = np.flatnonzero(num_frames != ref_num_frames)[0]
+        raise ValueError(f'hyps and refs must have the same number of frames for each song, '
+                         f'but song {mismatched} had {num_frames[mismatched]} '
+                         f'and {ref_num_frames[mismatched]}')
+    if background is None:
+        background_code = -1
+    else:
+        background_code = np.searchsorted(labels, background) if labels.size else -1
+        if background_code >= labels.size or labels[background_code] != background:
+            background_code = -1
+    song_ids = np.repeat(np.arange(num_songs), num_frames)
+    song_starts = np.cumsum(num_frames) - num_frames
+
+    num_frame_errors = np.bincount(song_ids, weights=hyp_codes != ref_codes,
+                                   minlength=num_songs).astype(np.int64)
+
+    # spacing between songs, so boundaries in different songs are never within tolerance
+    song_spacing = num_frames.max(initial=0) + 2 * tolerance + 2
+    syl_codes, boundaries = [], []
+    for codes in (hyp_codes, ref_codes):
+        # runs of frames with the same label, within each song
+        run_onsets = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1])
+                                          | (song_ids[1:] != song_ids[:-1])]) \
+            if codes.size else np.zeros((0,), dtype=np.intp)
+        run_offsets = np.r_[run_onsets[1:], codes.size].astype(np.intp)
+        syls = codes[run_onsets] != background_code
+        run_onsets, run_offsets = run_onsets[syls], run_offsets[syls]
+        syl_song_ids = song_ids[run_onsets]
+        num_syls = np.bincount(syl_song_ids, minlength=num_songs)
+        syl_codes.append(np.split(codes[run_onsets], np.cumsum(num_syls)[:-1])
+                         if num_songs else [])
+        # boundaries as position within song, offset by spacing of songs
+        song_offsets = syl_song_ids * song_spacing - song_starts[syl_song_ids]
+        boundaries.append(np.unique(np.concatenate((run_onsets + song_offsets,
+                                                    run_offsets + song_offsets))))
+
+    hyp_syls, ref_syls = syl_codes
+    distances = _edit_distances(hyp_syls, ref_syls, max_workers, batch_size)
+    num_hyp_syllables = np.array([syls.shape[0] for syls in hyp_syls], dtype=np.int64)
+    num_syllables = np.array([syls.shape[0] for syls in ref_syls], dtype=np.int64)
+
+    def num_within_tolerance(boundaries, other):
+        """number of boundaries in each song within tolerance of a boundary in other"""
+        if other.size == 0:
+            return np.zeros((num_songs,), dtype=np.int64)
+        ind = np.searchsorted(other, boundaries)
+        nearest = np.minimum(np.abs(boundaries - other[np.maximum(ind - 1, 0)]),
+                             np.abs(other[np.minimum(ind, other.size - 1)] - boundaries))
+        return np.bincount(boundaries[nearest <= tolerance] // song_spacing,
+                           minlength=num_songs).astype(np.int64)
+
+    hyp_boundaries, ref_boundaries = boundaries
+    num_hyp_boundaries = np.bincount(hyp_boundaries // song_spacing, minlength=num_songs)
+    num_boundaries = np.bincount(ref_boundaries // song_spacing, minlength=num_songs)
+    num_correct = num_within_tolerance(hyp_boundaries, ref_boundaries)
+    num_detected = num_within_tolerance(ref_boundaries, hyp_boundaries)
+
+    precision = _divide(num_correct.sum(), num_hyp_boundaries.sum())
+    recall = _divide(num_detected.sum(), num_boundaries.sum())
+    return {
+        'syllable_error_rate': float(_divide(distances.sum(), num_syllables.sum())),
+        'frame_error_rate': float(_divide(num_frame_errors.sum(), num_frames.sum())),
+        'boundary_precision': float(precision),
+        'boundary_recall': float(recall),
+        'boundary_f1': float(_divide(2 * precision * recall, precision + recall)),
+        'edit_distances': distances,
+        'num_syllables': num_syllables,
+        'num_hyp_syllables': num_hyp_syllables,
+        'num_frame_errors': num_frame_errors,
+        'num_frames': num_frames.astype(np.int64),
+        'num_boundaries': num_boundaries.astype(np.int64),
+        'num_hyp_boundaries': num_hyp_boundaries.astype(np.int64),
+        'num_correct_boundaries': num_correct,
+        'num_detected_boundaries': num_detected,
+        'song_syllable_error_rate': _divide(distances, num_syllables),
+        'song_frame_error_rate': _divide(num_frame_errors, num_frames),
+        'song_boundary_precision': _divide(num_correct, num_hyp_boundaries),
+        'song_boundary_recall': _divide(num_detected, num_boundaries),
+    }
+
+
+def get_trans_mat(seqs,smoothing_constant=1e-4,sparse=False):
     """calculate second-order transition matrix given sequences of syllable labels
 
     Parameters
     ----------
-    seqs : list of Sequence objects
+    seqs : list of Sequence objects, or AnnotationTable
 
     smoothing_constant : float
         default is 1e-4. Added to all probabilities so that none are zero.
         Mathematically convenient for computing Viterbi algorithm with
         exponential.
+    sparse : bool
+        if True, return a SparseTransitionMatrix, that only stores
+        transitions that occurred, instead of a 3-d array. Useful for large
+        sets of labels where most trigrams never occur. Default is False.
 
     Returns
     -------
@@ -467,34 +3899,408 @@ def get_trans_mat(seqs,smoothing_constant=1e-4):
         at time step t, given that label at time step t-1 was labels[k]
         and the label at time step t-2 was labels[i].
     """
+    with _stage('get_trans_mat'):
+        if isinstance(seqs, AnnotationTable):
+            labels, label_codes = seqs.labels, seqs.syl_label_codes
+            seq_lengths = np.diff(seqs.seq_offsets)
+        else:
+            with _stage('get_trans_mat.collect_labels'):
+                all_syls = [syl.label for seq in seqs for syl in seq.syls]
+                labels, label_codes = np.unique(all_syls, return_inverse=True)
+                seq_lengths = [len(seq.syls) for seq in seqs]
+        if sparse:
+            with _stage('get_trans_mat.count_trigrams'):
+                trigram_inds, trigram_counts = np.unique(
+                    _trigram_indices(label_codes, seq_lengths, labels.shape[0]),
+                    return_counts=True
+                )
+            with _stage('get_trans_mat.normalize'):
+                trans_mat = SparseTransitionMatrix.from_counts(
+                    labels.shape[0], trigram_inds, trigram_counts, smoothing_constant
+                )
+        else:
+            with _stage('get_trans_mat.count_trigrams'):
+                counts = get_backend().count_trigrams(label_codes, seq_lengths,
+                                                      labels.shape[0])
+            with _stage('get_trans_mat.normalize'):
+                trans_mat = _counts_to_trans_mat(counts, smoothing_constant)
+        if _stats is not None:
+            _stats.count('syllables_counted', len(label_codes))
+            _stats.peak('get_trans_mat.trans_mat', trans_mat)
+        return trans_mat
 
-    all_syls = [syl.label for seq in seqs for syl in seq.syls]
-    labels = np.unique(all_syls)
 
-    all_label_seqs = []
-    for seq in seqs:
-        all_label_seqs.append([syl.label for syl in seq.syls])
-
-    num_labels = labels.shape[0]
-    counts = np.zeros((num_labels,num_labels,num_labels))
-    for label_seq in all_label_seqs:
-        for ind in range(2,len(label_seq)):
-            k = np.where(labels==label_seq[ind])
-            j = np.where(labels==label_seq[ind-1])
-            i = np.where(labels==label_seq[ind-2])
-            counts[i,j,k] += 1
-    trans_mat = np.zeros(counts.shape)
-    for i in range(num_labels):
-        for j in range(num_labels):
-            num_ij_occurences = np.sum(counts[i,j,:])
-            if num_ij_occurences > 0:
-                for k in range(num_labels):
-                    trans_mat[i,j,k] = counts[i,j,k] / num_ij_occurences
+def _count_trigrams(label_codes, seq_lengths, num_labels):
+    """count occurrences of every trigram of labels in one bulk pass
+
+    Parameters
+    ----------
+    label_codes : 1-d array of ints
+        label of every syllable from all sequences, concatenated,
+        as an index into the set of unique labels
+    seq_lengths : 1-d array of ints
+        number of syllables in each sequence
+    num_labels : int
+        number of unique labels
+
+    Returns
+    -------
+    counts : 3-d array
+        of ints, num_labels x num_labels x num_labels,
+        counts[i,j,k] is the number of times labels i, j, k occurred in a row
+    """
+    trigram_ind = _trigram_indices(label_codes, seq_lengths, num_labels)
+    counts = np.bincount(trigram_ind, minlength=num_labels ** 3)
+    return counts.reshape((num_labels, num_labels, num_labels))
+
+
+def _trigram_indices(label_codes, seq_lengths, num_labels):
+    """get index of every trigram of labels into a flattened
+    num_labels x num_labels x num_labels array"""
+    label_codes = np.asarray(label_codes, dtype=np.intp).ravel()
+    seq_lengths = np.asarray(seq_lengths, dtype=np.intp)
+    # index of each syllable within its sequence
+    seq_starts = np.cumsum(seq_lengths) - seq_lengths
+    syl_ind = np.arange(label_codes.shape[0]) - np.repeat(seq_starts, seq_lengths)
+    # trigrams end at every syllable with at least two syllables before it in its sequence
+    trigram_end = np.flatnonzero(syl_ind >= 2)
+    return ((label_codes[trigram_end - 2] * num_labels
+             + label_codes[trigram_end - 1]) * num_labels
+            + label_codes[trigram_end])
+
+
+def _counts_to_trans_mat(counts, smoothing_constant=1e-4):
+    """normalize counts of trigrams to get second-order transition matrix,
+    then smooth by adding smoothing_constant and renormalizing"""
+    counts = np.asarray(counts, dtype=float)
+    num_ij_occurences = counts.sum(axis=2, keepdims=True)
+    trans_mat = np.divide(counts, num_ij_occurences,
+                          out=np.zeros(counts.shape),
+                          where=num_ij_occurences > 0)
 
     if smoothing_constant:
-        for i in range(num_labels):
-            for j in range(num_labels):
-                trans_mat[i,j,:] += smoothing_constant
-                trans_mat[i,j,:] /= np.sum(trans_mat[i,j,:])
+        trans_mat += smoothing_constant
+        trans_mat /= trans_mat.sum(axis=2, keepdims=True)
 
     return trans_mat
+
+
+class SparseTransitionMatrix:
+    """Second-order transition matrix that only stores transitions that occurred.
+
+    Returned by get_trans_mat when sparse is True. Smoothing gives every
+    transition that never occurred after labels[i] and labels[j] the same
+    probability, backoff[i, j], so only the probabilities of trigrams that
+    occurred are stored explicitly, and memory scales with the number of
+    those trigrams, instead of with n * n * n where n is the number of labels.
+    Indexing with [i, j, k] gives the same value as the dense matrix.
+
+    Attributes
+    ----------
+    num_labels : int
+        number of labels, n
+    indices : 1-d array
+        of ints, sorted, index of each trigram that occurred into
+        the flattened n * n * n matrix, i.e. (i * n + j) * n + k
+    probs : 1-d array
+        of floats, probability of each trigram in indices, which must not be
+        less than the backoff probability of the trigram's first two labels
+    backoff : 2-d array
+        n * n, backoff[i, j] is the probability of any transition
+        after labels[i] and labels[j] that is not in indices
+
+    Examples
+    --------
+    >>> trans_mat = get_trans_mat(seq_list, sparse=True)
+    >>> trans_mat[0, 1, 2] == get_trans_mat(seq_list)[0, 1, 2]
+    True
+    >>> resequencer = Resequencer(trans_mat, labels)
+    """
+    def __init__(self, num_labels, indices, probs, backoff):
+        indices = np.asarray(indices, dtype=np.int64)
+        probs = np.asarray(probs, dtype=float)
+        backoff = np.asarray(backoff, dtype=float)
+        if indices.ndim != 1 or indices.shape != probs.shape:
+            raise ValueError('indices and probs must be 1-d arrays with the same shape, '
+                             f'but shapes were {indices.shape} and {probs.shape}')
+        if backoff.shape != (num_labels, num_labels):
+            raise ValueError(f'backoff must have shape {(num_labels, num_labels)}, '
+                             f'but shape was {backoff.shape}')
+        if indices.size and (np.any(np.diff(indices) <= 0) or indices[0] < 0
+                             or indices[-1] >= num_labels ** 3):
+            raise ValueError('indices must be unique, sorted, and less than num_labels ** 3')
+        self.num_labels = num_labels
+        self.indices = indices
+        self.probs = probs
+        self.backoff = backoff
+
+    @classmethod
+    def from_counts(cls, num_labels, indices, counts, smoothing_constant=1e-4):
+        """compute transition matrix from counts of trigrams that occurred,
+        with the same arithmetic as the dense matrix, so that values are identical
+
+        Parameters
+        ----------
+        num_labels : int
+        indices : 1-d array
+            of ints, sorted and unique, index of each trigram into the
+            flattened num_labels * num_labels * num_labels array of counts
+        counts : 1-d array
+            of ints, greater than zero, count of each trigram in indices
+        smoothing_constant : float
+            default is 1e-4.
+
+        Returns
+        -------
+        trans_mat : SparseTransitionMatrix
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        counts = np.asarray(counts, dtype=float)
+        contexts, context_inds = np.unique(indices // num_labels, return_inverse=True)
+        dest_labels = indices % num_labels
+        num_ij_occurences = np.bincount(context_inds, weights=counts,
+                                        minlength=contexts.shape[0])
+        probs = counts / num_ij_occurences[context_inds]
+        backoff = np.zeros((num_labels * num_labels,))
+
+        if smoothing_constant:
+            probs += smoothing_constant
+            # sum each row of the dense matrix, with the same (pairwise) summation
+            # as the dense matrix, materializing rows only for contexts that occurred,
+            # a chunk at a time
+            row_sums = np.empty(contexts.shape)
+            chunk_size = max(2 ** 20 // num_labels, 1)
+            for start in range(0, contexts.shape[0], chunk_size):
+                stop = min(start + chunk_size, contexts.shape[0])
+                rows = np.full((stop - start, num_labels), float(smoothing_constant))
+                in_chunk = slice(*np.searchsorted(context_inds, [start, stop]))
+                rows[context_inds[in_chunk] - start, dest_labels[in_chunk]] = probs[in_chunk]
+                row_sums[start:stop] = rows.sum(axis=1)
+            probs /= row_sums[context_inds]
+            # rows of contexts that never occurred are all smoothing_constant
+            backoff[:] = smoothing_constant / np.full((1, num_labels),
+                                                      float(smoothing_constant)).sum(axis=1)
+            backoff[contexts] = smoothing_constant / row_sums
+
+        return cls(num_labels, indices, probs, backoff.reshape(num_labels, num_labels))
+
+    @property
+    def shape(self):
+        return (self.num_labels,) * 3
+
+    @property
+    def trigrams(self):
+        """n_trigrams x 3 array, labels i, j, k of each trigram that occurred"""
+        return np.stack(np.unravel_index(self.indices, self.shape), axis=1)
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes + self.probs.nbytes + self.backoff.nbytes
+
+    def __repr__(self):
+        return "SparseTransitionMatrix with {} labels and {} trigrams".format(
+            self.num_labels, self.indices.shape[0])
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple) or len(key) != 3:
+            raise IndexError('SparseTransitionMatrix must be indexed with three integers')
+        key = tuple(operator.index(ind) for ind in key)
+        if any(not -self.num_labels <= ind < self.num_labels for ind in key):
+            raise IndexError(f'index {key} is out of bounds for shape {self.shape}')
+        i, j, k = (ind % self.num_labels for ind in key)
+        flat_ind = (i * self.num_labels + j) * self.num_labels + k
+        pos = np.searchsorted(self.indices, flat_ind)
+        if pos < self.indices.shape[0] and self.indices[pos] == flat_ind:
+            return self.probs[pos]
+        return self.backoff[i, j]
+
+    def to_dense(self):
+        """return transition matrix as a 3-d array,
+        the same as returned by get_trans_mat when sparse is False"""
+        trans_mat = np.repeat(self.backoff[:, :, np.newaxis], self.num_labels, axis=2)
+        trans_mat.reshape(-1)[self.indices] = self.probs
+        return trans_mat
+
+
+class TransitionCounts:
+    """Counts of second-order transitions between labels of syllables,
+    used to compute the transition matrix returned by get_trans_mat.
+
+    Counts can be updated one sequence at a time, merged with counts from
+    other sequences (e.g., computed by other workers), and saved to a file,
+    so that the transition matrix can be updated as new data arrive,
+    instead of being computed again from all sequences.
+
+    Attributes
+    ----------
+    labels : 1-d array
+        set of unique labels across all sequences counted, sorted,
+        as returned by numpy.unique.
+    counts : 3-d array
+        of ints, counts[i,j,k] is the number of times labels[k] occurred
+        after labels[j] and labels[i]
+    num_seqs : int
+        number of sequences counted
+
+    Examples
+    --------
+    >>> trans_counts = TransitionCounts.from_seqs(parse_xml('./Bird0/Annotation.xml'))
+    >>> trans_counts.update(new_seq_list)
+    >>> trans_mat = trans_counts.trans_mat()  # same as get_trans_mat(all sequences)
+    >>> merged = functools.reduce(operator.add, counts_from_each_worker)
+    """
+    def __init__(self):
+        # labels in the order they were first counted, and their index
+        # into the axes of _counts
+        self._labels = []
+        self._label_codes = {}
+        self._counts = np.zeros((0, 0, 0), dtype=np.int64)
+        self.num_seqs = 0
+
+    @classmethod
+    def from_seqs(cls, seqs):
+        """make TransitionCounts from a list of Sequence objects"""
+        return cls().update(seqs)
+
+    @property
+    def labels(self):
+        return np.unique(np.array(self._labels, dtype=str))
+
+    @property
+    def counts(self):
+        order = self._sorted_order()
+        return self._counts[np.ix_(order, order, order)]
+
+    def __repr__(self):
+        return "TransitionCounts with {} labels from {} sequences".format(
+            len(self._labels), self.num_seqs)
+
+    def _sorted_order(self):
+        return np.argsort(np.array(self._labels, dtype=str), kind='stable')
+
+    def _add_labels(self, labels):
+        """add any new labels, growing the array of counts"""
+        new_labels = [label for label in dict.fromkeys(labels) if label not in self._label_codes]
+        if new_labels:
+            for label in new_labels:
+                self._label_codes[label] = len(self._labels)
+                self._labels.append(label)
+            num_old, num_labels = self._counts.shape[0], len(self._labels)
+            counts = np.zeros((num_labels, num_labels, num_labels), dtype=np.int64)
+            counts[:num_old, :num_old, :num_old] = self._counts
+            self._counts = counts
+
+    def update(self, seqs):
+        """add counts of transitions from sequences
+
+        Parameters
+        ----------
+        seqs : Sequence, or list of Sequence objects
+
+        Returns
+        -------
+        self : TransitionCounts
+        """
+        if isinstance(seqs, Sequence):
+            seqs = [seqs]
+        all_syls = [syl.label for seq in seqs for syl in seq.syls]
+        self._add_labels(all_syls)
+        label_codes = [self._label_codes[label] for label in all_syls]
+        seq_lengths = [len(seq.syls) for seq in seqs]
+        self._counts += get_backend().count_trigrams(label_codes, seq_lengths,
+                                                     len(self._labels))
+        self.num_seqs += len(seq_lengths)
+        return self
+
+    def merge(self, other):
+        """add counts from another TransitionCounts, in place
+
+        Parameters
+        ----------
+        other : TransitionCounts
+
+        Returns
+        -------
+        self : TransitionCounts
+        """
+        if not isinstance(other, TransitionCounts):
+            raise TypeError(f'can only merge with TransitionCounts, not type {type(other)}')
+        self._add_labels(other._labels)
+        codes = np.array([self._label_codes[label] for label in other._labels], dtype=np.intp)
+        self._counts[np.ix_(codes, codes, codes)] += other._counts
+        self.num_seqs += other.num_seqs
+        return self
+
+    def copy(self):
+        new = TransitionCounts()
+        new._labels = list(self._labels)
+        new._label_codes = dict(self._label_codes)
+        new._counts = self._counts.copy()
+        new.num_seqs = self.num_seqs
+        return new
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def trans_mat(self, smoothing_constant=1e-4, sparse=False):
+        """compute second-order transition matrix from counts.
+
+        Returns the same matrix as get_trans_mat for the same sequences,
+        where the axes correspond to TransitionCounts.labels.
+
+        Parameters
+        ----------
+        smoothing_constant : float
+            default is 1e-4. Added to all probabilities so that none are zero.
+        sparse : bool
+            if True, return a SparseTransitionMatrix. Default is False.
+
+        Returns
+        -------
+        trans_mat : 3-d array, or SparseTransitionMatrix
+            Shape is n * n * n where n is the number of labels.
+        """
+        counts = self.counts
+        if sparse:
+            indices = np.flatnonzero(counts)
+            return SparseTransitionMatrix.from_counts(counts.shape[0], indices,
+                                                      counts.ravel()[indices],
+                                                      smoothing_constant)
+        return _counts_to_trans_mat(counts, smoothing_constant)
+
+    def to_resequencer(self, smoothing_constant=1e-4, sparse=False, **kwargs):
+        """make a Resequencer from the transition matrix.
+        Additional keyword arguments are passed to Resequencer."""
+        return Resequencer(self.trans_mat(smoothing_constant, sparse=sparse),
+                           self.labels.tolist(), **kwargs)
+
+    def save(self, file):
+        """save counts to a .npz file
+
+        Parameters
+        ----------
+        file : str, or file-like object
+        """
+        np.savez(file, labels=np.array(self._labels, dtype=str), counts=self._counts,
+                 num_seqs=self.num_seqs)
+
+    @classmethod
+    def load(cls, file):
+        """load counts saved with TransitionCounts.save
+
+        Parameters
+        ----------
+        file : str, or file-like object
+
+        Returns
+        -------
+        trans_counts : TransitionCounts
+        """
+        with np.load(file, allow_pickle=False) as npz:
+            trans_counts = cls()
+            trans_counts._labels = npz['labels'].tolist()
+            trans_counts._label_codes = {label: code
+                                         for code, label in enumerate(trans_counts._labels)}
+            trans_counts._counts = npz['counts'].astype(np.int64)
+            trans_counts.num_seqs = int(npz['num_seqs'])
+        return trans_counts
@@ -1,7 +1,13 @@
 """
 test birdsongrec module
 """
+import itertools
 import os
+import shutil
+import tempfile
+import wave
+import weakref
+import xml.etree.ElementTree as ET
 from glob import glob
 import unittest
 
@@ -95,3 +101,1170 @@ class TestKoumura(unittest.TestCase):
             wav_ind = np.asarray([wav_file_without_path == seq.wav_file 
                                   for seq in seq_list])
 
+
+    def test_resequence_engines_equivalent(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        seq_list = birdsongrec.parse_xml(xml_file, concat_seqs_into_songs=True)
+        trans_mat = birdsongrec.get_trans_mat(seq_list)
+        labels = list(np.unique([syl.label for seq in seq_list for syl in seq.syls]))
+        resequencer = birdsongrec.Resequencer(trans_mat, labels)
+
+        rng = np.random.default_rng(42)
+        observation_probs = rng.random((60, len(labels)))
+        observation_probs /= observation_probs.sum(axis=1, keepdims=True)
+        self.assertEqual(
+            resequencer.resequence(observation_probs, engine='vectorized'),
+            resequencer.resequence(observation_probs, engine='reference'),
+        )
+
+        # uniform probabilities everywhere, so every comparison is a tie
+        num_labels = 4
+        uniform = birdsongrec.Resequencer(
+            np.ones((num_labels, num_labels, num_labels)) / num_labels,
+            list('abcd')
+        )
+        observation_probs = np.ones((20, num_labels)) / num_labels
+        self.assertEqual(
+            uniform.resequence(observation_probs, engine='vectorized'),
+            uniform.resequence(observation_probs, engine='reference'),
+        )
+
+        # zero probabilities, so every score is -inf
+        observation_probs = np.zeros((5, num_labels))
+        self.assertEqual(
+            uniform.resequence(observation_probs, engine='vectorized'),
+            uniform.resequence(observation_probs, engine='reference'),
+        )
+
+        # no time steps; the reference engine fails on this input,
+        # the vectorized engine returns an empty sequence
+        self.assertEqual(uniform.resequence(np.zeros((0, num_labels)), engine='vectorized'), [])
+
+        with self.assertRaises(ValueError):
+            resequencer.resequence(observation_probs, engine='not-an-engine')
+
+    def test_resequence_batch(self):
+        num_labels = 5
+        labels = list('abcde')
+        rng = np.random.default_rng(7)
+        trans_mat = rng.random((num_labels, num_labels, num_labels))
+        trans_mat /= trans_mat.sum(axis=2, keepdims=True)
+        resequencer = birdsongrec.Resequencer(trans_mat, labels)
+
+        lengths = [12, 1, 30, 7, 30, 2]
+        obs_list = [rng.random((length, num_labels)) for length in lengths]
+        expected = [resequencer.resequence(obs) for obs in obs_list]
+
+        # list of variable-length arrays
+        self.assertEqual(resequencer.resequence_batch(obs_list), expected)
+        self.assertEqual(resequencer.resequence_batch(obs_list, batch_size=4), expected)
+
+        # padded 3-d array
+        padded = np.zeros((len(lengths), max(lengths), num_labels))
+        for ind, obs in enumerate(obs_list):
+            padded[ind, :obs.shape[0]] = obs
+        self.assertEqual(resequencer.resequence_batch(padded, lengths=lengths), expected)
+        self.assertEqual(resequencer.resequence_batch(padded, lengths=lengths, batch_size=1),
+                         expected)
+
+        with self.assertRaises(ValueError):
+            resequencer.resequence_batch(padded, lengths=lengths[:-1])
+        with self.assertRaises(ValueError):
+            resequencer.resequence_batch(padded, lengths=[0] * len(lengths))
+        with self.assertRaises(ValueError):
+            resequencer.resequence_batch(obs_list[0])
+
+    def test_resequencer_state_tables(self):
+        num_labels = 3
+        resequencer = birdsongrec.Resequencer(
+            np.ones((num_labels, num_labels, num_labels)) / num_labels, list('abc')
+        )
+        self.assertEqual(resequencer.destination_table.shape,
+                         (resequencer.num_states, num_labels))
+        self.assertEqual(resequencer.destination_table.dtype, np.int32)
+        self.assertEqual(resequencer.state_labels.dtype, np.int32)
+        for state, (label_one, label_two) in enumerate(resequencer.state_labels):
+            if state == resequencer.head_state:
+                self.assertEqual((label_one, label_two), (num_labels, num_labels))
+            else:
+                self.assertEqual(state, label_one * num_labels + label_two)
+            for dest_label in range(num_labels):
+                dest_state = resequencer.destination_table[state, dest_label]
+                self.assertEqual(resequencer.destination_states[state][dest_label],
+                                 dest_state)
+                self.assertEqual(resequencer.state_labels[dest_state, 0], label_two)
+                self.assertEqual(resequencer.state_labels[dest_state, 1], dest_label)
+        self.assertEqual(resequencer.backpointer_dtype, np.uint8)
+        self.assertEqual(resequencer.log_transition_probs.shape,
+                         (num_labels + 1, num_labels, num_labels))
+
+    def test_streaming_resequencer(self):
+        num_labels = 4
+        labels = list('abcd')
+        rng = np.random.default_rng(3)
+        trans_mat = rng.random((num_labels, num_labels, num_labels)) ** 4
+        trans_mat /= trans_mat.sum(axis=2, keepdims=True)
+        resequencer = birdsongrec.Resequencer(trans_mat, labels)
+        observation_probs = rng.random((300, num_labels)) ** 4
+        expected = resequencer.resequence(observation_probs)
+
+        # without lag, output should be same as decoding all at once
+        streamer = resequencer.stream()
+        resequenced = []
+        for chunk_start in range(0, 300, 7):
+            resequenced.extend(streamer.push(observation_probs[chunk_start:chunk_start + 7]))
+        self.assertTrue(len(resequenced) > 0)  # labels committed before end of stream
+        resequenced.extend(streamer.flush())
+        self.assertEqual(resequenced, expected)
+        self.assertEqual(streamer.num_time_steps, 0)  # flush resets
+
+        # pushing one time step at a time as a 1-d array
+        resequenced = []
+        for row in observation_probs:
+            resequenced.extend(streamer.push(row))
+        resequenced.extend(streamer.flush())
+        self.assertEqual(resequenced, expected)
+
+        # with lag, number of uncommitted time steps is bounded
+        for lag in (0, 1, 5):
+            streamer = birdsongrec.StreamingResequencer(resequencer, lag=lag)
+            resequenced = []
+            for chunk_start in range(0, 300, 7):
+                resequenced.extend(streamer.push(observation_probs[chunk_start:chunk_start + 7]))
+                self.assertTrue(streamer.num_pending <= lag)
+                self.assertEqual(len(resequenced), streamer.num_committed)
+            resequenced.extend(streamer.flush())
+            self.assertEqual(len(resequenced), len(expected))
+            self.assertTrue(all([label in labels for label in resequenced]))
+
+        with self.assertRaises(TypeError):
+            resequencer.stream(lag=1.5)
+        with self.assertRaises(ValueError):
+            resequencer.stream(lag=-1)
+
+    def test_resequencer_beam(self):
+        num_labels = 6
+        labels = list('abcdef')
+        rng = np.random.default_rng(5)
+        trans_mat = rng.random((num_labels, num_labels, num_labels)) ** 4
+        trans_mat /= trans_mat.sum(axis=2, keepdims=True)
+        observation_probs = rng.random((100, num_labels)) ** 4
+        exact = birdsongrec.Resequencer(trans_mat, labels).resequence(observation_probs)
+
+        # beam that keeps every state gives exact result
+        num_states = (num_labels + 1) * num_labels + 1
+        for kwargs in ({'beam_width': num_states}, {'beam_threshold': np.inf}):
+            resequencer = birdsongrec.Resequencer(trans_mat, labels, **kwargs)
+            self.assertEqual(resequencer.resequence(observation_probs), exact)
+            beam_eval = resequencer.evaluate_beam(observation_probs)
+            self.assertEqual(beam_eval['num_different'], 0)
+            self.assertEqual(beam_eval['log_score_difference'], 0.)
+
+        for kwargs in ({'beam_width': 2}, {'beam_threshold': 1.}):
+            resequencer = birdsongrec.Resequencer(trans_mat, labels, **kwargs)
+            resequenced = resequencer.resequence(observation_probs)
+            self.assertEqual(len(resequenced), len(exact))
+            self.assertEqual(resequencer.resequence_batch([observation_probs]), [resequenced])
+            beam_eval = resequencer.evaluate_beam(observation_probs)
+            self.assertEqual(beam_eval['resequenced'], resequenced)
+            self.assertEqual(beam_eval['exact'], exact)
+            self.assertTrue(beam_eval['log_score_difference'] >= 0.)
+            self.assertTrue(0. <= beam_eval['label_error_rate'] <= 1.)
+
+        with self.assertRaises(ValueError):
+            birdsongrec.Resequencer(trans_mat, labels, beam_width=0)
+        with self.assertRaises(TypeError):
+            birdsongrec.Resequencer(trans_mat, labels, beam_width=2.5)
+        with self.assertRaises(ValueError):
+            birdsongrec.Resequencer(trans_mat, labels, beam_threshold=-1.)
+
+        # no state survives a time step where all observation probabilities are zero
+        uniform = np.ones((4, 4, 4)) / 4
+        exact = birdsongrec.Resequencer(uniform, list('abcd'))
+        observation_probs = np.full((5, 4), 0.25)
+        observation_probs[2] = 0.
+        for kwargs in (dict(beam_width=3), dict(beam_threshold=1.)):
+            beam = birdsongrec.Resequencer(uniform, list('abcd'), **kwargs)
+            self.assertEqual(beam.resequence(observation_probs),
+                             exact.resequence(observation_probs))
+
+    def test_resequence_parallel(self):
+        num_labels = 3
+        rng = np.random.default_rng(11)
+        resequencers = {}
+        observation_probs = {}
+        for bird in ('bird0', 'bird1'):
+            trans_mat = rng.random((num_labels, num_labels, num_labels))
+            trans_mat /= trans_mat.sum(axis=2, keepdims=True)
+            resequencers[bird] = birdsongrec.Resequencer(trans_mat, list('abc'))
+            observation_probs[bird] = {
+                f'{song}.wav': rng.random((rng.integers(1, 40), num_labels))
+                for song in range(5)
+            }
+
+        resequenced = birdsongrec.resequence_parallel(resequencers, observation_probs,
+                                                      max_workers=2, chunksize=2)
+        self.assertEqual(list(resequenced.keys()), list(observation_probs.keys()))
+        for bird, probs in observation_probs.items():
+            self.assertEqual(list(resequenced[bird].keys()), list(probs.keys()))
+            for song, obs in probs.items():
+                self.assertEqual(resequenced[bird][song], resequencers[bird].resequence(obs))
+
+        # single Resequencer and list of arrays
+        probs_list = list(observation_probs['bird0'].values())
+        resequenced = birdsongrec.resequence_parallel(resequencers['bird0'], probs_list,
+                                                      max_workers=2)
+        self.assertEqual(resequenced,
+                         [resequencers['bird0'].resequence(obs) for obs in probs_list])
+
+        with self.assertRaises(ValueError):
+            birdsongrec.resequence_parallel(resequencers, {'bird0': probs_list})
+
+    def test_get_trans_mat(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        seq_list = birdsongrec.parse_xml(xml_file, concat_seqs_into_songs=False)
+        labels = np.unique([syl.label for seq in seq_list for syl in seq.syls])
+
+        # count trigrams and normalize with loops, as get_trans_mat originally did
+        num_labels = labels.shape[0]
+        counts = np.zeros((num_labels, num_labels, num_labels))
+        for seq in seq_list:
+            label_seq = [syl.label for syl in seq.syls]
+            for ind in range(2, len(label_seq)):
+                i, j, k = [np.where(labels == label)[0][0] for label in label_seq[ind - 2:ind + 1]]
+                counts[i, j, k] += 1
+        for smoothing_constant in (1e-4, 0):
+            expected = np.zeros(counts.shape)
+            for i in range(num_labels):
+                for j in range(num_labels):
+                    num_ij_occurences = np.sum(counts[i, j, :])
+                    if num_ij_occurences > 0:
+                        for k in range(num_labels):
+                            expected[i, j, k] = counts[i, j, k] / num_ij_occurences
+            if smoothing_constant:
+                for i in range(num_labels):
+                    for j in range(num_labels):
+                        expected[i, j, :] += smoothing_constant
+                        expected[i, j, :] /= np.sum(expected[i, j, :])
+            trans_mat = birdsongrec.get_trans_mat(seq_list, smoothing_constant=smoothing_constant)
+            self.assertTrue(np.array_equal(trans_mat, expected))
+
+    def test_TransitionCounts(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        seq_list = birdsongrec.parse_xml(xml_file, concat_seqs_into_songs=False)
+        expected = birdsongrec.get_trans_mat(seq_list)
+        labels = np.unique([syl.label for seq in seq_list for syl in seq.syls])
+
+        trans_counts = birdsongrec.TransitionCounts.from_seqs(seq_list)
+        self.assertTrue(np.array_equal(trans_counts.labels, labels))
+        self.assertTrue(np.array_equal(trans_counts.trans_mat(), expected))
+        self.assertEqual(trans_counts.num_seqs, len(seq_list))
+
+        # one sequence at a time, in reverse so labels are first seen in a different order
+        one_at_a_time = birdsongrec.TransitionCounts()
+        for seq in reversed(seq_list):
+            one_at_a_time.update(seq)
+        self.assertTrue(np.array_equal(one_at_a_time.trans_mat(), expected))
+
+        # merge counts from shards
+        shards = [birdsongrec.TransitionCounts.from_seqs(seq_list[start:start + 100])
+                  for start in range(0, len(seq_list), 100)]
+        merged = shards[0]
+        for shard in shards[1:]:
+            merged = merged + shard
+        self.assertTrue(np.array_equal(merged.counts, trans_counts.counts))
+        self.assertTrue(np.array_equal(merged.trans_mat(smoothing_constant=0),
+                                       birdsongrec.get_trans_mat(seq_list, smoothing_constant=0)))
+        self.assertEqual(merged.num_seqs, len(seq_list))
+        # __add__ doesn't change operands
+        self.assertEqual(shards[0].num_seqs, 100)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            npz_path = os.path.join(tmp_dir, 'counts.npz')
+            trans_counts.save(npz_path)
+            loaded = birdsongrec.TransitionCounts.load(npz_path)
+        self.assertTrue(np.array_equal(loaded.trans_mat(), expected))
+        self.assertEqual(loaded.num_seqs, trans_counts.num_seqs)
+
+        resequencer = trans_counts.to_resequencer()
+        self.assertEqual(resequencer.labels, labels.tolist())
+
+    def test_iter_xml(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        for concat_seqs_into_songs in (False, True):
+            seq_list = birdsongrec.parse_xml(xml_file,
+                                             concat_seqs_into_songs=concat_seqs_into_songs)
+            seq_iter = birdsongrec.iter_xml(xml_file,
+                                            concat_seqs_into_songs=concat_seqs_into_songs)
+            self.assertFalse(isinstance(seq_iter, list))
+            seq_iter = list(seq_iter)
+            self.assertEqual(len(seq_iter), len(seq_list))
+            for seq, seq_from_iter in zip(seq_list, seq_iter):
+                self.assertTrue(type(seq_from_iter) == birdsongrec.Sequence)
+                for attr in ['wav_file', 'position', 'length', 'num_syls']:
+                    self.assertEqual(getattr(seq, attr), getattr(seq_from_iter, attr))
+                self.assertEqual(
+                    [(syl.position, syl.length, syl.label) for syl in seq.syls],
+                    [(syl.position, syl.length, syl.label) for syl in seq_from_iter.syls],
+                )
+
+        with self.assertRaises(NotADirectoryError):
+            birdsongrec.iter_xml(xml_file, return_wav_abspath=True,
+                                 wav_abspath=os.path.join(self.test_data_dir, 'not-a-dir'))
+
+        # Sequence elements are freed while parsing, instead of staying in the root,
+        # so memory is bounded by one sequence
+        seq_elements = birdsongrec.birdsongrec._iter_seq_elements(xml_file)
+        first_ref = weakref.ref(next(seq_elements))
+        for _ in range(5):
+            next(seq_elements)
+        self.assertIsNone(first_ref())
+        seq_elements.close()
+
+    def test_AnnotationTable(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        for concat_seqs_into_songs in (False, True):
+            seq_list = birdsongrec.parse_xml(xml_file,
+                                             concat_seqs_into_songs=concat_seqs_into_songs)
+            annot = birdsongrec.AnnotationTable.from_xml(
+                xml_file, concat_seqs_into_songs=concat_seqs_into_songs
+            )
+            self.assertEqual(len(annot), len(seq_list))
+            self.assertEqual(annot.num_syls, sum([len(seq.syls) for seq in seq_list]))
+            for seq_id, seq in enumerate(seq_list):
+                seq_view = annot.sequence(seq_id)
+                self.assertEqual(seq_view.wav_file, seq.wav_file)
+                self.assertEqual(seq_view.position, seq.position)
+                self.assertEqual(seq_view.length, seq.length)
+                self.assertEqual(seq_view.syl_positions.tolist(),
+                                 [syl.position for syl in seq.syls])
+                self.assertEqual(seq_view.syl_lengths.tolist(),
+                                 [syl.length for syl in seq.syls])
+                self.assertEqual(annot.labels[seq_view.syl_label_codes].tolist(),
+                                 [syl.label for syl in seq.syls])
+                # views, not copies
+                self.assertTrue(np.shares_memory(seq_view.syl_label_codes, annot.syl_label_codes))
+            self.assertTrue(np.array_equal(birdsongrec.get_trans_mat(annot),
+                                           birdsongrec.get_trans_mat(seq_list)))
+            self.assertTrue(np.array_equal(
+                birdsongrec.AnnotationTable.from_seqs(seq_list).syl_label_codes,
+                annot.syl_label_codes
+            ))
+            to_seqs = annot.to_seqs()
+            self.assertTrue(all([type(seq) == birdsongrec.Sequence for seq in to_seqs]))
+            self.assertEqual([seq.length for seq in to_seqs], [seq.length for seq in seq_list])
+
+        self.assertEqual(birdsongrec.birdsongrec.determine_unique_labels(annot),
+                         birdsongrec.birdsongrec.determine_unique_labels(xml_file))
+
+        # songs from a table of sequences
+        annot = birdsongrec.AnnotationTable.from_xml(xml_file)
+        for song in seq_list:
+            song_view = annot.song(song.wav_file)
+            self.assertEqual(song_view.position, song.position)
+            self.assertEqual(song_view.length, song.length)
+            self.assertEqual(song_view.syl_positions.tolist(), [syl.position for syl in song.syls])
+            self.assertEqual(annot.labels[song_view.syl_label_codes].tolist(),
+                             [syl.label for syl in song.syls])
+        with self.assertRaises(ValueError):
+            annot.song('not-a-file.wav')
+
+    def test_AnnotationCache(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = birdsongrec.AnnotationCache(os.path.join(tmp_dir, 'cache'))
+            for concat_seqs_into_songs in (False, True):
+                expected = birdsongrec.parse_xml(xml_file,
+                                                 concat_seqs_into_songs=concat_seqs_into_songs,
+                                                 return_wav_abspath=True)
+                # first call parses and stores, second loads from cache
+                for _ in range(2):
+                    seq_list = birdsongrec.parse_xml(xml_file,
+                                                     concat_seqs_into_songs=concat_seqs_into_songs,
+                                                     return_wav_abspath=True,
+                                                     cache=cache)
+                    self.assertEqual(len(seq_list), len(expected))
+                    for seq, expected_seq in zip(seq_list, expected):
+                        self.assertTrue(type(seq) == birdsongrec.Sequence)
+                        for attr in ['wav_file', 'position', 'length', 'num_syls']:
+                            self.assertEqual(getattr(seq, attr), getattr(expected_seq, attr))
+                        self.assertEqual(
+                            [(syl.position, syl.length, syl.label) for syl in seq.syls],
+                            [(syl.position, syl.length, syl.label) for syl in expected_seq.syls],
+                        )
+            annot = cache.load_table(xml_file)
+            self.assertTrue(isinstance(annot.syl_label_codes, np.memmap))
+            self.assertEqual(birdsongrec.birdsongrec.determine_unique_labels(xml_file, cache=cache),
+                             birdsongrec.birdsongrec.determine_unique_labels(xml_file))
+
+            # entry is invalidated when file changes
+            xml_copy = os.path.join(tmp_dir, 'Annotation.xml')
+            shutil.copy(xml_file, xml_copy)
+            self.assertEqual(cache.load_table(xml_copy).num_seqs, annot.num_seqs)
+            tree = ET.parse(xml_copy)
+            root = tree.getroot()
+            root.remove(root.find('Sequence'))
+            tree.write(xml_copy)
+            self.assertEqual(cache.load_table(xml_copy).num_seqs, annot.num_seqs - 1)
+
+            # least recently used entries are evicted
+            small_cache = birdsongrec.AnnotationCache(os.path.join(tmp_dir, 'small-cache'),
+                                                      max_bytes=1)
+            # files and directories that are not entries are never removed
+            foreign_dir = os.path.join(small_cache.cache_dir, 'Bird0')
+            os.makedirs(foreign_dir)
+            with open(os.path.join(foreign_dir, 'important.wav'), 'wb') as fp:
+                fp.write(b'0' * 1000)
+            with open(os.path.join(small_cache.cache_dir, 'notes.txt'), 'w') as fp:
+                fp.write('notes')
+            small_cache.load_table(xml_file)
+            small_cache.load_table(xml_copy)
+            # only the entry just stored is kept
+            self.assertEqual(sorted(os.listdir(small_cache.cache_dir)),
+                             sorted(['Bird0', 'notes.txt',
+                                     os.path.basename(small_cache._entry_dir(xml_copy))]))
+            self.assertTrue(os.path.isfile(os.path.join(foreign_dir, 'important.wav')))
+            small_cache.clear()
+            self.assertEqual(sorted(os.listdir(small_cache.cache_dir)), ['Bird0', 'notes.txt'])
+            self.assertTrue(os.path.isfile(os.path.join(foreign_dir, 'important.wav')))
+
+            # cache next to .xml file
+            default_cache = birdsongrec.AnnotationCache()
+            default_cache.load_table(xml_copy)
+            self.assertTrue(os.path.isdir(os.path.join(tmp_dir, '.birdsongrec-cache')))
+            default_cache.clear(xml_copy)
+            self.assertFalse(os.path.isdir(os.path.join(tmp_dir, '.birdsongrec-cache')))
+
+    def test_AnnotationIndex(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        index = birdsongrec.get_annotation_index(xml_file)
+        self.assertTrue(index is birdsongrec.get_annotation_index(xml_file))
+        seq_list = birdsongrec.parse_xml(xml_file, concat_seqs_into_songs=True)
+        self.assertEqual(len(index), len(seq_list))
+
+        song = index.load('0.wav')
+        self.assertTrue(type(song) == birdsongrec.Sequence)
+        self.assertEqual([syl.position for syl in song.syls],
+                         [syl.position for syl in seq_list[0].syls])
+        # lookups return new objects, so changing them doesn't change later lookups
+        song.syls[0].position += 1000
+        self.assertEqual(index.load('0.wav').syls[0].position, seq_list[0].syls[0].position)
+
+        seqs = index.load('0.wav', concat_seqs=False)
+        self.assertTrue(all([type(seq) == birdsongrec.Sequence for seq in seqs]))
+        self.assertEqual(sum([seq.length for seq in seqs]), song.length)
+        self.assertFalse('not-a-file.wav' in index)
+        self.assertEqual(index.load('not-a-file.wav'), [])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xml_copy = os.path.join(tmp_dir, 'Annotation.xml')
+            shutil.copy(xml_file, xml_copy)
+            index_copy = birdsongrec.get_annotation_index(xml_copy)
+            self.assertTrue(index_copy is not index)
+            tree = ET.parse(xml_copy)
+            tree.getroot().remove(tree.getroot().find('Sequence'))
+            tree.write(xml_copy)
+            # new index when file changes
+            os.utime(xml_copy, ns=(0, 0))
+            self.assertEqual(birdsongrec.get_annotation_index(xml_copy).load('0.wav').length,
+                             song.length - seqs[0].length)
+
+    def test_load_dataset(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        bird0_annot = birdsongrec.AnnotationTable.from_xml(xml_file)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for bird_id in ('Bird0', 'Bird1'):
+                bird_dir = os.path.join(tmp_dir, bird_id)
+                os.makedirs(os.path.join(bird_dir, 'Wave'))
+                shutil.copy(xml_file, bird_dir)
+            for wav_file in bird0_annot.wav_files.tolist():
+                open(os.path.join(tmp_dir, 'Bird0', 'Wave', wav_file), 'w').close()
+
+            for max_workers in (1, 2):
+                catalog = birdsongrec.load_dataset(tmp_dir, max_workers=max_workers)
+                self.assertEqual(catalog.bird_ids.tolist(), ['Bird0', 'Bird1'])
+                self.assertEqual(catalog.table.num_seqs, 2 * bird0_annot.num_seqs)
+                self.assertEqual(catalog.table.num_syls, 2 * bird0_annot.num_syls)
+                self.assertEqual(catalog.wav_paths.shape[0], 2 * bird0_annot.wav_files.shape[0])
+                self.assertEqual(catalog.seq_bird_ids.tolist(),
+                                 ['Bird0'] * bird0_annot.num_seqs + ['Bird1'] * bird0_annot.num_seqs)
+                for bird_id in ('Bird0', 'Bird1'):
+                    bird_annot = catalog.bird(bird_id)
+                    self.assertTrue(np.array_equal(bird_annot.syl_label_codes,
+                                                   bird0_annot.syl_label_codes))
+                    self.assertEqual(bird_annot.wav_files[0],
+                                     os.path.join(tmp_dir, bird_id, 'Wave', '0.wav'))
+                self.assertEqual(
+                    catalog.table.labels[catalog.table.syl_label_codes].tolist(),
+                    bird0_annot.syl_labels.tolist() * 2
+                )
+
+            with self.assertRaises(FileNotFoundError):
+                # no .wav files for Bird1
+                birdsongrec.load_dataset(tmp_dir, max_workers=1, validate_wav_files=True)
+            shutil.rmtree(os.path.join(tmp_dir, 'Bird1'))
+            catalog = birdsongrec.load_dataset(tmp_dir, max_workers=1, validate_wav_files=True)
+            self.assertEqual(catalog.bird_ids.tolist(), ['Bird0'])
+
+            with self.assertRaises(ValueError):
+                birdsongrec.load_dataset(os.path.join(tmp_dir, 'Bird0'))
+
+    def test_WavFile(self):
+        wav_path = os.path.join(self.test_data_dir, 'Wave', '0.wav')
+        with wave.open(wav_path, 'rb') as wav_fp:
+            expected = np.frombuffer(wav_fp.readframes(wav_fp.getnframes()), dtype='<i2')
+            samplerate = wav_fp.getframerate()
+        wav = birdsongrec.open_wav(wav_path)
+        self.assertTrue(wav is birdsongrec.open_wav(wav_path))
+        self.assertEqual(wav.samplerate, samplerate)
+        self.assertEqual(wav.num_samples, expected.shape[0])
+        self.assertTrue(isinstance(wav.data, np.memmap))
+        self.assertTrue(np.array_equal(wav.data, expected))
+        self.assertTrue(np.array_equal(wav.read(100, 50), expected[100:150]))
+        with self.assertRaises(ValueError):
+            wav.read(expected.shape[0] - 10, 20)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stereo_path = os.path.join(tmp_dir, 'stereo.wav')
+            stereo = np.arange(200, dtype='<i2').reshape(100, 2)
+            with wave.open(stereo_path, 'wb') as wav_fp:
+                wav_fp.setnchannels(2)
+                wav_fp.setsampwidth(2)
+                wav_fp.setframerate(32000)
+                wav_fp.writeframes(stereo.tobytes())
+            self.assertTrue(np.array_equal(birdsongrec.WavFile(stereo_path).data, stereo))
+            not_wav_path = os.path.join(tmp_dir, 'not.wav')
+            with open(not_wav_path, 'wb') as fp:
+                fp.write(b'not a wav file')
+            with self.assertRaises(ValueError):
+                birdsongrec.WavFile(not_wav_path)
+
+    def test_AudioReader(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        reader = birdsongrec.AudioReader(os.path.join(self.test_data_dir, 'Wave'))
+        seq_list = birdsongrec.parse_xml(xml_file)[:10]
+        with wave.open(os.path.join(self.test_data_dir, 'Wave', '0.wav'), 'rb') as wav_fp:
+            audio = np.frombuffer(wav_fp.readframes(wav_fp.getnframes()), dtype='<i2')
+        seq = seq_list[0]
+        self.assertTrue(np.array_equal(reader.sequence(seq),
+                                       audio[seq.position:seq.position + seq.length]))
+        syl = seq.syls[0]
+        start = seq.position + syl.position
+        self.assertTrue(np.array_equal(reader.syllable(seq, syl), audio[start:start + syl.length]))
+        self.assertTrue(np.array_equal(reader.song('0.wav'), audio))
+
+        song = birdsongrec.parse_xml(xml_file, concat_seqs_into_songs=True)[0]
+        self.assertTrue(np.array_equal(reader.syllable(song, song.syls[0], relative=False),
+                                       reader.syllable(seq, syl)))
+
+        annot = birdsongrec.AnnotationTable.from_xml(xml_file)
+        syl_ids = np.arange(0, annot.num_syls, 97)
+        windows, lengths = reader.gather_syllables(annot, syl_ids)
+        self.assertEqual(windows.shape, (syl_ids.shape[0], lengths.max()))
+        for window, length, syl_id in zip(windows, lengths, syl_ids):
+            seq_view = annot.sequence(annot.syl_seq_ids[syl_id])
+            syl_start = seq_view.position + annot.syl_positions[syl_id]
+            expected = reader.song(seq_view.wav_file)[syl_start:syl_start + length]
+            self.assertTrue(np.array_equal(window[:length], expected))
+            self.assertTrue(np.all(window[length:] == 0))
+        # preallocated output
+        out = np.ones((syl_ids.shape[0], lengths.max() + 10), dtype=np.float32)
+        reader.gather_syllables(annot, syl_ids, out=out)
+        self.assertTrue(np.array_equal(out[:, :lengths.max()], windows))
+        self.assertTrue(np.all(out[:, lengths.max():] == 0))
+        with self.assertRaises(ValueError):
+            reader.gather_syllables(annot, syl_ids, out=np.zeros((1, 1)))
+
+    def test_spectrogram(self):
+        rng = np.random.default_rng(5)
+        audio_list = [rng.standard_normal(length) for length in (1000, 300, 2048)]
+        window = np.hanning(257)[:-1]
+        spects = birdsongrec.spectrograms(audio_list, nperseg=256, noverlap=128)
+        self.assertEqual([spect.shape for spect in spects],
+                         [(6, 129), (1, 129), (15, 129)])
+        for audio, spect in zip(audio_list, spects):
+            for ind in range(spect.shape[0]):
+                frame = audio[ind * 128:ind * 128 + 256] * window
+                expected = np.log(np.maximum(np.abs(np.fft.rfft(frame)), 1e-10))
+                self.assertTrue(np.allclose(spect[ind], expected, rtol=1e-4, atol=1e-4))
+        self.assertEqual(birdsongrec.spectrogram(np.zeros(100)).shape, (0, 257))
+        self.assertEqual(birdsongrec.spectrograms([]), [])
+        with self.assertRaises(ValueError):
+            birdsongrec.spectrogram(audio_list[0], nperseg=256, noverlap=256)
+
+    def test_SpectrogramCache(self):
+        wav_dir = os.path.join(self.test_data_dir, 'Wave')
+        seq_list = birdsongrec.parse_xml(os.path.join(self.test_data_dir, 'Annotation.xml'))
+        wav_files = sorted(set([seq.wav_file for seq in seq_list]))[:4]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spect_cache = birdsongrec.SpectrogramCache(tmp_dir, wav_dir=wav_dir)
+            self.assertEqual(spect_cache.compute(wav_files, max_workers=2, batch_size=2), 4)
+            self.assertTrue(all([wav_file in spect_cache for wav_file in wav_files]))
+            # already computed
+            self.assertEqual(spect_cache.compute(wav_files + wav_files, max_workers=1), 0)
+            for wav_file in wav_files:
+                spect = spect_cache.song(wav_file)
+                self.assertTrue(isinstance(spect, np.memmap))
+                audio = birdsongrec.open_wav(os.path.join(wav_dir, wav_file)).data
+                self.assertTrue(np.array_equal(spect, birdsongrec.spectrogram(audio)))
+            seq = [seq for seq in seq_list if seq.wav_file == wav_files[0]][0]
+            start, stop = spect_cache.frame_range(seq.position, seq.length)
+            self.assertTrue(np.array_equal(spect_cache.sequence(seq),
+                                           spect_cache.song(seq.wav_file)[start:stop]))
+            self.assertTrue(start * spect_cache.hop >= seq.position)
+            self.assertTrue((stop - 1) * spect_cache.hop < seq.position + seq.length)
+
+            # different parameters are a different entry, computed on load
+            other_cache = birdsongrec.SpectrogramCache(tmp_dir, nperseg=256, noverlap=0,
+                                                       wav_dir=wav_dir)
+            self.assertFalse(wav_files[0] in other_cache)
+            self.assertEqual(other_cache.load(wav_files[0]).shape[1], 129)
+            self.assertEqual(len(os.listdir(tmp_dir)), 5)
+
+            # least recently used entries are removed,
+            # but files that are not entries are never removed
+            with open(os.path.join(tmp_dir, 'important.npy'), 'wb') as fp:
+                fp.write(b'0' * 1000)
+            os.makedirs(os.path.join(tmp_dir, 'Bird0'))
+            small_cache = birdsongrec.SpectrogramCache(tmp_dir, wav_dir=wav_dir, max_bytes=1)
+            small_cache._evict()
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['Bird0', 'important.npy'])
+            # entry that is loaded is not removed
+            self.assertEqual(small_cache.load(wav_files[0]).shape,
+                             spect_cache.song(wav_files[0]).shape)
+            spect_cache.clear()
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['Bird0', 'important.npy'])
+            # directory is removed only if empty
+            os.remove(os.path.join(tmp_dir, 'important.npy'))
+            os.rmdir(os.path.join(tmp_dir, 'Bird0'))
+            spect_cache.clear()
+            self.assertFalse(os.path.exists(tmp_dir))
+            os.makedirs(tmp_dir)
+
+    def test_frame_labels(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        songs = birdsongrec.parse_xml(xml_file, concat_seqs_into_songs=True)
+        labels = np.array(list(birdsongrec.birdsongrec.determine_unique_labels(xml_file)))
+        frame_size, hop = 512, 200
+
+        def loop_frame_labels(song, num_samples):
+            # label each frame with syllable that contains its center, one frame at a time
+            num_frames = max(0, (num_samples - frame_size) // hop + 1)
+            label_vec = np.full((num_frames,), len(labels))
+            for ind in range(num_frames):
+                center = ind * hop + frame_size // 2
+                for syl in song.syls:
+                    if syl.position <= center < syl.position + syl.length:
+                        label_vec[ind] = labels.tolist().index(syl.label)
+            return label_vec
+
+        num_samples = {song.wav_file: song.position + song.length + 1000 for song in songs}
+        annot = birdsongrec.AnnotationTable.from_xml(xml_file)
+        for songs_arg in (songs, annot):
+            wav_files, label_vecs = birdsongrec.frame_labels(
+                songs_arg, frame_size=frame_size, hop=hop, num_samples=num_samples)
+            self.assertEqual(wav_files, [song.wav_file for song in songs])
+            for song, label_vec in zip(songs[:20], label_vecs):
+                self.assertTrue(np.array_equal(label_vec,
+                                               loop_frame_labels(song, num_samples[song.wav_file])))
+
+        # streaming gives same vectors
+        streamed = list(birdsongrec.iter_frame_labels(
+            birdsongrec.iter_xml(xml_file, concat_seqs_into_songs=True), labels,
+            frame_size=frame_size, hop=hop, num_samples=num_samples))
+        self.assertEqual([wav_file for wav_file, _ in streamed], wav_files)
+        self.assertTrue(all([np.array_equal(streamed_vec, label_vec)
+                             for (_, streamed_vec), label_vec in zip(streamed, label_vecs)]))
+        streamed = list(birdsongrec.iter_frame_labels(annot, labels, frame_size=frame_size,
+                                                      hop=hop, num_samples=num_samples))
+        self.assertTrue(all([np.array_equal(streamed_vec, label_vec)
+                             for (_, streamed_vec), label_vec in zip(streamed, label_vecs)]))
+
+        # default number of frames ends with last syllable, background code can be set
+        _, label_vecs = birdsongrec.frame_labels(annot, background=-1)
+        last_syl = songs[0].syls[-1]
+        self.assertEqual(label_vecs[0].shape[0],
+                         birdsongrec.num_frames(last_syl.position + last_syl.length))
+        self.assertTrue(all([np.array_equal(streamed_vec, label_vec) for (_, streamed_vec), label_vec
+                             in zip(birdsongrec.iter_frame_labels(songs, labels, background=-1),
+                                    label_vecs)]))
+        self.assertEqual(label_vecs[0].min(), -1)
+        # codes are indices into labels passed in
+        _, label_vecs = birdsongrec.frame_labels(annot, labels=labels[::-1], background=-1)
+        syl_frames = label_vecs[0] != -1
+        _, default_vecs = birdsongrec.frame_labels(annot, background=-1)
+        self.assertTrue(np.array_equal(label_vecs[0][syl_frames],
+                                       len(labels) - 1 - default_vecs[0][syl_frames]))
+        with self.assertRaises(ValueError):
+            birdsongrec.frame_labels(annot, labels=labels[1:])
+
+    def test_stats(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        seq_list = birdsongrec.parse_xml(xml_file)
+        num_syls = sum([seq.num_syls for seq in seq_list])
+        self.assertTrue(birdsongrec.get_stats() is None)
+
+        stage_calls = []
+        stats = birdsongrec.Stats()
+        stats.add_callback(lambda stage, seconds: stage_calls.append(stage))
+        with birdsongrec.collect_stats(stats) as collected:
+            self.assertTrue(collected is stats)
+            self.assertTrue(birdsongrec.get_stats() is stats)
+            songs = birdsongrec.parse_xml(xml_file, concat_seqs_into_songs=True)
+            trans_mat = birdsongrec.get_trans_mat(songs)
+        self.assertTrue(birdsongrec.get_stats() is None)
+        self.assertEqual(stats.counters['sequences_parsed'], len(seq_list))
+        self.assertEqual(stats.counters['syllables_parsed'], num_syls)
+        self.assertEqual(stats.counters['syllables_counted'], num_syls)
+        self.assertEqual(stats.peak_bytes['get_trans_mat.trans_mat'], trans_mat.nbytes)
+        for stage in ('parse_xml', 'parse_xml.read_xml', 'parse_xml.make_objects',
+                      'parse_xml.concat_seqs_into_songs', 'get_trans_mat',
+                      'get_trans_mat.count_trigrams'):
+            self.assertTrue(stage in stats.seconds)
+            self.assertTrue(0 <= stats.self_seconds[stage] <= stats.seconds[stage])
+        self.assertEqual(stats.calls['parse_xml'], 1)
+        self.assertEqual(stats.calls['parse_xml.concat_seqs_into_songs'], len(songs) + 1)
+        # nested stages are not counted in self time of the stage they are in
+        nested = sum([stats.seconds[stage] for stage in stats.seconds
+                      if stage.startswith('get_trans_mat.')])
+        self.assertAlmostEqual(stats.self_seconds['get_trans_mat'],
+                               stats.seconds['get_trans_mat'] - nested)
+        self.assertEqual(stage_calls.count('parse_xml'), 1)
+        self.assertEqual(stage_calls[-1], 'get_trans_mat')
+
+        # disabled, nothing is collected
+        stats.reset()
+        birdsongrec.parse_xml(xml_file)
+        self.assertEqual(stats.to_dict(), {'seconds': {}, 'self_seconds': {}, 'calls': {},
+                                           'counters': {}, 'peak_bytes': {}})
+
+        labels = birdsongrec.birdsongrec.determine_unique_labels(xml_file)
+        resequencer = birdsongrec.Resequencer(trans_mat, labels)
+        beam_resequencer = birdsongrec.Resequencer(trans_mat, labels, beam_width=5)
+        rng = np.random.default_rng(3)
+        obs = [rng.dirichlet(np.ones(len(labels)), size=length) for length in (20, 30)]
+        stats = birdsongrec.enable_stats()
+        try:
+            resequencer.resequence_batch(obs)
+            dense_expanded = stats.counters['states_expanded']
+            beam_resequencer.resequence(obs[0])
+            birdsongrec.load_song_annot(seq_list[0].wav_file, xml_file)
+        finally:
+            self.assertTrue(birdsongrec.disable_stats() is stats)
+        self.assertEqual(stats.counters['frames_decoded'], 20 + 30 + 20)
+        self.assertEqual(stats.counters['sequences_decoded'], 3)
+        num_pair_states = (len(labels) + 1) * len(labels)
+        self.assertEqual(dense_expanded, (19 + 29) * num_pair_states)
+        self.assertTrue(stats.counters['states_expanded'] - dense_expanded <= 19 * 5)
+        self.assertEqual(stats.counters['songs_loaded'], 1)
+        for stage in ('Resequencer.resequence_batch', 'Resequencer.resequence',
+                      'Resequencer.viterbi', 'Resequencer.traceback', 'load_song_annot'):
+            self.assertTrue(stage in stats.seconds)
+        self.assertTrue(stats.peak_bytes['Resequencer.backpointers'] > 0)
+
+    def test_slots_and_trusted_construction(self):
+        syl = birdsongrec.Syllable(position=32000, length=3200, label='0')
+        seq = birdsongrec.Sequence(wav_file='0.wav', position=16000, length=120000,
+                                   syl_list=[syl])
+        for obj in (syl, seq):
+            self.assertFalse(hasattr(obj, '__dict__'))
+            with self.assertRaises(AttributeError):
+                obj.not_an_attribute = 1
+        with self.assertRaises(TypeError):
+            birdsongrec.Sequence(wav_file='0.wav', position=16000, length=120000,
+                                 syl_list=[syl, 'not a syllable'])
+
+        trusted = birdsongrec.Sequence._from_columns('0.wav', 16000, 120000,
+                                                     [32000, 64000], [3200, 3300], ['0', '1'])
+        self.assertEqual(type(trusted), birdsongrec.Sequence)
+        self.assertEqual(trusted.num_syls, 2)
+        self.assertEqual([(s.position, s.length, s.label) for s in trusted.syls],
+                         [(32000, 3200, '0'), (64000, 3300, '1')])
+        self.assertTrue(all([type(s) == birdsongrec.Syllable for s in trusted.syls]))
+
+        # parser and AnnotationTable make the same objects as the checked constructors
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        for seq_list in (birdsongrec.parse_xml(xml_file),
+                         birdsongrec.AnnotationTable.from_xml(xml_file).to_seqs()):
+            for seq in seq_list[:50]:
+                checked = birdsongrec.Sequence(
+                    seq.wav_file, seq.position, seq.length,
+                    [birdsongrec.Syllable(s.position, s.length, s.label) for s in seq.syls]
+                )
+                self.assertEqual((seq.wav_file, seq.position, seq.length, seq.num_syls),
+                                 (checked.wav_file, checked.position, checked.length,
+                                  checked.num_syls))
+
+        # missing label still raises the same error as the constructor
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bad_xml = os.path.join(tmp_dir, 'Annotation.xml')
+            with open(bad_xml, 'w') as fp:
+                fp.write('<Sequences><NumSequence>1</NumSequence><Sequence>'
+                         '<WaveFileName>0.wav</WaveFileName><Position>0</Position>'
+                         '<Length>10</Length><NumNote>1</NumNote><Note><Position>0</Position>'
+                         '<Length>5</Length></Note></Sequence></Sequences>')
+            with self.assertRaises(TypeError):
+                birdsongrec.parse_xml(bad_xml)
+            # and the table does not turn it into the label 'None'
+            with self.assertRaises(TypeError):
+                birdsongrec.AnnotationTable.from_xml(bad_xml)
+
+    def test_SongIndex(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        seq_list = birdsongrec.parse_xml(xml_file)
+        seq_positions = [(seq.position, [syl.position for syl in seq.syls]) for seq in seq_list]
+        expected = birdsongrec.parse_xml(xml_file, concat_seqs_into_songs=True)
+
+        songs = birdsongrec.SongIndex(seq_list)
+        self.assertEqual(len(songs), len(expected))
+        self.assertEqual(songs.wav_files, [song.wav_file for song in expected])
+        for song, expected_song in zip(songs, expected):
+            self.assertEqual((song.wav_file, song.position, song.length, song.num_syls),
+                             (expected_song.wav_file, expected_song.position,
+                              expected_song.length, expected_song.num_syls))
+            self.assertEqual(song.syl_positions,
+                             [syl.position for syl in expected_song.syls])
+            # syllables are the same objects as in the sequences, not copies
+            self.assertTrue(all([syl is seq_syl for syl, seq_syl in zip(
+                song.syls, [syl for seq in song.seqs for syl in seq.syls])]))
+            song_seq = song.to_sequence()
+            self.assertEqual([(syl.position, syl.length, syl.label) for syl in song_seq.syls],
+                             [(syl.position, syl.length, syl.label)
+                              for syl in expected_song.syls])
+        # sequences are not changed
+        self.assertEqual([(seq.position, [syl.position for syl in seq.syls])
+                          for seq in seq_list], seq_positions)
+        # song attributes are computed once
+        song = songs[0]
+        self.assertTrue(song.syls is song.syls)
+        self.assertEqual(song.length, sum([seq.length for seq in song.seqs]))
+        # concatenating into songs makes new objects
+        concat = list(birdsongrec.birdsongrec._concat_seqs_into_songs(seq_list))
+        self.assertEqual(len(concat), len(expected))
+        self.assertFalse(any([song_seq is seq for song_seq in concat for seq in seq_list]))
+        self.assertEqual([(seq.position, [syl.position for syl in seq.syls])
+                          for seq in seq_list], seq_positions)
+        # songs are made once
+        self.assertTrue(songs['0.wav'] is songs[0])
+        self.assertTrue(songs.song_of(0) is songs[0])
+        self.assertEqual(songs.song_seq_ids('0.wav'),
+                         [seq_id for seq_id, seq in enumerate(seq_list) if seq.wav_file == '0.wav'])
+        self.assertTrue('0.wav' in songs)
+        self.assertFalse('not_a_song.wav' in songs)
+        self.assertEqual(len(songs.to_seqs()), len(expected))
+
+        # sequences from the same .wav file do not have to be next to each other
+        shuffled = seq_list[1:] + seq_list[:1]
+        songs = birdsongrec.SongIndex(shuffled)
+        self.assertEqual(songs['0.wav'].seqs[-1], seq_list[0])
+        self.assertEqual(sorted(songs['0.wav'].syl_positions),
+                         [syl.position for syl in expected[0].syls])
+
+    def test_resequence_nbest(self):
+        num_labels = 3
+        labels = list('abc')
+        rng = np.random.default_rng(11)
+        trans_mat = rng.random((num_labels, num_labels, num_labels)) ** 2
+        trans_mat /= trans_mat.sum(axis=2, keepdims=True)
+        resequencer = birdsongrec.Resequencer(trans_mat, labels)
+        log_init = np.log(resequencer.initial_transition_prob)
+
+        for length in (1, 2, 5):
+            observation_probs = rng.dirichlet(np.ones(num_labels), size=length)
+            # score every sequence of labels
+            all_scores = []
+            for seq in itertools.product(range(num_labels), repeat=length):
+                score = log_init + np.log(observation_probs[0, seq[0]])
+                for time_step in range(1, length):
+                    if time_step == 1:
+                        score += log_init
+                    else:
+                        score += np.log(trans_mat[seq[time_step - 2], seq[time_step - 1],
+                                                  seq[time_step]])
+                    score += np.log(observation_probs[time_step, seq[time_step]])
+                all_scores.append((score, [labels[label] for label in seq]))
+            all_scores.sort(key=lambda score_seq: -score_seq[0])
+
+            resequenced, log_scores = resequencer.resequence_nbest(observation_probs, k=6)
+            self.assertEqual(resequenced[0], resequencer.resequence(observation_probs))
+            num_expected = min(6, len(all_scores))
+            self.assertEqual(len(resequenced), num_expected)
+            self.assertTrue(np.allclose(log_scores,
+                                        [score for score, _ in all_scores[:num_expected]]))
+            self.assertEqual(resequenced, [seq for _, seq in all_scores[:num_expected]])
+            self.assertEqual(len(set([tuple(seq) for seq in resequenced])), num_expected)
+
+        # best path is the same as resequence, with larger label set and longer sequence
+        trans_mat = birdsongrec.get_trans_mat(
+            birdsongrec.parse_xml(os.path.join(self.test_data_dir, 'Annotation.xml')))
+        labels = list(birdsongrec.birdsongrec.determine_unique_labels(
+            os.path.join(self.test_data_dir, 'Annotation.xml')))
+        resequencer = birdsongrec.Resequencer(trans_mat, labels)
+        observation_probs = rng.dirichlet(np.ones(len(labels)), size=50)
+        resequenced, log_scores = resequencer.resequence_nbest(observation_probs, k=4)
+        self.assertEqual(resequenced[0], resequencer.resequence(observation_probs))
+        self.assertEqual(log_scores[0],
+                         resequencer.evaluate_beam(observation_probs)['exact_log_score'])
+        self.assertTrue(np.all(np.diff(log_scores) <= 0))
+
+        # zero probabilities leave fewer sequences
+        observation_probs = np.zeros((3, len(labels)))
+        observation_probs[:, 0] = 1.
+        observation_probs[1, 1] = 1.
+        resequenced, log_scores = resequencer.resequence_nbest(observation_probs, k=5)
+        self.assertEqual(len(resequenced), 2)
+        with self.assertRaises(ValueError):
+            resequencer.resequence_nbest(observation_probs, k=0)
+
+    def test_segment_observations(self):
+        observation_probs = np.array([[0.9, 0.1], [0.8, 0.2], [0.3, 0.7], [0.35, 0.65],
+                                      [0.6, 0.4]])
+        onsets, lengths = birdsongrec.segment_observations(observation_probs)
+        self.assertEqual(onsets.tolist(), [0, 2, 4])
+        self.assertEqual(lengths.tolist(), [2, 2, 1])
+        onsets, lengths = birdsongrec.segment_observations(observation_probs, method='threshold',
+                                                           threshold=0.2)
+        self.assertEqual(onsets.tolist(), [0, 2, 4])
+        onsets, lengths = birdsongrec.segment_observations(observation_probs, method='threshold',
+                                                           threshold=0.01)
+        self.assertEqual(onsets.tolist(), [0, 1, 2, 3, 4])
+        with self.assertRaises(ValueError):
+            birdsongrec.segment_observations(observation_probs, method='not_a_method')
+
+    def test_resequence_segments(self):
+        num_labels = 3
+        labels = list('abc')
+        rng = np.random.default_rng(13)
+        trans_mat = rng.random((num_labels, num_labels, num_labels)) ** 2
+        trans_mat /= trans_mat.sum(axis=2, keepdims=True)
+        resequencer = birdsongrec.Resequencer(trans_mat, labels)
+        log_init = np.log(resequencer.initial_transition_prob)
+
+        def path_score(label_codes, observation_probs):
+            score = log_init + np.log(observation_probs[0, label_codes[0]])
+            for time_step in range(1, len(label_codes)):
+                if time_step == 1:
+                    score += log_init
+                else:
+                    score += np.log(trans_mat[label_codes[time_step - 2],
+                                              label_codes[time_step - 1],
+                                              label_codes[time_step]])
+                score += np.log(observation_probs[time_step, label_codes[time_step]])
+            return score
+
+        for _ in range(20):
+            observation_probs = rng.dirichlet(np.full(num_labels, 0.5), size=rng.integers(1, 8))
+            # segments of one frame give same result as decoding frames
+            self.assertEqual(
+                resequencer.resequence_segments(observation_probs, method='threshold',
+                                                threshold=-1.),
+                resequencer.resequence(observation_probs)
+            )
+            # best path with the same label for all frames in each segment
+            onsets, lengths = birdsongrec.segment_observations(observation_probs)
+            best_score = max([
+                path_score(np.repeat(segment_labels, lengths), observation_probs)
+                for segment_labels in itertools.product(range(num_labels), repeat=len(onsets))
+            ])
+            resequenced = resequencer.resequence_segments(observation_probs)
+            self.assertAlmostEqual(
+                path_score([labels.index(label) for label in resequenced], observation_probs),
+                best_score
+            )
+
+        # long runs of similar frames are decoded as a few segments
+        true_codes = np.repeat(rng.integers(num_labels, size=20), rng.integers(10, 40, size=20))
+        logits = rng.standard_normal((true_codes.shape[0], num_labels)) * 0.3
+        logits[np.arange(true_codes.shape[0]), true_codes] += 3.
+        observation_probs = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+        segments_eval = resequencer.evaluate_segments(observation_probs)
+        self.assertTrue(segments_eval['compression'] > 5)
+        self.assertEqual(segments_eval['resequenced'],
+                         resequencer.resequence_segments(observation_probs))
+        self.assertEqual(len(segments_eval['resequenced']), true_codes.shape[0])
+        self.assertTrue(0 <= segments_eval['label_error_rate'] <= 1)
+
+        segment_labels, onsets, lengths = resequencer.resequence_segments(
+            observation_probs, return_segments=True)
+        self.assertEqual(np.repeat(np.array(segment_labels), lengths).tolist(),
+                         segments_eval['resequenced'])
+        self.assertEqual(onsets.tolist(), (np.cumsum(lengths) - lengths).tolist())
+        self.assertTrue(all([label_one != label_two for label_one, label_two
+                             in zip(segment_labels[:-1], segment_labels[1:])]))
+
+    def test_SparseTransitionMatrix(self):
+        xml_file = os.path.join(self.test_data_dir, 'Annotation.xml')
+        seq_list = birdsongrec.parse_xml(xml_file)
+        labels = list(birdsongrec.birdsongrec.determine_unique_labels(xml_file))
+        for smoothing_constant in (1e-4, 0.5, 0):
+            dense = birdsongrec.get_trans_mat(seq_list, smoothing_constant)
+            sparse = birdsongrec.get_trans_mat(seq_list, smoothing_constant, sparse=True)
+            self.assertIsInstance(sparse, birdsongrec.SparseTransitionMatrix)
+            self.assertEqual(sparse.shape, dense.shape)
+            # values are identical, not just close
+            self.assertTrue(np.array_equal(sparse.to_dense(), dense))
+            self.assertTrue(np.array_equal(
+                birdsongrec.TransitionCounts.from_seqs(seq_list).trans_mat(
+                    smoothing_constant, sparse=True).to_dense(),
+                dense
+            ))
+        self.assertLess(sparse.nbytes, dense.nbytes)
+        self.assertEqual(sparse.trigrams.shape, (sparse.indices.shape[0], 3))
+        self.assertTrue(np.all(dense[tuple(sparse.trigrams.T)] > 0))
+        for key in [(0, 0, 0), (1, 2, 3), tuple(sparse.trigrams[0]), (-1, 0, -2)]:
+            self.assertEqual(sparse[key], dense[key])
+        with self.assertRaises(IndexError):
+            sparse[0, 0, len(labels)]
+        with self.assertRaises(IndexError):
+            sparse[0, 0]
+
+        dense_resequencer = birdsongrec.Resequencer(birdsongrec.get_trans_mat(seq_list), labels)
+        sparse_resequencer = birdsongrec.Resequencer(
+            birdsongrec.get_trans_mat(seq_list, sparse=True), labels
+        )
+        rng = np.random.default_rng(17)
+        observation_probs = [rng.dirichlet(np.full(len(labels), 0.3), size=length)
+                             for length in (1, 2, 30, 100)]
+        self.assertEqual(sparse_resequencer.resequence_batch(observation_probs),
+                         dense_resequencer.resequence_batch(observation_probs))
+        for obs in observation_probs:
+            self.assertEqual(sparse_resequencer.resequence(obs),
+                             dense_resequencer.resequence(obs))
+            self.assertEqual(sparse_resequencer.resequence_segments(obs),
+                             dense_resequencer.resequence_segments(obs))
+        self.assertEqual(
+            sparse_resequencer.resequence(observation_probs[2][:10], engine='reference'),
+            dense_resequencer.resequence(observation_probs[2][:10])
+        )
+        # dense table is made when needed
+        self.assertTrue(np.array_equal(sparse_resequencer.log_transition_probs,
+                                       dense_resequencer.log_transition_probs))
+
+    def test_backends(self):
+        previous = birdsongrec.get_backend()
+        self.assertIn(previous.name, ('numpy', 'numba'))
+        try:
+            for name in ('numpy', 'numba'):
+                try:
+                    backend = birdsongrec.set_backend(name)
+                except ImportError:
+                    # Numba is not installed
+                    continue
+                with self.subTest(backend=name):
+                    self.assertIs(birdsongrec.get_backend(), backend)
+                    self.assertEqual(backend.name, name)
+                    # same tests against the reference code for every backend
+                    self.test_get_trans_mat()
+                    self.test_TransitionCounts()
+                    self.test_resequence_engines_equivalent()
+                    self.test_resequence_batch()
+
+            # add a backend that overrides one kernel
+            class CountingBackend(birdsongrec.NumpyBackend):
+                name = 'counting'
+                num_calls = 0
+
+                def count_trigrams(self, label_codes, seq_lengths, num_labels):
+                    CountingBackend.num_calls += 1
+                    return super().count_trigrams(label_codes, seq_lengths, num_labels)
+
+            birdsongrec.register_backend(CountingBackend)
+            birdsongrec.set_backend('counting')
+            seq_list = birdsongrec.parse_xml(os.path.join(self.test_data_dir, 'Annotation.xml'))
+            trans_mat = birdsongrec.get_trans_mat(seq_list)
+            self.assertEqual(CountingBackend.num_calls, 1)
+            birdsongrec.set_backend('numpy')
+            self.assertTrue(np.array_equal(trans_mat, birdsongrec.get_trans_mat(seq_list)))
+
+            with self.assertRaises(ValueError):
+                birdsongrec.set_backend('not-a-backend')
+            with self.assertRaises(TypeError):
+                birdsongrec.register_backend(object)
+        finally:
+            birdsongrec.birdsongrec._BACKENDS.pop('counting', None)
+            birdsongrec.birdsongrec._backend = previous
+
+    def test_edit_distance(self):
+        def levenshtein(hyp, ref):
+            distances = list(range(len(ref) + 1))
+            for hyp_ind, hyp_label in enumerate(hyp, 1):
+                previous, distances[0] = distances[0], hyp_ind
+                for ref_ind, ref_label in enumerate(ref, 1):
+                    previous, distances[ref_ind] = distances[ref_ind], min(
+                        distances[ref_ind] + 1, distances[ref_ind - 1] + 1,
+                        previous + (hyp_label != ref_label)
+                    )
+            return distances[-1]
+
+        rng = np.random.default_rng(19)
+        hyps = [list(rng.choice(list('abcd'), size=rng.integers(0, 12))) for _ in range(60)]
+        refs = [list(rng.choice(list('abcde'), size=rng.integers(0, 12))) for _ in range(60)]
+        expected = [levenshtein(hyp, ref) for hyp, ref in zip(hyps, refs)]
+        self.assertEqual(birdsongrec.edit_distance(hyps, refs).tolist(), expected)
+        # in small batches, in a pool of processes
+        self.assertEqual(
+            birdsongrec.edit_distance(hyps, refs, max_workers=2, batch_size=8).tolist(), expected
+        )
+        self.assertEqual(birdsongrec.edit_distance(['kitten', []], ['sitting', ['a', 'b']]).tolist(),
+                         [3, 2])
+        self.assertEqual(birdsongrec.edit_distance([], []).tolist(), [])
+        with self.assertRaises(ValueError):
+            birdsongrec.edit_distance(hyps, refs[:-1])
+
+    def test_evaluate_songs(self):
+        refs = [list('--aaa--bb--'), list('cc-'), list('---')]
+        hyps = [list('--aa---bbb-'), list('cc-'), list('-c-')]
+        metrics = birdsongrec.evaluate_songs(hyps, refs, background='-', tolerance=0)
+        self.assertEqual(metrics['num_frames'].tolist(), [11, 3, 3])
+        self.assertEqual(metrics['num_frame_errors'].tolist(), [2, 0, 1])
+        self.assertEqual(metrics['num_syllables'].tolist(), [2, 1, 0])
+        self.assertEqual(metrics['num_hyp_syllables'].tolist(), [2, 1, 1])
+        self.assertEqual(metrics['edit_distances'].tolist(), [0, 0, 1])
+        # boundaries are 2, 5, 7, 9 in refs, and 2, 4, 7, 10 in hyps, of song 0
+        self.assertEqual(metrics['num_boundaries'].tolist(), [4, 2, 0])
+        self.assertEqual(metrics['num_hyp_boundaries'].tolist(), [4, 2, 2])
+        self.assertEqual(metrics['num_correct_boundaries'].tolist(), [2, 2, 0])
+        self.assertEqual(metrics['num_detected_boundaries'].tolist(), [2, 2, 0])
+        self.assertEqual(metrics['syllable_error_rate'], 1 / 3)
+        self.assertEqual(metrics['frame_error_rate'], 3 / 17)
+        self.assertEqual(metrics['boundary_precision'], 4 / 8)
+        self.assertEqual(metrics['boundary_recall'], 4 / 6)
+        self.assertTrue(np.isnan(metrics['song_syllable_error_rate'][2]))
+        self.assertEqual(metrics['song_frame_error_rate'].tolist()[:2], [2 / 11, 0.])
+
+        # boundaries one frame off are correct with tolerance of 1
+        metrics = birdsongrec.evaluate_songs(hyps, refs, background='-', tolerance=1,
+                                             max_workers=2, batch_size=1)
+        self.assertEqual(metrics['num_correct_boundaries'].tolist(), [4, 2, 0])
+        self.assertEqual(metrics['num_detected_boundaries'].tolist(), [4, 2, 0])
+        # without background, every run of frames is a syllable
+        metrics = birdsongrec.evaluate_songs(hyps, refs)
+        self.assertEqual(metrics['num_syllables'].tolist(), [5, 2, 1])
+
+        with self.assertRaises(ValueError):
+            birdsongrec.evaluate_songs(hyps, [list('--aaa--bb-'), list('cc-'), list('---')])
+        with self.assertRaises(ValueError):
+            birdsongrec.evaluate_songs(hyps, refs[:2])
+
+    def test_resequence_segments_zero_probabilities(self):
+        rng = np.random.default_rng(0)
+        trans_mat = rng.random((3, 3, 3))
+        trans_mat /= trans_mat.sum(axis=2, keepdims=True)
+        resequencer = birdsongrec.Resequencer(trans_mat, list('abc'))
+        # one-hot observations, so first frame of segments has probability zero
+        # for every other label
+        observation_probs = np.repeat(np.eye(3), 2, axis=0)
+        self.assertEqual(resequencer.resequence_segments(observation_probs),
+                         resequencer.resequence(observation_probs))
+        self.assertEqual(resequencer.resequence_segments(observation_probs), list('aabbcc'))
+
+        # transitions from a label to itself twice in a row have probability zero
+        label_range = np.arange(3)
+        trans_mat[label_range, label_range, label_range] = 0
+        trans_mat /= trans_mat.sum(axis=2, keepdims=True)
+        resequencer = birdsongrec.Resequencer(trans_mat, list('abc'))
+        observation_probs = np.array([[.8, .1, .1], [.8, .1, .1], [.1, .8, .1], [.1, .8, .1],
+                                      [.1, .1, .8]])
+        self.assertEqual(resequencer.resequence_segments(observation_probs),
+                         resequencer.resequence(observation_probs))
+        self.assertEqual(resequencer.resequence_segments(observation_probs), list('aabbc'))